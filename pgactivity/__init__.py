@@ -1,7 +1,19 @@
 from datetime import timedelta
 
-from pgactivity.core import cancel, pid, terminate, timeout
-from pgactivity.runtime import context
+from pgactivity.core import DeadlineExceeded, cancel, deadline, pid, signal, terminate, timeout
+from pgactivity.runtime import always_context, context
 from pgactivity.version import __version__
 
-__all__ = ["cancel", "context", "pid", "terminate", "timedelta", "timeout", "__version__"]
+__all__ = [
+    "always_context",
+    "cancel",
+    "context",
+    "deadline",
+    "DeadlineExceeded",
+    "pid",
+    "signal",
+    "terminate",
+    "timedelta",
+    "timeout",
+    "__version__",
+]
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+from pgactivity import core, registry, runtime, slow
+
+
+class PGActivityConfig(AppConfig):
+    name = "pgactivity"
+
+    def ready(self):
+        connection_created.connect(core.install, dispatch_uid="pgactivity.core.install")
+        connection_created.connect(runtime.install, dispatch_uid="pgactivity.install")
+        connection_created.connect(registry.install, dispatch_uid="pgactivity.registry.install")
+        connection_created.connect(slow.install, dispatch_uid="pgactivity.slow.install")
@@ -0,0 +1,82 @@
+"""Caching of expensive monitoring queries with single-flight refreshes"""
+
+import threading
+import time
+from typing import Any, Callable
+
+from django.core.cache import caches
+
+from pgactivity import config
+
+_locks = {}
+_locks_lock = threading.Lock()
+# How often processes check for a value refreshed by another process
+_poll_interval = 0.05
+
+
+def _local_lock(key: str) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def get_or_refresh(key: str, refresh: Callable[[], Any], timeout: float) -> Any:
+    """Return a cached value, refreshing it at most once per timeout.
+
+    Only one caller refreshes an expired value. Threads of the same process
+    wait for the refresh, and other processes are served the previous value
+    while the refresh is in progress. When there is no previous value, other
+    processes wait for the refresh. Values are stored in the cache from
+    ``settings.PGACTIVITY_CACHE``.
+
+    Args:
+        key: The cache key.
+        refresh: Computes the value.
+        timeout: The number of seconds the value is fresh.
+
+    Returns:
+        The cached or refreshed value.
+    """
+    cache = caches[config.cache()]
+    key = f"pgactivity:{key}"
+
+    def get_fresh():
+        entry = cache.get(key)
+        if entry is not None and time.time() - entry[0] < timeout:
+            return entry
+
+        return None
+
+    entry = get_fresh()
+    if entry is not None:
+        return entry[1]
+
+    with _local_lock(key):
+        # Another thread may have refreshed the value while this one waited
+        entry = get_fresh()
+        if entry is not None:
+            return entry[1]
+
+        # Ensure only one process refreshes the value. The lock expires with
+        # the timeout in case the process refreshing it dies
+        lock_key = f"{key}:lock"
+        acquired = cache.add(lock_key, True, timeout=max(timeout, 1))
+        if not acquired:
+            # Wait for the value of the process refreshing it until the lock is
+            # released. The value is only refreshed here if that process failed
+            entry = cache.get(key)
+            while entry is None and cache.get(lock_key) is not None:
+                time.sleep(_poll_interval)
+                entry = cache.get(key)
+
+            if entry is not None:
+                return entry[1]
+
+        try:
+            value = refresh()
+            # Stale values are kept around so that they can be served while
+            # other processes refresh them
+            cache.set(key, (time.time(), value), timeout=max(timeout * 10, 60))
+            return value
+        finally:
+            if acquired:
+                cache.delete(lock_key)
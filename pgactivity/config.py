@@ -1,9 +1,18 @@
 """Core way to access configuration"""
 
+import datetime as dt
+import functools
+
 from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
 from django.utils.module_loading import import_string
 
 
+def activity_cache_timeout():
+    """The number of seconds cached snapshots of activity are fresh"""
+    return getattr(settings, "PGACTIVITY_ACTIVITY_CACHE_TIMEOUT", 5)
+
+
 def attributes():
     return getattr(
         settings,
@@ -18,11 +27,64 @@ def attributes():
     )
 
 
+def cache():
+    """The name of the Django cache used for caching monitoring queries"""
+    return getattr(settings, "PGACTIVITY_CACHE", "default")
+
+
+def cancel_on_disconnect():
+    """True if the ASGI middleware cancels queries of requests after clients disconnect"""
+    return getattr(settings, "PGACTIVITY_CANCEL_ON_DISCONNECT", True)
+
+
 def configs():
     """Return pre-configured LS arguments"""
     return getattr(settings, "PGACTIVITY_CONFIGS", {})
 
 
+def context_databases():
+    """The database aliases that receive context.
+
+    Either a list of aliases or ``"__all__"``.
+    """
+    return getattr(settings, "PGACTIVITY_CONTEXT_DATABASES", [DEFAULT_DB_ALIAS])
+
+
+def context_key_aliases():
+    """Short aliases for context keys, reducing the size of the context comment"""
+    return getattr(settings, "PGACTIVITY_CONTEXT_KEY_ALIASES", {})
+
+
+def context_max_value_length():
+    """The maximum length of string values in the context comment"""
+    return getattr(settings, "PGACTIVITY_CONTEXT_MAX_VALUE_LENGTH", None)
+
+
+def context_max_bytes():
+    """The maximum size of the context comment in bytes"""
+    return getattr(settings, "PGACTIVITY_CONTEXT_MAX_BYTES", None)
+
+
+def context_transport():
+    """How context is sent to Postgres. Either "comment" or "application_name" """
+    return getattr(settings, "PGACTIVITY_CONTEXT_TRANSPORT", "comment")
+
+
+def context_sample_rate():
+    """The fraction of statements that receive context"""
+    return getattr(settings, "PGACTIVITY_CONTEXT_SAMPLE_RATE", None)
+
+
+def context_min_transaction_age():
+    """Statements in transactions older than this always receive context"""
+    return getattr(settings, "PGACTIVITY_CONTEXT_MIN_TRANSACTION_AGE", None)
+
+
+def history_retention():
+    """How long sampled activity history is kept"""
+    return getattr(settings, "PGACTIVITY_HISTORY_RETENTION", dt.timedelta(days=7))
+
+
 def limit():
     """The default limit when using the LS subcommand"""
     return getattr(settings, "PGACTIVITY_LIMIT", 25)
@@ -51,6 +113,51 @@ def get(name, **overrides):
     return cfg
 
 
+def metrics_context_keys():
+    """The context keys that are used as labels in metrics"""
+    return getattr(settings, "PGACTIVITY_METRICS_CONTEXT_KEYS", ["url", "command"])
+
+
+def metrics_cache_timeout():
+    """The number of seconds metrics are cached"""
+    return getattr(settings, "PGACTIVITY_METRICS_CACHE_TIMEOUT", 10)
+
+
+def metrics_max_label_values():
+    """The maximum number of values for each metric label"""
+    return getattr(settings, "PGACTIVITY_METRICS_MAX_LABEL_VALUES", 50)
+
+
+def metrics_quantiles():
+    """The quantiles of durations exposed in metrics"""
+    return getattr(settings, "PGACTIVITY_METRICS_QUANTILES", [0.5, 0.9, 0.99])
+
+
+def slow_statements():
+    """The number of the slowest statements of the process that are recorded"""
+    return getattr(settings, "PGACTIVITY_SLOW_STATEMENTS", 0)
+
+
+def timeout_defer():
+    """True if pgactivity.timeout applies timeouts with the next statement"""
+    return getattr(settings, "PGACTIVITY_TIMEOUT_DEFER", False)
+
+
+def registry():
+    """True if the backends of connections are registered in the process"""
+    return getattr(settings, "PGACTIVITY_REGISTRY", False)
+
+
+def request_deadline():
+    """The deadline of statements of every request, applied by the middleware"""
+    return getattr(settings, "PGACTIVITY_REQUEST_DEADLINE", None)
+
+
+def route_timeouts():
+    """Statement timeouts of routes, keyed by URL name or path pattern"""
+    return getattr(settings, "PGACTIVITY_ROUTE_TIMEOUTS", {})
+
+
 def json_encoder():
     """The JSON encoder when tracking context"""
     encoder = getattr(
@@ -58,6 +165,13 @@ def json_encoder():
     )
 
     if isinstance(encoder, str):  # pragma: no branch
-        encoder = import_string(encoder)
+        encoder = _import_string(encoder)
 
     return encoder
+
+
+@functools.lru_cache(maxsize=None)
+def _import_string(path):
+    # Import paths are resolved once. The cache is keyed by the path, so changing
+    # the setting results in the new path being imported
+    return import_string(path)
@@ -1,22 +1,35 @@
 import contextlib
+import contextvars
 import datetime as dt
-import threading
-from typing import List, Union
+import time
+from typing import List, Tuple, Union
 
 from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import OperationalError
 
-from pgactivity import utils
+from pgactivity import config, utils
 
 if utils.psycopg_maj_version == 2:
     import psycopg2.extensions
 elif utils.psycopg_maj_version == 3:
+    import psycopg
     import psycopg.pq
 else:
     raise AssertionError
 
 
-_timeout = threading.local()
 _unset = object()
+_default = object()
+_unknown = object()
+_deadline = contextvars.ContextVar("pgactivity_deadline", default=None)
+# The (alias, pid) of every backend used by the current request
+_tracked = contextvars.ContextVar("pgactivity_tracked", default=None)
+# Execute wrappers installed by pgactivity
+_execute_wrappers = set()
+
+
+class DeadlineExceeded(OperationalError):
+    """Raised instead of running a statement once the deadline has passed"""
 
 
 def _cast_timeout(timeout):
@@ -47,11 +60,235 @@ def _is_transaction_errored(cursor):
         raise AssertionError
 
 
+def _is_transaction_idle(connection):
+    """
+    True if the DB-API connection is not in a transaction
+    """
+    if utils.psycopg_maj_version == 2:
+        return connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    elif utils.psycopg_maj_version == 3:
+        return connection.info.transaction_status == psycopg.pq.TransactionStatus.IDLE
+    else:
+        raise AssertionError
+
+
+def _backend_pid(conn):
+    """Return the backend process ID of a connection without a query.
+
+    The driver knows the process ID of its connection. It's cached until
+    the connection is re-established.
+    """
+    cached = getattr(conn, "_pgactivity_pid", None)
+    if cached is None or cached[0] is not conn.connection:
+        if utils.psycopg_maj_version == 2:
+            backend_pid = conn.connection.get_backend_pid()
+        elif utils.psycopg_maj_version == 3:
+            backend_pid = conn.connection.info.backend_pid
+        else:
+            raise AssertionError
+
+        cached = conn._pgactivity_pid = (conn.connection, backend_pid)
+
+    return cached[1]
+
+
+def _install_execute_wrapper(connection, wrapper, *, outermost=False):
+    """Install an execute wrapper on a connection if it's not installed.
+
+    Wrappers are installed before other wrappers instead of being appended.
+    ``connection.execute_wrapper`` removes the last wrapper when it exits,
+    and connections are often opened, and instrumented, while it's active.
+    """
+    wrappers = connection.execute_wrappers
+    if wrapper in wrappers:
+        return
+
+    _execute_wrappers.add(wrapper)
+    index = 0
+    if not outermost:
+        while index < len(wrappers) and wrappers[index] in _execute_wrappers:
+            index += 1
+
+    wrappers.insert(index, wrapper)
+
+
+def _supports_multiple_statements(cursor):
+    """
+    True if the cursor can execute multiple statements along with parameters
+    """
+    if getattr(cursor.cursor, "name", None) is not None:
+        # Server-side cursors declare a cursor for a single query
+        return False
+
+    if utils.psycopg_maj_version == 3:
+        # Server-side binding prepares statements, which can only contain
+        # one statement
+        return isinstance(cursor.cursor, psycopg.ClientCursor)
+
+    return True
+
+
+class _TimeoutState:
+    """The statement timeout requested on a connection and the one applied on the server.
+
+    Timeouts are applied with ``SET LOCAL`` inside transactions, so they
+    revert when the transaction or savepoint ends. Outside of transactions,
+    ``SET`` is used.
+    """
+
+    def __init__(self):
+        self.requested = []
+        self.connection = None
+        self.session = _default
+        self.local = None
+
+    def _in_transaction(self, conn):
+        return conn.in_atomic_block or not conn.autocommit
+
+    def applied(self, conn):
+        """Return the statement timeout that is applied on the server"""
+        if conn.connection is not self.connection:
+            self.connection = conn.connection
+            self.session = _default
+            self.local = None
+
+        if self.local is not None:
+            value, savepoint_ids = self.local
+            if not self._in_transaction(conn) or _is_transaction_idle(conn.connection):
+                # Local timeouts end with their transaction
+                self.local = None
+            elif tuple(conn.savepoint_ids[: len(savepoint_ids)]) != savepoint_ids:
+                # The savepoint of the local timeout was released or rolled back
+                self.local = (_unknown, savepoint_ids)
+                return _unknown
+            else:
+                return value
+
+        return self.session
+
+    def target(self):
+        """Return the timeout that statements should run with.
+
+        Under a deadline, this is the remaining time of the deadline unless
+        the requested timeout is shorter.
+        """
+        requested = self.requested[-1] if self.requested else _default
+        remaining = _remaining_ms()
+        if remaining is not None and (requested in (_default, 0) or remaining < requested):
+            return remaining
+
+        return requested
+
+    def pending_sql(self, conn, target):
+        """Return the SQL that applies the target timeout, if it's not applied"""
+        if target == self.applied(conn):
+            return None
+
+        scope = "LOCAL " if self._in_transaction(conn) else ""
+        value = "DEFAULT" if target is _default else target
+        return f"SET {scope}statement_timeout = {value}"
+
+    def mark_applied(self, conn, target):
+        if self._in_transaction(conn):
+            self.local = (target, tuple(conn.savepoint_ids))
+        else:
+            self.session = target
+
+    def mark_unknown(self):
+        # Failed statements roll back timeouts that were applied with them
+        self.session = _unknown
+        self.local = None
+
+
+# Timeouts aren't applied with savepoint statements since savepoints
+# change the scope of local timeouts
+_savepoint_prefixes = ("SAVEPOINT ", "RELEASE SAVEPOINT ", "ROLLBACK TO SAVEPOINT ")
+
+
+def _apply_timeout(execute, sql, params, many, context):
+    """Apply a pending statement timeout along with the statement being executed"""
+    conn = context["connection"]
+    tracked = _tracked.get()
+    if tracked is not None:
+        tracked.add((conn.alias, _backend_pid(conn)))
+
+    state = getattr(conn, "_pgactivity_timeout", None)
+    if state is None and _deadline.get() is None:
+        return execute(sql, params, many, context)
+
+    cursor = context["cursor"]
+    if sql.startswith(_savepoint_prefixes) or _is_transaction_errored(cursor.cursor):
+        return execute(sql, params, many, context)
+
+    state = state or _get_timeout_state(conn)
+    target = state.target()
+    set_sql = state.pending_sql(conn, target)
+    if set_sql is None:
+        return execute(sql, params, many, context)
+
+    try:
+        if sql == set_sql:
+            result = execute(sql, params, many, context)
+        elif many or not _supports_multiple_statements(cursor):
+            # The timeout is applied with a plain cursor since server-side
+            # cursors can only execute queries
+            with conn.connection.cursor() as set_cursor:
+                set_cursor.execute(set_sql)
+
+            result = execute(sql, params, many, context)
+        else:
+            result = execute(f"{set_sql}; {sql}", params, many, context)
+            if utils.psycopg_maj_version == 3:
+                # psycopg returns the results of the first statement
+                cursor.nextset()
+    except Exception:
+        state.mark_unknown()
+        raise
+
+    state.mark_applied(conn, target)
+    return result
+
+
+def install(connection, **kwargs):
+    """Install the timeout execute wrapper on a connection.
+
+    The wrapper is a no-op for connections without timeouts outside of
+    ``pgactivity.deadline``. It also tracks the backends used by requests
+    of [pgactivity.middleware.ActivityMiddleware][]. When the ``pgactivity`` app is loaded, it is
+    installed the first time a connection is opened.
+    """
+    # The wrapper runs before the context wrapper so that the context
+    # comment remains at the start of statements
+    _install_execute_wrapper(connection, _apply_timeout, outermost=True)
+
+
+def _get_timeout_state(conn):
+    if not hasattr(conn, "_pgactivity_timeout"):
+        conn._pgactivity_timeout = _TimeoutState()
+
+    install(conn)
+    return conn._pgactivity_timeout
+
+
+def _flush_timeout(conn, state):
+    # Under a deadline, every statement is sent with its own timeout
+    if _deadline.get() is not None:
+        return
+
+    conn.ensure_connection()
+    set_sql = state.pending_sql(conn, state.target())
+    if set_sql is not None:
+        with conn.cursor() as cursor:
+            if not _is_transaction_errored(cursor):
+                cursor.execute(set_sql)
+
+
 @contextlib.contextmanager
 def timeout(
     timeout: Union[dt.timedelta, int, float, None] = _unset,
     *,
     using: str = DEFAULT_DB_ALIAS,
+    defer: Union[bool, None] = None,
     **timedelta_kwargs: int,
 ):
     """Set the statement timeout as a decorator or context manager.
@@ -60,13 +297,19 @@ def timeout(
     A value of less than a millisecond is not permitted.
 
     Nested invocations will successfully apply and rollback the timeout to
-    the previous value.
+    the previous value. Restoring a timeout that was never applied is skipped.
+
+    When deferred, the timeout is applied with the next statement sent
+    over the connection instead of with separate statements on enter and
+    exit.
 
     Args:
         timeout: The number of seconds as an integer or float. Use a timedelta
             object to precisely specify the timeout interval. Use ``None`` for
             an infinite timeout.
         using: The database to use.
+        defer: Apply the timeout with the next statement. Defaults to
+            ``settings.PGACTIVITY_TIMEOUT_DEFER``.
         **timedelta_kwargs: Keyword arguments to directly supply to
             datetime.timedelta to create an interval. E.g.
             `pgactivity.timeout(seconds=1, milliseconds=100)`
@@ -92,43 +335,151 @@ def timeout(
     else:
         timeout = dt.timedelta()
 
-    if not hasattr(_timeout, "value"):
-        _timeout.value = None
+    if defer is None:
+        defer = config.timeout_defer()
 
-    old_timeout = _timeout.value
-    _timeout.value = int(timeout.total_seconds() * 1000)
+    conn = connections[using]
+    state = _get_timeout_state(conn)
+    state.requested.append(int(timeout.total_seconds() * 1000))
 
     try:
-        with connections[using].cursor() as cursor:
-            cursor.execute(f"SELECT set_config('statement_timeout', '{_timeout.value}', false)")
-            yield
+        if not defer:
+            _flush_timeout(conn, state)
+
+        yield
     finally:
-        _timeout.value = old_timeout
+        state.requested.pop()
 
-        with connections[using].cursor() as cursor:
-            if not _is_transaction_errored(cursor):
-                if _timeout.value is None:
-                    cursor.execute("SELECT set_config('statement_timeout', NULL, false)")
-                else:
-                    cursor.execute(
-                        f"SELECT set_config('statement_timeout', '{_timeout.value}', false)"
-                    )
-
-
-def _pg_backend_method(method, pids, using):
-    assert method in ("cancel", "terminate")
-
-    if pids:
-        with connections[using].cursor() as cursor:
-            cursor.execute(
-                f"""
-                SELECT pg_{method}_backend(pid)
-                FROM pg_stat_activity
-                WHERE pid IN ({', '.join(str(pid) for pid in pids)})
-            """
-            )
+        if not defer:
+            _flush_timeout(conn, state)
 
-    return pids
+
+def _remaining_ms():
+    """Return the milliseconds left until the deadline, if there is one.
+
+    Raises:
+        DeadlineExceeded: When the deadline has passed
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+
+    remaining = int((deadline - time.monotonic()) * 1000)
+    if remaining < 1:
+        raise DeadlineExceeded("The pgactivity.deadline has passed")
+
+    return remaining
+
+
+@contextlib.contextmanager
+def deadline(
+    budget: Union[dt.timedelta, int, float, str] = _unset,
+    **timedelta_kwargs: int,
+):
+    """Run statements within a time budget as a decorator or context manager.
+
+    Every statement runs with a statement timeout of the time remaining
+    until the deadline, or the timeout of [pgactivity.timeout][] if it's
+    shorter. The timeout is sent along with each statement, adding no
+    round trips. Once the deadline has passed, statements fail without
+    being sent to the database.
+
+    The deadline covers every database and is stored in a context variable,
+    following code across ``asyncio`` tasks and ``sync_to_async`` calls.
+    Nested deadlines can shorten the deadline but never extend it.
+
+    Args:
+        budget: The time budget as seconds, a timedelta, or a string such
+            as "2s".
+        **timedelta_kwargs: Keyword arguments to directly supply to
+            datetime.timedelta to create the budget. E.g.
+            `pgactivity.deadline(seconds=2)`.
+
+    Raises:
+        django.db.utils.OperationalError: When a statement times out
+        pgactivity.core.DeadlineExceeded: When a statement is executed after
+            the deadline. It's a subclass of ``OperationalError``.
+    """
+    if timedelta_kwargs:
+        budget = dt.timedelta(**timedelta_kwargs)
+    elif budget is _unset:
+        raise ValueError("Must supply a value to pgactivity.deadline")
+
+    # Connections opened before the app was loaded don't have the wrapper
+    for conn in connections.all(initialized_only=True):
+        install(conn)
+
+    deadline = time.monotonic() + utils.parse_interval(budget).total_seconds()
+    current = _deadline.get()
+    token = _deadline.set(min(deadline, current) if current is not None else deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _signal_sql(method, pid_sql, timeout=None, *, using=DEFAULT_DB_ALIAS):
+    """Return the SQL expression that signals a backend"""
+    if method not in ("cancel", "terminate"):
+        raise ValueError('Method must be "cancel" or "terminate"')
+
+    if timeout is None:
+        return f"pg_{method}_backend({pid_sql})"
+
+    if method != "terminate":
+        raise ValueError("A timeout can only be supplied when terminating")
+
+    if connections[using].pg_version < 140000:
+        raise ValueError("A timeout can only be supplied on Postgres 14 or higher")
+
+    timeout_ms = int(utils.parse_interval(timeout).total_seconds() * 1000)
+    return f"pg_{method}_backend({pid_sql}, {timeout_ms})"
+
+
+def signal(
+    method: str,
+    *pids: int,
+    timeout: Union[dt.timedelta, int, float, str, None] = None,
+    using: str = DEFAULT_DB_ALIAS,
+) -> List[Tuple[int, bool]]:
+    """Cancel or terminate activity and report the outcome of every process.
+
+    Every process is signaled in one statement.
+
+    Args:
+        method: Either "cancel" or "terminate".
+        *pids: The process ID(s) to signal.
+        timeout: When terminating, wait for processes to exit for up to this
+            long. Processes that haven't exited are reported as unsuccessful.
+            Requires Postgres 14.
+        using: The database to use.
+
+    Returns:
+        ``(pid, succeeded)`` pairs for every process ID
+
+    Raises:
+        ValueError: When a timeout is supplied on Postgres 13 or lower.
+    """
+    signal_sql = _signal_sql(method, "_pga_pid", timeout, using=using)
+
+    if not pids:
+        return []
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT
+                _pga_pid,
+                CASE
+                    WHEN EXISTS (SELECT FROM pg_stat_activity WHERE pid = _pga_pid)
+                    THEN {signal_sql}
+                    ELSE false
+                END
+            FROM UNNEST(%s::int[]) AS _pga_pid
+            """,
+            [[int(pid) for pid in pids]],
+        )
+        return [(pid, bool(succeeded)) for pid, succeeded in cursor.fetchall()]
 
 
 def cancel(*pids: int, using: str = DEFAULT_DB_ALIAS) -> List[int]:
@@ -139,33 +490,45 @@ def cancel(*pids: int, using: str = DEFAULT_DB_ALIAS) -> List[int]:
         using: The database to use.
 
     Returns:
-        Canceled process IDs
+        The process IDs. Use [pgactivity.signal][] for the outcome of
+        every process.
     """
-    return _pg_backend_method("cancel", pids, using)
+    signal("cancel", *pids, using=using)
+    return pids
 
 
-def terminate(*pids: int, using: str = DEFAULT_DB_ALIAS) -> List[int]:
+def terminate(
+    *pids: int,
+    timeout: Union[dt.timedelta, int, float, str, None] = None,
+    using: str = DEFAULT_DB_ALIAS,
+) -> List[int]:
     """Terminate activity using the Postgres ``pg_teminate_backend`` function.
 
     Args:
         *pids: The process ID(s) to terminate.
+        timeout: Wait for processes to exit for up to this long. Requires
+            Postgres 14.
         using: The database to use.
 
     Returns:
-        Terminated process IDs
+        The process IDs. Use [pgactivity.signal][] for the outcome of
+        every process.
     """
-    return _pg_backend_method("terminate", pids, using)
+    signal("terminate", *pids, timeout=timeout, using=using)
+    return pids
 
 
 def pid(using: str = DEFAULT_DB_ALIAS) -> int:
     """Get the current backend process ID.
 
+    The process ID is read from the database driver without a query.
+
     Args:
         using: The database to use.
 
     Returns:
         The current backend process ID
     """
-    with connections[using].cursor() as cursor:
-        cursor.execute("SELECT pg_backend_pid()")
-        return cursor.fetchone()[0]
+    conn = connections[using]
+    conn.ensure_connection()
+    return _backend_pid(conn)
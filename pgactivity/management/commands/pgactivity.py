@@ -1,13 +1,17 @@
+import csv
 import datetime as dt
+import json
 import os
 import re
 import sys
 import textwrap
+import time
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
 from django.db.models import F
 
-from pgactivity import config, models
+from pgactivity import config, models, utils
 
 
 def get_terminal_width():  # pragma: no cover
@@ -17,6 +21,13 @@ def get_terminal_width():  # pragma: no cover
         return 80
 
 
+def get_terminal_height():  # pragma: no cover
+    try:
+        return os.get_terminal_size().lines
+    except OSError:  # This only happens during testing
+        return 24
+
+
 def _format(val, expanded):
     if isinstance(val, dt.timedelta):
         if val:  # pragma: no branch
@@ -30,6 +41,92 @@ def _format(val, expanded):
     return str(val)
 
 
+def _order_by(attribute):
+    if attribute.startswith("-"):
+        return F(attribute[1:]).desc(nulls_last=True)
+    else:
+        return F(attribute).asc(nulls_last=True)
+
+
+def _format_line(query, attributes, term_w):
+    line = " | ".join(_format(query[a], False) for a in attributes)
+    return line[:term_w]
+
+
+def _delta(query, previous):
+    """Return a marker for new or changed activity since the previous frame"""
+    if previous is None:
+        return " "
+    elif query["id"] not in previous:
+        return "+"
+    elif previous[query["id"]] != query["state"]:
+        return "~"
+    else:
+        return " "
+
+
+class _Screen:
+    """Redraws only the lines of the terminal that changed between frames"""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.lines = []
+
+    def draw(self, lines):
+        if not self.lines:
+            self.stdout.write("\033[2J", ending="")
+
+        for num, line in enumerate(lines):
+            if num >= len(self.lines) or self.lines[num] != line:
+                self.stdout.write(f"\033[{num + 1};1H{line}\033[K", ending="")
+
+        for num in range(len(lines), len(self.lines)):
+            self.stdout.write(f"\033[{num + 1};1H\033[K", ending="")
+
+        self.stdout.write(f"\033[{len(lines) + 1};1H", ending="")
+        self.stdout.flush()
+        self.lines = lines
+
+
+def _export_value(val, encoder):
+    """Format a value for CSV output"""
+    if val is None:
+        return ""
+    elif isinstance(val, (dict, list)):
+        return json.dumps(val, cls=encoder, separators=(",", ":"))
+    elif isinstance(val, (dt.datetime, dt.date, dt.time, dt.timedelta)):
+        return encoder().default(val)
+    else:
+        return val
+
+
+def _export(rows, attributes, output_format, stdout):
+    """Write rows as JSON, JSON lines, or CSV without truncation.
+
+    Rows are written as they are read so that output uses constant memory.
+    """
+    encoder = config.json_encoder()
+
+    def dumps(row):
+        return json.dumps({a: row[a] for a in attributes}, cls=encoder, separators=(",", ":"))
+
+    if output_format == "jsonl":
+        for row in rows:
+            stdout.write(dumps(row))
+    elif output_format == "json":
+        stdout.write("[", ending="")
+        for num, row in enumerate(rows):
+            stdout.write(("," if num else "") + dumps(row), ending="")
+        stdout.write("]")
+    elif output_format == "csv":
+        writer = csv.writer(stdout, lineterminator="\n")
+        writer.writerow(attributes)
+        for row in rows:
+            writer.writerow([_export_value(row[a], encoder) for a in attributes])
+    else:
+        raise CommandError(f'Invalid format "{output_format}"')
+
+
 def _handle_user_input(*, cfg, num_queries, stdout):
     is_cancel = cfg.get("cancel")
 
@@ -58,6 +155,11 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("pids", nargs="*", type=str)
         parser.add_argument("-d", "--database", help="The database")
+        parser.add_argument(
+            "--all-databases",
+            action="store_true",
+            help="Query every database concurrently",
+        )
         parser.add_argument(
             "-f",
             "--filter",
@@ -73,9 +175,37 @@ class Command(BaseCommand):
             help="Attributes to show",
         )
         parser.add_argument("-l", "--limit", help="Limit results")
+        parser.add_argument(
+            "--format",
+            choices=["text", "json", "jsonl", "csv"],
+            help='The output format. Defaults to "text"',
+        )
         parser.add_argument("-e", "--expanded", action="store_true", help="Show an expanded view")
         parser.add_argument("-c", "--config", help="Use a config from settings.PGACTIVITY_CONFIGS")
         parser.add_argument("-y", "--yes", action="store_true", help="Don't prompt for input")
+        parser.add_argument(
+            "-o",
+            "--order-by",
+            help='Attribute to order by. Prefix with "-" to descend. Defaults to "-duration"',
+        )
+        parser.add_argument(
+            "-t",
+            "--tree",
+            action="store_true",
+            help="Show the tree of processes blocking one another on locks",
+        )
+        parser.add_argument(
+            "-g",
+            "--group",
+            action="store_true",
+            help="Group activity by query fingerprint",
+        )
+        parser.add_argument(
+            "-w",
+            "--watch",
+            metavar="INTERVAL",
+            help='Refresh results at an interval, such as "2s"',
+        )
 
         group = parser.add_mutually_exclusive_group()
         group.add_argument(
@@ -91,8 +221,26 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         cfg = config.get(options["config"], **options)
+
+        if cfg.get("tree"):
+            return self.tree(cfg)
+
         is_cancel = cfg.get("cancel")
         is_terminate = cfg.get("terminate")
+        if cfg.get("group"):
+            if cfg.get("all_databases") or is_cancel or is_terminate or cfg.get("watch"):
+                raise CommandError(
+                    "--group cannot be used with --all-databases, --cancel, --terminate,"
+                    " or --watch"
+                )
+
+            return self.group(cfg, options)
+
+        if cfg.get("all_databases") and (is_cancel or is_terminate or cfg.get("watch")):
+            raise CommandError(
+                "--all-databases cannot be used with --cancel, --terminate, or --watch"
+            )
+
         activity = (models.PGActivity.objects.config(options["config"], **options)).values(
             *cfg["attributes"]
         )
@@ -113,18 +261,115 @@ class Command(BaseCommand):
             self.stdout.write(
                 (f"{'Canceled' if is_cancel else 'Terminated'} " f"{num_success} quer{pluralize}")
             )
+        elif cfg.get("watch"):
+            self.watch(activity, cfg)
         else:
-            activity = activity.order_by(F("duration").desc(nulls_last=True))
+            activity = activity.order_by(_order_by(cfg.get("order_by", "-duration")))
 
             if not cfg.get("pids") and cfg.get("limit"):
                 activity = activity[: cfg["limit"]]
 
+            attributes = cfg["attributes"]
+            if cfg.get("all_databases"):
+                # Query every database concurrently and tag rows with their database.
+                # Results are merged by the ordering, so it must be selected
+                order_by = cfg.get("order_by", "-duration").lstrip("-")
+                activity = activity.values(*{*attributes, order_by})
+                activity = [{**query, "database": alias} for alias, query in activity.across()]
+                attributes = ["database", *attributes]
+
+            output_format = cfg.get("format", "text")
+            if output_format != "text":
+                if not cfg.get("all_databases"):
+                    # Stream rows with a server-side cursor
+                    activity = activity.iterator(chunk_size=500)
+
+                return _export(activity, attributes, output_format, self.stdout)
+
             for query in activity:
                 if cfg.get("expanded"):
                     self.stdout.write("\033[1m" + "─" * term_w + "\033[0m")
-                    for a in cfg["attributes"]:
+                    for a in attributes:
                         self.stdout.write(f"\033[1m{a}\033[0m: {_format(query[a], expanded)}")
                 else:
-                    line = " | ".join(_format(query[a], expanded) for a in cfg["attributes"])
-                    line = line[:term_w]
-                    self.stdout.write(line)
+                    self.stdout.write(_format_line(query, attributes, term_w))
+
+    def group(self, cfg, options):
+        """Show the number of processes and durations of every query fingerprint"""
+        activity = (
+            models.PGActivity.objects.config(options["config"], **options)
+            .group_by_fingerprint()
+            .order_by(_order_by(cfg.get("order_by", "-count")))
+        )
+        if not cfg.get("pids") and cfg.get("limit"):
+            activity = activity[: cfg["limit"]]
+
+        attributes = ["count", "max_duration", "mean_duration", "normalized_query"]
+        output_format = cfg.get("format", "text")
+        if output_format != "text":
+            attributes = ["fingerprint", "count", "total_duration", *attributes[1:]]
+            return _export(activity, attributes, output_format, self.stdout)
+
+        term_w = get_terminal_width()
+        for row in activity:
+            self.stdout.write(_format_line(row, attributes, term_w))
+
+    def tree(self, cfg):
+        """Render the lock-wait tree, indenting blocked processes under their blockers"""
+        blocking = models.PGBlocking.objects.using(cfg.get("database") or DEFAULT_DB_ALIAS)
+        if cfg.get("pids"):
+            blocking = blocking.filter(root__in=cfg["pids"])
+
+        term_w = get_terminal_width()
+        num_rows = 0
+        for row in blocking:
+            num_rows += 1
+            prefix = "" if not row.depth else "   " * (row.depth - 1) + "└─ "
+            lock = f"{row.lock_mode} on {row.relation or row.lock_type}" if row.lock_mode else ""
+            line = " | ".join(
+                _format(val, False)
+                for val in (row.id, lock, row.state, row.duration, row.context, row.query)
+                if val != ""
+            )
+            self.stdout.write((prefix + line)[:term_w])
+
+        if not num_rows:
+            self.stdout.write("No blocked processes.")
+
+    def watch(self, activity, cfg):
+        """Re-run the query at an interval, redrawing changed lines in place.
+
+        Rows are marked with "+" when the process is new since the last refresh
+        and "~" when its state changed.
+        """
+        interval = utils.parse_interval(cfg["watch"]).total_seconds()
+        attributes = cfg["attributes"]
+        activity = activity.values(*{*attributes, "id", "state"}).order_by(
+            _order_by(cfg.get("order_by", "-duration"))
+        )
+        screen = _Screen(self.stdout)
+        previous = None
+
+        try:
+            while True:
+                term_w = get_terminal_width()
+                num_rows = get_terminal_height() - 2
+                if not cfg.get("pids") and cfg.get("limit"):
+                    num_rows = min(num_rows, int(cfg["limit"]))
+
+                rows = list(activity[:num_rows])
+                header = f"Every {cfg['watch']}: {len(rows)} rows at {dt.datetime.now():%H:%M:%S}"
+                screen.draw(
+                    [header[:term_w]]
+                    + [
+                        f"{_delta(query, previous)} {_format_line(query, attributes, term_w - 2)}"
+                        for query in rows
+                    ]
+                )
+                # Track every process, not only the drawn ones, so that processes
+                # scrolling into view aren't marked as new
+                previous = dict(activity.order_by().values_list("id", "state"))
+
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            self.stdout.write("")
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from pgactivity import profiler
+
+
+class Command(BaseCommand):
+    help = "Profile where the database spends time by sampling wait events."
+
+    def add_arguments(self, parser):
+        parser.add_argument("-d", "--database", default=DEFAULT_DB_ALIAS, help="The database")
+        parser.add_argument("--duration", default="60s", help='How long to profile, such as "60s"')
+        parser.add_argument(
+            "--hz", type=float, default=10, help="The number of samples per second"
+        )
+        parser.add_argument(
+            "-k",
+            "--context-key",
+            action="append",
+            dest="context_keys",
+            help="A context key to profile. Can be used multiple times. Defaults to every key",
+        )
+        parser.add_argument(
+            "--min-percent",
+            type=float,
+            default=1,
+            help="Omit entries of the summary under this share of samples",
+        )
+        parser.add_argument(
+            "--folded",
+            action="store_true",
+            help="Print folded stacks for flame graph tools instead of a summary",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            activity_profiler = profiler.Profiler(
+                duration=options["duration"],
+                hz=options["hz"],
+                context_keys=options["context_keys"],
+                using=options["database"],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc)) from exc
+
+        profile = activity_profiler.run()
+        if options["folded"]:
+            lines = profile.folded()
+        else:
+            lines = profile.summary(min_percent=options["min_percent"])
+
+        for line in lines:
+            self.stdout.write(line)
@@ -0,0 +1,66 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from pgactivity import reaper
+
+
+class Command(BaseCommand):
+    help = "Cancel and terminate activity matching a config on a schedule."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-c", "--config", required=True, help="Use a config from settings.PGACTIVITY_CONFIGS"
+        )
+        parser.add_argument("-i", "--interval", help='The time between ticks, such as "5s"')
+        parser.add_argument(
+            "-g",
+            "--grace",
+            help="How long canceled activity can keep matching before it is terminated",
+        )
+        parser.add_argument(
+            "-l", "--limit", type=int, help="The maximum number of processes signaled per tick"
+        )
+        parser.add_argument(
+            "-r", "--rate-limit", type=int, help="The maximum number of signals per minute"
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            default=None,
+            help="Log activity that would be signaled without signaling it",
+        )
+        parser.add_argument(
+            "-n",
+            "--count",
+            type=int,
+            help="Exit after this many ticks instead of running forever",
+        )
+
+    def handle(self, *args, **options):
+        # Events are logged. Show them when logging isn't configured
+        handler = None
+        level = reaper.logger.level
+        if options["verbosity"] and not reaper.logger.handlers:
+            handler = logging.StreamHandler(self.stdout)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            reaper.logger.addHandler(handler)
+            reaper.logger.setLevel(logging.INFO)
+
+        activity_reaper = reaper.from_config(
+            options["config"],
+            interval=options["interval"],
+            grace=options["grace"],
+            limit=options["limit"],
+            rate_limit=options["rate_limit"],
+            dry_run=options["dry_run"],
+        )
+
+        try:
+            activity_reaper.run_forever(count=options["count"])
+        except KeyboardInterrupt:  # pragma: no cover
+            pass
+        finally:
+            if handler:
+                reaper.logger.removeHandler(handler)
+                reaper.logger.setLevel(level)
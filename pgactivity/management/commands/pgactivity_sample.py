@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from pgactivity import sampler
+
+
+class Command(BaseCommand):
+    help = "Record activity snapshots into the activity history table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-d",
+            "--database",
+            action="append",
+            dest="databases",
+            help="The database. Can be used multiple times",
+        )
+        parser.add_argument(
+            "-i", "--interval", default="1s", help='The time between samples, such as "1s"'
+        )
+        parser.add_argument(
+            "-r",
+            "--retention",
+            help="How long history is kept. Defaults to settings.PGACTIVITY_HISTORY_RETENTION",
+        )
+        parser.add_argument(
+            "-n",
+            "--count",
+            type=int,
+            help="Exit after this many samples instead of running forever",
+        )
+
+    def handle(self, *args, **options):
+        activity_sampler = sampler.Sampler(
+            options["interval"],
+            databases=options["databases"],
+            retention=options["retention"],
+        )
+
+        try:
+            activity_sampler.run_forever(count=options["count"])
+        except KeyboardInterrupt:  # pragma: no cover
+            pass
@@ -0,0 +1,179 @@
+"""Export aggregates of activity in the Prometheus text format"""
+
+import re
+from typing import Dict, List, Tuple
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from pgactivity import cache, config, models
+
+_OTHER = "__other__"
+
+
+def _label_name(key: str) -> str:
+    return "context_" + re.sub(r"\W", "_", key)
+
+
+def _escape(val: str) -> str:
+    return val.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _dimensions() -> Dict[str, str]:
+    """Return the metric labels and the SQL expressions of their values"""
+    dimensions = {"state": "state", "wait_event_type": "wait_event_type"}
+    for key in config.metrics_context_keys():
+        dimensions[_label_name(key)] = f"context->>{models._quote(key)}"
+
+    return dimensions
+
+
+def _metrics_sql(using: str) -> Tuple[str, List]:
+    """Return the SQL that aggregates activity over every dimension.
+
+    All aggregates are computed in one statement with ``GROUPING SETS``.
+    Values of a dimension beyond the label cardinality limit are folded
+    into one "__other__" value before aggregating so that quantiles stay
+    accurate.
+    """
+    activity = models.PGActivity.objects.using(using).values(
+        "id", "state", "wait_event_type", "duration", "context"
+    )
+    sql, params = activity.query.get_compiler(using=using).as_sql()
+
+    dimensions = _dimensions()
+    max_values = config.metrics_max_label_values()
+    quantiles = [float(q) for q in config.metrics_quantiles()]
+
+    columns = ", ".join(f"{expr} AS d{i}" for i, expr in enumerate(dimensions.values()))
+    counts = ", ".join(
+        f"d{i}, COUNT(*) OVER (PARTITION BY d{i}) AS n{i}" for i in range(len(dimensions))
+    )
+    ranks = ", ".join(
+        f"d{i}, DENSE_RANK() OVER (ORDER BY n{i} DESC, d{i}) AS r{i}"
+        for i in range(len(dimensions))
+    )
+    capped = ", ".join(
+        f"CASE WHEN r{i} > {int(max_values)} AND d{i} IS NOT NULL"
+        f" THEN {models._quote(_OTHER)} ELSE d{i} END AS d{i}"
+        for i in range(len(dimensions))
+    )
+    dims = ", ".join(f"d{i}" for i in range(len(dimensions)))
+    sets = ", ".join(["()", *(f"(d{i})" for i in range(len(dimensions)))])
+
+    return (
+        f"""
+        SELECT
+            {dims},
+            GROUPING({dims}),
+            COUNT(*),
+            MAX(duration),
+            PERCENTILE_CONT(%s::float8[]) WITHIN GROUP (ORDER BY duration)
+        FROM (
+            SELECT {capped}, duration
+            FROM (
+                SELECT {ranks}, duration
+                FROM (
+                    SELECT {counts}, duration
+                    FROM (
+                        SELECT {columns}, EXTRACT(EPOCH FROM duration) AS duration
+                        FROM ({sql}) AS _pga_activity
+                        WHERE id <> pg_backend_pid()
+                    ) AS _pga_metrics
+                ) AS _pga_counts
+            ) AS _pga_ranks
+        ) AS _pga_capped
+        GROUP BY GROUPING SETS ({sets})
+        """,
+        [quantiles, *params],
+    )
+
+
+def _format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        label_str = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+        name = f"{name}{{{label_str}}}"
+
+    return f"{name} {float(value)!r}"
+
+
+def _render(using: str) -> str:
+    sql, params = _metrics_sql(using)
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    labels = list(_dimensions())
+    quantiles = config.metrics_quantiles()
+    backends, maxes, percentiles = [], [], []
+
+    for row in rows:
+        values, grouping, count, max_duration, quantile_values = (
+            row[: len(labels)],
+            row[len(labels)],
+            row[len(labels) + 1],
+            row[len(labels) + 2],
+            row[len(labels) + 3],
+        )
+
+        # GROUPING() has a bit set for every dimension that is not grouped.
+        # The bits are ordered from the first dimension to the last
+        sample_labels = {}
+        for i, label in enumerate(labels):
+            if not grouping & (1 << (len(labels) - 1 - i)):
+                sample_labels[label] = values[i]
+
+        # Backends without a value for a dimension are only part of the totals
+        if None in sample_labels.values():
+            continue
+
+        backends.append(_format_sample("pgactivity_backends", sample_labels, count))
+        if max_duration is not None:
+            maxes.append(
+                _format_sample("pgactivity_duration_seconds_max", sample_labels, max_duration)
+            )
+
+        for quantile, value in zip(quantiles, quantile_values or []):
+            if value is not None:
+                percentiles.append(
+                    _format_sample(
+                        "pgactivity_duration_seconds",
+                        {**sample_labels, "quantile": str(quantile)},
+                        value,
+                    )
+                )
+
+    return (
+        "\n".join(
+            [
+                "# HELP pgactivity_backends The number of backends.",
+                "# TYPE pgactivity_backends gauge",
+                *backends,
+                "# HELP pgactivity_duration_seconds_max The longest query duration in seconds.",
+                "# TYPE pgactivity_duration_seconds_max gauge",
+                *maxes,
+                "# HELP pgactivity_duration_seconds Quantiles of query durations in seconds.",
+                "# TYPE pgactivity_duration_seconds gauge",
+                *percentiles,
+            ]
+        )
+        + "\n"
+    )
+
+
+def collect(*, using: str = DEFAULT_DB_ALIAS) -> str:
+    """Return activity metrics in the Prometheus text format.
+
+    Backends are counted by state, wait event type and the context keys in
+    ``settings.PGACTIVITY_METRICS_CONTEXT_KEYS``, along with the maximum and
+    quantiles of query durations. All metrics are computed in one query and
+    cached for ``settings.PGACTIVITY_METRICS_CACHE_TIMEOUT`` seconds.
+
+    Args:
+        using: The database to use.
+
+    Returns:
+        The metrics.
+    """
+    return cache.get_or_refresh(
+        f"metrics:{using}", lambda: _render(using), config.metrics_cache_timeout()
+    )
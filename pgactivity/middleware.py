@@ -1,15 +1,172 @@
+import asyncio
+import collections
+import contextlib
+import re
 from typing import Callable
 
-from pgactivity import runtime
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
 
+from pgactivity import config, core, runtime
 
-def ActivityMiddleware(get_response: Callable):
+_no_timeout = object()
+_index = None
+
+
+def _validate_route_timeout(key, timeout):
+    try:
+        valid = timeout is None or bool(core._cast_timeout(timeout))
+    except TypeError:
+        valid = False
+
+    if not valid:
+        raise ValueError(
+            f'Invalid timeout {timeout!r} for "{key}" in settings.PGACTIVITY_ROUTE_TIMEOUTS.'
+            " Use an int, float, timedelta of at least a millisecond, or None."
+        )
+
+
+def _route_index(rules):
+    """Compile route timeout rules into an index.
+
+    URL names are stored in a dictionary. Path patterns are combined into a
+    single regular expression with one named group per pattern, so that a
+    path is matched against every pattern in one pass.
+    """
+    names = {}
+    patterns = []
+    for key, timeout in rules:
+        _validate_route_timeout(key, timeout)
+        if key.startswith("^") or "/" in key:
+            patterns.append((key, timeout))
+        else:
+            names[key] = timeout
+
+    regex = None
+    if patterns:
+        regex = re.compile("|".join(f"(?P<_r{i}>{key})" for i, (key, _) in enumerate(patterns)))
+
+    return names, regex, {f"_r{i}": timeout for i, (_, timeout) in enumerate(patterns)}
+
+
+def _get_route_index():
+    """Return the index of ``settings.PGACTIVITY_ROUTE_TIMEOUTS``, building it once"""
+    global _index
+
+    if _index is None:
+        _index = _route_index(config.route_timeouts().items())
+
+    return _index
+
+
+@receiver(setting_changed)
+def _reset_route_index(setting, **kwargs):
+    global _index
+
+    if setting == "PGACTIVITY_ROUTE_TIMEOUTS":
+        _index = None
+
+
+def _get_route_timeout(request):
+    """Return the timeout of a request's route from ``settings.PGACTIVITY_ROUTE_TIMEOUTS``.
+
+    URL names take precedence over path patterns. Patterns are matched in
+    the order they're defined.
+    """
+    names, regex, pattern_timeouts = _get_route_index()
+    if not names and not regex:
+        return _no_timeout
+
+    resolver_match = getattr(request, "resolver_match", None)
+    if resolver_match and resolver_match.view_name in names:
+        return names[resolver_match.view_name]
+
+    if regex:
+        match = regex.match(request.path_info)
+        if match:
+            return pattern_timeouts[match.lastgroup]
+
+    return _no_timeout
+
+
+def _request_deadline():
+    """Return the deadline of a request from ``settings.PGACTIVITY_REQUEST_DEADLINE``"""
+    budget = config.request_deadline()
+    return core.deadline(budget) if budget is not None else contextlib.nullcontext()
+
+
+def _cancel_backends(backends):
+    """Cancel the queries of backends, given as (alias, pid) pairs"""
+    pids = collections.defaultdict(list)
+    for alias, pid in backends:
+        pids[alias].append(pid)
+
+    try:
+        for alias, alias_pids in pids.items():
+            core.cancel(*alias_pids, using=alias)
+    finally:
+        connections.close_all()
+
+
+class ActivityMiddleware:
     """
     Annotates the url/method in the pgactivity context.
+
+    Supports both WSGI and ASGI deployments. Under ASGI, the context
+    follows the request into ``sync_to_async`` calls and tasks.
+
+    Statement timeouts are applied to views with [pgactivity.timeout][]
+    based on ``settings.PGACTIVITY_ROUTE_TIMEOUTS``. Requests run under a
+    [pgactivity.deadline][] when ``settings.PGACTIVITY_REQUEST_DEADLINE``
+    is set.
+
+    Under ASGI, queries of a request are canceled when the client disconnects
+    unless ``settings.PGACTIVITY_CANCEL_ON_DISCONNECT`` is ``False``.
     """
 
-    def middleware(request):
-        with runtime.context(url=request.path, method=request.method):
-            return get_response(request)
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable):
+        self.get_response = get_response
+        # Invalid route timeouts are reported at startup instead of during requests
+        _get_route_index()
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        with runtime.context(url=request.path, method=request.method), _request_deadline():
+            with contextlib.ExitStack() as request._pgactivity_exit_stack:
+                return self.get_response(request)
+
+    async def __acall__(self, request):
+        with runtime.context(url=request.path, method=request.method), _request_deadline():
+            request._pgactivity_exit_stack = contextlib.ExitStack()
+            tracked = set() if config.cancel_on_disconnect() else None
+            token = core._tracked.set(tracked)
+            try:
+                return await self.get_response(request)
+            except asyncio.CancelledError:
+                # Django cancels requests when clients disconnect, but sync
+                # code keeps running queries in its thread. That thread is
+                # busy, so backends are canceled from another one
+                if tracked:
+                    await sync_to_async(_cancel_backends, thread_sensitive=False)(list(tracked))
+
+                raise
+            finally:
+                core._tracked.reset(token)
+                # The timeout is entered in the request's sync thread by
+                # process_view. Restore it in the same thread
+                await sync_to_async(request._pgactivity_exit_stack.close)()
 
-    return middleware
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timeout = _get_route_timeout(request)
+        if timeout is not _no_timeout:
+            request._pgactivity_exit_stack.enter_context(core.timeout(timeout))
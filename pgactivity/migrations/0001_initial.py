@@ -0,0 +1,99 @@
+import django.db.models.manager
+from django.db import migrations, models
+
+import pgactivity.models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="PGActivity",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("start", models.DateTimeField()),
+                ("duration", models.DurationField()),
+                ("query", models.TextField()),
+                ("context", pgactivity.models.JSONField(null=True)),
+                ("state", models.CharField(max_length=64)),
+                ("xact_start", models.DateTimeField()),
+                ("backend_start", models.DateTimeField()),
+                ("state_change", models.DateTimeField()),
+                ("wait_event_type", models.CharField(max_length=32, null=True)),
+                ("wait_event", models.CharField(max_length=64, null=True)),
+                ("backend_xid", models.CharField(max_length=256, null=True)),
+                ("backend_xmin", models.CharField(max_length=256, null=True)),
+                ("backend_type", models.CharField(max_length=64)),
+                ("application_name", models.CharField(max_length=64, null=True)),
+                ("client_addr", models.CharField(max_length=256, null=True)),
+                ("client_hostname", models.CharField(max_length=256, null=True)),
+                ("client_port", models.IntegerField()),
+            ],
+            options={
+                "db_table": "_pgactivity_activity_cte",
+                "managed": False,
+                "default_manager_name": "no_objects",
+            },
+            managers=[
+                ("no_objects", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.SeparateDatabaseAndState(
+            # The history table is partitioned by day. Django does not support
+            # partitioned tables, so the table is created with SQL
+            database_operations=[
+                migrations.RunSQL(
+                    sql="""
+                        CREATE TABLE pgactivity_pgactivityhistory (
+                            id bigint GENERATED BY DEFAULT AS IDENTITY,
+                            sampled_at timestamp with time zone NOT NULL,
+                            pid integer NOT NULL,
+                            start timestamp with time zone NULL,
+                            duration interval NULL,
+                            state varchar(64) NULL,
+                            wait_event_type varchar(32) NULL,
+                            wait_event varchar(64) NULL,
+                            backend_type varchar(64) NULL,
+                            context jsonb NULL,
+                            query text NULL,
+                            PRIMARY KEY (id, sampled_at)
+                        ) PARTITION BY RANGE (sampled_at);
+                        CREATE INDEX pgactivity_history_sampled
+                            ON pgactivity_pgactivityhistory (sampled_at);
+                    """,
+                    reverse_sql="DROP TABLE pgactivity_pgactivityhistory;",
+                ),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name="PGActivityHistory",
+                    fields=[
+                        ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                        ("sampled_at", models.DateTimeField()),
+                        ("pid", models.IntegerField()),
+                        ("start", models.DateTimeField(null=True)),
+                        ("duration", models.DurationField(null=True)),
+                        ("state", models.CharField(max_length=64, null=True)),
+                        ("wait_event_type", models.CharField(max_length=32, null=True)),
+                        ("wait_event", models.CharField(max_length=64, null=True)),
+                        ("backend_type", models.CharField(max_length=64, null=True)),
+                        ("context", pgactivity.models.JSONField(null=True)),
+                        ("query", models.TextField(null=True)),
+                    ],
+                    options={
+                        "indexes": [
+                            models.Index(fields=["sampled_at"], name="pgactivity_history_sampled")
+                        ],
+                    },
+                ),
+            ],
+        ),
+    ]
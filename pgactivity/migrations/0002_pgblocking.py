@@ -0,0 +1,45 @@
+import django.contrib.postgres.fields
+import django.db.models.manager
+from django.db import migrations, models
+
+import pgactivity.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pgactivity", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PGBlocking",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("blocked_by", models.IntegerField(null=True)),
+                ("root", models.IntegerField()),
+                ("depth", models.IntegerField()),
+                (
+                    "path",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.IntegerField(), size=None
+                    ),
+                ),
+                ("lock_mode", models.CharField(max_length=64, null=True)),
+                ("lock_type", models.CharField(max_length=64, null=True)),
+                ("relation", models.CharField(max_length=256, null=True)),
+                ("state", models.CharField(max_length=64, null=True)),
+                ("duration", models.DurationField(null=True)),
+                ("context", pgactivity.models.JSONField(null=True)),
+                ("query", models.TextField(null=True)),
+            ],
+            options={
+                "db_table": "_pgactivity_blocking_cte",
+                "ordering": ["root", "path"],
+                "managed": False,
+                "default_manager_name": "no_objects",
+            },
+            managers=[
+                ("no_objects", django.db.models.manager.Manager()),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+import django.db.models.manager
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pgactivity", "0002_pgblocking"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PGStatement",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("query", models.TextField()),
+                ("calls", models.BigIntegerField()),
+                ("total_exec_time", models.FloatField()),
+                ("mean_exec_time", models.FloatField(null=True)),
+                ("rows", models.BigIntegerField()),
+                ("shared_blks_hit", models.BigIntegerField()),
+                ("shared_blks_read", models.BigIntegerField()),
+                ("temp_blks_written", models.BigIntegerField()),
+            ],
+            options={
+                "db_table": "_pgactivity_statement_cte",
+                "managed": False,
+                "default_manager_name": "no_objects",
+            },
+            managers=[
+                ("no_objects", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="pgactivityhistory",
+            name="query_id",
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
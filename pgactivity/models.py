@@ -1,11 +1,19 @@
-from typing import Any, List
+import concurrent.futures
+import datetime as dt
+import re
+from typing import Any, List, Tuple, Union
 
 from django.conf import settings
-from django.db import DEFAULT_DB_ALIAS, models
+from django.contrib.postgres.fields import ArrayField
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.db.models.expressions import Col, F, OrderBy, RawSQL
+from django.db.models.lookups import Exact, In
 from django.db.models.sql import Query
 from django.db.models.sql.compiler import SQLCompiler
+from django.db.models.sql.where import AND
+from django.utils import timezone
 
-from pgactivity import config, core, utils
+from pgactivity import cache, config, core, snapshots, statements, utils
 
 
 class JSONField(utils.JSONField):
@@ -18,79 +26,383 @@ class JSONField(utils.JSONField):
     pass
 
 
+_context_prefix = "/*pga_context="
+_application_name_prefix = "pga="
+
+
+def _quote(val):
+    """Quote a string as a SQL literal"""
+    return "'" + str(val).replace("'", "''") + "'"
+
+
 class PGTableQueryCompiler(SQLCompiler):
-    def get_ctes(self):
-        context_re = r"^/\*pga_context={[^\*]*}\*/"
+    """The base compiler for PG* models.
+
+    Subclasses implement ``get_ctes`` to return the CTE that is queried
+    as the model's table.
+    """
+
+    def get_ctes(self, used_columns=None):  # pragma: no cover
+        raise NotImplementedError
+
+    def get_context_sql(self):
+        # Context is parsed with plain string functions instead of regular
+        # expressions. The comment is only parsed when the query starts with it.
+        # Otherwise context is read from application_name, which is used by
+        # the "application_name" context transport
+        start = len(_context_prefix) + 1
+        app_start = len(_application_name_prefix) + 1
+        context_sql = f"""
+            CASE
+                WHEN STARTS_WITH(query, '{_context_prefix}{{') AND STRPOS(query, '*/') > 0
+                THEN SUBSTRING(query, {start}, STRPOS(query, '*/') - {start})::jsonb
+                WHEN STARTS_WITH(application_name, '{_application_name_prefix}{{')
+                THEN SUBSTRING(application_name, {app_start})::jsonb
+            END
+        """
+        aliases = config.context_key_aliases()
+        if aliases:
+            # Expand aliased keys back to their original names
+            aliases_sql = ", ".join(
+                f"({_quote(alias)}, {_quote(key)})" for key, alias in aliases.items()
+            )
+            # Empty contexts have no keys to aggregate, so they are coalesced
+            # back to empty objects
+            context_sql = f"""
+                (
+                    SELECT
+                        CASE WHEN _pga_raw.context IS NOT NULL THEN COALESCE(
+                            jsonb_object_agg(COALESCE(_pga_alias.key, _pga_context.key), _pga_context.value)
+                                FILTER (WHERE _pga_context.key IS NOT NULL),
+                            '{{}}'::jsonb
+                        ) END
+                    FROM (SELECT {context_sql} AS context) AS _pga_raw
+                    LEFT JOIN LATERAL jsonb_each(_pga_raw.context) AS _pga_context ON TRUE
+                    LEFT JOIN (VALUES {aliases_sql}) AS _pga_alias(alias, key)
+                        ON _pga_alias.alias = _pga_context.key
+                    GROUP BY _pga_raw.context
+                )
+            """  # noqa
+
+        return context_sql
+
+    def get_query_sql(self):
+        # The context comment is always followed by a newline
+        return f"""
+            CASE
+                WHEN STARTS_WITH(query, '{_context_prefix}{{') AND STRPOS(query, '*/') > 0
+                THEN SUBSTRING(query, STRPOS(query, '*/') + 3)
+                ELSE query
+            END
+        """
+
+    def get_normalized_query_sql(self):
+        # Mirrors utils.fingerprint. Postgres uses "\y" for word boundaries
+        sql = self.get_query_sql()
+        for pattern, replacement, flags in utils.fingerprint_patterns:
+            pattern = pattern.replace(r"\b", r"\y")
+            sql = (
+                f"REGEXP_REPLACE({sql}, {_quote(pattern)}, {_quote(replacement)},"
+                f" {_quote('g' + flags)})"
+            )
+
+        return f"TRIM({sql})"
+
+    def get_datname_sql(self):
+        return _quote(settings.DATABASES[self.using]["NAME"])
+
+    def get_pid_clause(self, column="pid"):
+        pid_clause = ""
+        if self.query.pids:
+            pid_clause = f"AND {column} IN ({', '.join(str(pid) for pid in self.query.pids)})"
+
+        return pid_clause
+
+    def as_sql(self, *args, **kwargs):
+        """
+        Return the CTEs of the table to facilitate queries
+        """
+        sql, params = super().as_sql(*args, **kwargs)
+
+        # Only compute the columns referenced by the query
+        used_columns = set(re.findall(r'\."(\w+)"', sql))
+        ctes, cte_params = self.get_ctes(used_columns)
+
+        return "WITH " + ", ".join(ctes) + sql, (*cte_params, *params)
+
+
+class PGActivityQueryCompiler(PGTableQueryCompiler):
+    # Filters on these columns are repeated inside of the CTE so that
+    # rows are discarded before any other expression is computed
+    pushdown_columns = {
+        "id": "pid",
+        "state": "UPPER(REPLACE(state, ' ', '_'))",
+        "backend_type": "UPPER(REPLACE(backend_type, ' ', '_'))",
+    }
+
+    def get_columns(self):
+        """Return the CTE columns and the SQL expressions that compute them"""
+        return {
+            "id": "pid",
+            "start": "query_start",
+            "duration": "NOW() - query_start",
+            "context": self.get_context_sql(),
+            "query": self.get_query_sql(),
+            "state": "UPPER(REPLACE(state, ' ', '_'))",
+            "xact_start": "xact_start",
+            "backend_start": "backend_start",
+            "backend_xid": "backend_xid::text",
+            "backend_xmin": "backend_xmin::text",
+            "backend_type": "UPPER(REPLACE(backend_type, ' ', '_'))",
+            "wait_event_type": (
+                r"TRIM(BOTH '_' FROM UPPER(REGEXP_REPLACE(wait_event_type, '([A-Z])','_\1', 'g')))"
+            ),
+            "wait_event": (
+                r"TRIM(BOTH '_' FROM UPPER(REGEXP_REPLACE(wait_event, '([A-Z])','_\1', 'g')))"
+            ),
+            "state_change": "state_change",
+            "application_name": "application_name",
+            "client_addr": "client_addr::text",
+            "client_hostname": "client_hostname",
+            "client_port": "client_port",
+            # query_id was added in Postgres 14
+            "query_id": "query_id" if self.connection.pg_version >= 140000 else "NULL::bigint",
+            # The normalized query is computed once per row in a lateral subquery
+            "normalized_query": "_pga_normalized.normalized_query",
+            "fingerprint": "LEFT(MD5(_pga_normalized.normalized_query), 16)",
+        }
+
+    def get_ctes(self, used_columns=None):
+        """Return the CTEs and their params.
+
+        Only the columns in ``used_columns`` are computed. All columns
+        are computed if ``used_columns`` is ``None``.
+        """
+        columns = {
+            column: expression
+            for column, expression in self.get_columns().items()
+            if used_columns is None or column == "id" or column in used_columns
+        }
+        select_sql = ",\n                    ".join(
+            f"{expression} AS {column}" for column, expression in columns.items()
+        )
+        normalized_sql = ""
+        if {"normalized_query", "fingerprint"} & set(columns):
+            # OFFSET 0 keeps Postgres from inlining the expression into every
+            # column that references it
+            normalized_sql = (
+                f"CROSS JOIN LATERAL (SELECT {self.get_normalized_query_sql()}"
+                " AS normalized_query OFFSET 0) AS _pga_normalized"
+            )
+
+        pushdown_sql, pushdown_params = self.get_pushdown_clause()
         return [
-            rf"""
+            f"""
             _pgactivity_activity_cte AS (
                 SELECT
-                    pid AS id,
-                    query_start AS start,
-                    NOW() - query_start AS duration,
-                    RTRIM(
-                        LTRIM(
-                            (REGEXP_MATCH(query, '{context_re}'))[1],
-                            '/*pga_context='
-                        ),
-                        '*/'
-                    )::jsonb AS context,
-                    REGEXP_REPLACE(query, '{context_re}\n', '') AS query,
-                    UPPER(REPLACE(state, ' ', '_')) AS state,
-                    xact_start,
-                    backend_start,
-                    backend_xid::text,
-                    backend_xmin::text,
-                    UPPER(REPLACE(backend_type, ' ', '_')) AS backend_type,
-                    TRIM(
-                        BOTH '_' FROM UPPER(REGEXP_REPLACE(wait_event_type, '([A-Z])','_\1', 'g'))
-                    ) AS wait_event_type,
-                    TRIM(
-                        BOTH '_' FROM UPPER(REGEXP_REPLACE(wait_event, '([A-Z])','_\1', 'g'))
-                    ) AS wait_event,
-                    state_change,
-                    application_name,
-                    client_addr::text,
-                    client_hostname,
-                    client_port
-                    FROM pg_stat_activity
+                    {select_sql}
+                FROM pg_stat_activity
+                {normalized_sql}
                 WHERE
-                    datname = '{settings.DATABASES[self.using]["NAME"]}'
+                    datname = {self.get_datname_sql()}
                     {self.get_pid_clause()}
+                    {pushdown_sql}
             )
             """
-        ]
+        ], pushdown_params
 
-    def get_pid_clause(self):
-        pid_clause = ""
-        if self.query.pids:
-            pid_clause = f"AND pid IN ({', '.join(str(pid) for pid in self.query.pids)})"
+    def get_pushdown_clause(self):
+        """Repeat simple filters on raw columns inside of the CTE"""
+        where = self.query.where
+        if where.connector != AND or where.negated:
+            return "", []
 
-        return pid_clause
+        clauses, params = [], []
+        for child in where.children:
+            if not isinstance(child, (Exact, In)) or not isinstance(child.lhs, Col):
+                continue
 
-    def as_sql(self, *args, **kwargs):
-        """
-        Return a CTE for the pg_stat_activity to facilitate queries
+            expression = self.pushdown_columns.get(child.lhs.target.column)
+            if isinstance(child, In) and isinstance(child.rhs, (list, tuple, set, frozenset)):
+                values = [val for val in child.rhs if val is not None]
+            elif isinstance(child, Exact):
+                values = [child.rhs]
+            else:
+                continue
+
+            if expression and values and all(isinstance(val, (str, int)) for val in values):
+                clauses.append(f"AND {expression} IN ({', '.join(['%s'] * len(values))})")
+                params.extend(values)
+
+        return "\n                    ".join(clauses), params
+
+
+class PGBlockingQueryCompiler(PGTableQueryCompiler):
+    def get_ctes(self, used_columns=None):
+        """Return a recursive CTE of the lock-wait tree.
+
+        Blocked processes are found with ``pg_blocking_pids``, which is only
+        called for processes waiting on a lock. Every tree starts at a root
+        process that is not blocked itself.
         """
-        ctes = "WITH " + ", ".join(self.get_ctes())
+        return [
+            rf"""
+            _pgactivity_blocking_cte AS (
+                WITH RECURSIVE
+                    _pga_waiting_locks AS (
+                        SELECT DISTINCT ON (pid)
+                            pid,
+                            mode,
+                            locktype,
+                            relation::regclass::text AS relation
+                        FROM pg_locks
+                        WHERE NOT granted
+                        ORDER BY pid
+                    ),
+                    _pga_edges AS (
+                        SELECT
+                            pg_stat_activity.pid,
+                            _pga_blocking.pid AS blocking_pid
+                        FROM pg_stat_activity
+                        CROSS JOIN LATERAL
+                            UNNEST(pg_blocking_pids(pg_stat_activity.pid)) AS _pga_blocking(pid)
+                        WHERE
+                            datname = {self.get_datname_sql()}
+                            AND wait_event_type = 'Lock'
+                    ),
+                    _pga_tree(id, blocked_by, root, depth, path) AS (
+                        SELECT DISTINCT blocking_pid, NULL::integer, blocking_pid, 0, ARRAY[blocking_pid]
+                        FROM _pga_edges
+                        WHERE blocking_pid NOT IN (SELECT pid FROM _pga_edges)
+                        UNION ALL
+                        SELECT
+                            _pga_edges.pid,
+                            _pga_edges.blocking_pid,
+                            _pga_tree.root,
+                            _pga_tree.depth + 1,
+                            _pga_tree.path || _pga_edges.pid
+                        FROM _pga_edges
+                        JOIN _pga_tree ON _pga_edges.blocking_pid = _pga_tree.id
+                        WHERE NOT _pga_edges.pid = ANY(_pga_tree.path)
+                    )
+                SELECT
+                    _pga_tree.id,
+                    _pga_tree.blocked_by,
+                    _pga_tree.root,
+                    _pga_tree.depth,
+                    _pga_tree.path,
+                    _pga_waiting_locks.mode AS lock_mode,
+                    _pga_waiting_locks.locktype AS lock_type,
+                    _pga_waiting_locks.relation,
+                    UPPER(REPLACE(state, ' ', '_')) AS state,
+                    NOW() - query_start AS duration,
+                    {self.get_context_sql()} AS context,
+                    {self.get_query_sql()} AS query
+                FROM _pga_tree
+                LEFT JOIN pg_stat_activity ON pg_stat_activity.pid = _pga_tree.id
+                LEFT JOIN _pga_waiting_locks
+                    ON _pga_waiting_locks.pid = _pga_tree.id AND _pga_tree.blocked_by IS NOT NULL
+                WHERE TRUE {self.get_pid_clause('_pga_tree.id')}
+            )
+            """  # noqa
+        ], []
+
+
+# The schemas of pg_stat_statements, keyed by database alias. Databases
+# without the extension aren't cached so that it can be installed later
+_pg_stat_statements_schemas = {}
+
+
+def _pg_stat_statements_schema(using):
+    if using not in _pg_stat_statements_schemas:
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT nspname
+                FROM pg_extension
+                JOIN pg_namespace ON pg_namespace.oid = pg_extension.extnamespace
+                WHERE extname = 'pg_stat_statements'
+                """
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+
+            _pg_stat_statements_schemas[using] = row[0]
+
+    return _pg_stat_statements_schemas[using]
 
-        sql, params = super().as_sql(*args, **kwargs)
-        return ctes + sql, params
+
+class PGStatementQueryCompiler(PGTableQueryCompiler):
+    # Counters are summed across users and nesting levels so that every
+    # normalized query has one row
+    counter_columns = [
+        "calls",
+        "rows",
+        "shared_blks_hit",
+        "shared_blks_read",
+        "temp_blks_written",
+    ]
+
+    def get_ctes(self, used_columns=None):
+        """Return the CTE of pg_stat_statements for the current database.
+
+        When the extension isn't installed, the CTE is an empty relation.
+        """
+        schema = _pg_stat_statements_schema(self.using)
+        if schema is None:
+            counters_sql = ", ".join(f"NULL::bigint AS {col}" for col in self.counter_columns)
+            return [
+                f"""
+                _pgactivity_statement_cte AS (
+                    SELECT
+                        NULL::bigint AS id,
+                        NULL::text AS query,
+                        {counters_sql},
+                        NULL::float8 AS total_exec_time,
+                        NULL::float8 AS mean_exec_time
+                    WHERE FALSE
+                )
+                """
+            ], []
+
+        counters_sql = ", ".join(f"SUM({col})::bigint AS {col}" for col in self.counter_columns)
+        # Postgres 12 and lower name the execution time "total_time"
+        time_col = "total_exec_time" if self.connection.pg_version >= 130000 else "total_time"
+        return [
+            f"""
+            _pgactivity_statement_cte AS (
+                SELECT
+                    queryid AS id,
+                    MIN(query) AS query,
+                    {counters_sql},
+                    SUM({time_col}) AS total_exec_time,
+                    SUM({time_col}) / NULLIF(SUM(calls), 0) AS mean_exec_time
+                FROM {connections[self.using].ops.quote_name(schema)}.pg_stat_statements
+                WHERE
+                    dbid = (SELECT oid FROM pg_database WHERE datname = {self.get_datname_sql()})
+                    AND queryid IS NOT NULL
+                GROUP BY queryid
+            )
+            """
+        ], []
 
 
 class PGTableQuery(Query):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, compiler_class=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.pids = None
+        self.compiler_class = compiler_class
 
     def get_compiler(self, *args, **kwargs):
         compiler = super().get_compiler(*args, **kwargs)
-        compiler.__class__ = PGTableQueryCompiler
+        compiler.__class__ = self.compiler_class
         return compiler
 
     def __chain(self, _name, klass=None, *args, **kwargs):
         clone = getattr(super(), _name)(self.__class__, *args, **kwargs)
         clone.pids = self.pids
+        clone.compiler_class = self.compiler_class
         return clone
 
     def chain(self, klass=None):
@@ -104,9 +416,11 @@ class PGTableQuerySet(models.QuerySet):
     query much more efficient.
     """
 
+    compiler_class = PGTableQueryCompiler
+
     def __init__(self, model=None, query=None, using=None, hints=None):
         if query is None:
-            query = PGTableQuery(model)
+            query = PGTableQuery(model, compiler_class=self.compiler_class)
 
         super().__init__(model, query, using, hints)
 
@@ -116,19 +430,211 @@ class PGTableQuerySet(models.QuerySet):
         qs.query.pids = [int(pid) for pid in pids]
         return qs
 
+    def _get_ordering(self):
+        """Return the (field, descending) pairs of the queryset's ordering"""
+        ordering = []
+        for order_by in self.query.order_by or self.model._meta.ordering:
+            if isinstance(order_by, str):
+                ordering.append((order_by.lstrip("-"), order_by.startswith("-")))
+            elif isinstance(order_by, OrderBy) and isinstance(order_by.expression, F):
+                ordering.append((order_by.expression.name, order_by.descending))
+            else:
+                raise ValueError(f"Cannot order results across databases by {order_by}")
+
+        return ordering
+
+    def _get_value(self, row, field):
+        if isinstance(row, dict):
+            return row[field]
+        elif isinstance(row, tuple):
+            return row[self._fields.index(field)]
+        else:
+            return getattr(row, field)
+
+    def across(self, *aliases: str) -> List[Tuple[str, Any]]:
+        """Evaluate the queryset on multiple databases concurrently.
+
+        Every database is queried from its own thread, so the time taken
+        is bounded by the slowest database. Results are merged using the
+        ordering of the queryset. If the queryset is sliced, the slice is
+        applied to the merged results.
+
+        Args:
+            *aliases: The database aliases. Defaults to every Postgres
+                database in ``settings.DATABASES``.
+
+        Returns:
+            ``(alias, row)`` pairs for every result.
+        """
+        aliases = aliases or [
+            alias
+            for alias, db in settings.DATABASES.items()
+            if "postgresql" in db.get("ENGINE", "") or "postgis" in db.get("ENGINE", "")
+        ]
+        ordering = self._get_ordering()
+        if self._fields and not {field for field, _ in ordering} <= set(self._fields):
+            raise ValueError(
+                "Fields that are ordered by must be selected to order across databases"
+            )
+
+        low_mark, high_mark = self.query.low_mark, self.query.high_mark
+        qs = self._chain()
+        qs.query.clear_limits()
+        if high_mark is not None:
+            qs = qs[:high_mark]
+
+        def fetch(alias):
+            try:
+                return [(alias, row) for row in qs.using(alias)]
+            finally:
+                connections.close_all()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(aliases) or 1) as executor:
+            results = [row for rows in executor.map(fetch, aliases) for row in rows]
+
+        # Sort by each field from last to first. Sorts are stable, so
+        # earlier fields take precedence. Nulls are always last
+        for field, descending in reversed(ordering):
+            values = [(self._get_value(row, field), (alias, row)) for alias, row in results]
+            non_null = [item for item in values if item[0] is not None]
+            non_null.sort(key=lambda item: item[0], reverse=descending)
+            results = [item[1] for item in non_null] + [
+                item[1] for item in values if item[0] is None
+            ]
+
+        return results[low_mark:high_mark]
+
 
 class PGActivityQuerySet(PGTableQuerySet):
     """The Queryset for the `PGActivity` model."""
 
+    compiler_class = PGActivityQueryCompiler
+
+    def signal(
+        self,
+        method: str,
+        *,
+        timeout: Union[dt.timedelta, int, float, str, None] = None,
+    ) -> List[Tuple[int, bool]]:
+        """Cancel or terminate filtered activity and report the outcome of every process.
+
+        Activity is filtered and signaled in one statement.
+
+        Args:
+            method: Either "cancel" or "terminate".
+            timeout: When terminating, wait for processes to exit for up to
+                this long. Requires Postgres 14.
+
+        Returns:
+            ``(pid, succeeded)`` pairs for every filtered process
+
+        Raises:
+            ValueError: When a timeout is supplied on Postgres 13 or lower.
+        """
+        signal_sql = core._signal_sql(method, "_pga_signal.id", timeout, using=self.db)
+        pids = self.values_list("id", flat=True)
+        sql, params = pids.query.get_compiler(using=self.db).as_sql()
+
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f"SELECT _pga_signal.id, {signal_sql} FROM ({sql}) AS _pga_signal", params
+            )
+            return [(pid, bool(succeeded)) for pid, succeeded in cursor.fetchall()]
+
     def cancel(self) -> List[int]:
-        """Cancel filtered activity."""
-        pids = list(self.values_list("id", flat=True))
-        return core.cancel(*pids, using=self.db)
+        """Cancel filtered activity.
+
+        Returns:
+            The filtered process IDs. Use ``signal`` for the outcome of every
+            process.
+        """
+        return [pid for pid, _ in self.signal("cancel")]
+
+    def terminate(
+        self, *, timeout: Union[dt.timedelta, int, float, str, None] = None
+    ) -> List[int]:
+        """Terminate filtered activity.
+
+        Args:
+            timeout: Wait for processes to exit for up to this long. Requires
+                Postgres 14.
+
+        Returns:
+            The filtered process IDs. Use ``signal`` for the outcome of every
+            process.
+        """
+        return [pid for pid, _ in self.signal("terminate", timeout=timeout)]
+
+    def group_by_fingerprint(self) -> models.QuerySet:
+        """Group activity by query fingerprint.
 
-    def terminate(self) -> List[int]:
-        """Terminate filtered activity."""
-        pids = list(self.values_list("id", flat=True))
-        return core.terminate(*pids, using=self.db)
+        Returns:
+            A values queryset with the ``fingerprint``, ``normalized_query``,
+            ``count``, ``total_duration``, ``mean_duration``, and ``max_duration``
+            of every group, ordered by the number of processes.
+        """
+        return (
+            self.values("fingerprint", "normalized_query")
+            .annotate(
+                count=models.Count("id"),
+                total_duration=models.Sum("duration"),
+                mean_duration=models.Avg("duration"),
+                max_duration=models.Max("duration"),
+            )
+            .order_by("-count", F("total_duration").desc(nulls_last=True))
+        )
+
+    def cached(
+        self, *, timeout: Union[dt.timedelta, int, float, str, None] = None
+    ) -> snapshots.ActivitySnapshot:
+        """Read activity from a snapshot that is shared by every process.
+
+        Snapshots are stored in the cache from ``settings.PGACTIVITY_CACHE``.
+        Only one process queries activity when the snapshot expires, and
+        the rest are served the snapshot. Filters are evaluated in memory,
+        so they must be applied to the returned snapshot.
+
+        Args:
+            timeout: How long snapshots are fresh. Defaults to
+                ``settings.PGACTIVITY_ACTIVITY_CACHE_TIMEOUT`` seconds.
+
+        Returns:
+            The activity of the snapshot, excluding the process that took it.
+
+        Raises:
+            ValueError: When the queryset is filtered.
+        """
+        if self.query.where or self.query.is_sliced:
+            raise ValueError("Filter the snapshot returned by cached() instead of the queryset.")
+
+        using = self.db
+        if timeout is None:
+            timeout = config.activity_cache_timeout()
+
+        def refresh():
+            # Normalized queries and fingerprints are computed by snapshots
+            # when they're used
+            activity = (
+                self.model.objects.using(using)
+                .exclude(id=RawSQL("pg_backend_pid()", []))
+                .values(
+                    *(
+                        field.attname
+                        for field in self.model._meta.concrete_fields
+                        if field.attname not in snapshots._computed_columns
+                    )
+                )
+            )
+            return timezone.now(), list(activity)
+
+        taken_at, rows = cache.get_or_refresh(
+            f"activity:{using}", refresh, utils.parse_interval(timeout).total_seconds()
+        )
+        if self.query.pids:
+            pids = {int(pid) for pid in self.query.pids}
+            rows = [row for row in rows if row["id"] in pids]
+
+        return snapshots.ActivitySnapshot(self.model, rows, taken_at, using=using)
 
     def config(self, name: str, **overrides: Any) -> models.QuerySet:
         """
@@ -157,6 +663,29 @@ class PGActivityQuerySet(PGTableQuerySet):
         return qset
 
 
+class PGBlockingQuerySet(PGTableQuerySet):
+    """The Queryset for the `PGBlocking` model."""
+
+    compiler_class = PGBlockingQueryCompiler
+
+
+class PGStatementQuerySet(PGTableQuerySet):
+    """The Queryset for the `PGStatement` model."""
+
+    compiler_class = PGStatementQueryCompiler
+
+    def snapshot(self) -> statements.Snapshot:
+        """Take a snapshot of the cumulative statistics of filtered statements.
+
+        Returns:
+            A snapshot that can be compared to other snapshots with
+            [pgactivity.statements.Snapshot.diff][].
+        """
+        taken_at = timezone.now()
+        rows = self.values("id", "query", *statements.COUNTERS)
+        return statements.Snapshot(taken_at, {row["id"]: row for row in rows})
+
+
 class NoObjectsManager(models.Manager):
     """
     Django's dumpdata and other commands will try to dump PG* models.
@@ -208,6 +737,13 @@ class PGActivity(PGTable):
             reverse DNS lookup of client_addr.
         client_port (models.IntegerField): TCP port number that the client is using for
             communication with this backend, or -1 if a Unix socket is used.
+        query_id (models.BigIntegerField): Identifier of the normalized query, if
+            ``compute_query_id`` is enabled. Matches ``PGStatement.id``. Always
+            ``None`` before Postgres 14.
+        normalized_query (models.TextField): The SQL without comments, with literals
+            replaced by ``?`` and lists of values collapsed.
+        fingerprint (models.CharField): A hash of the normalized SQL. Queries that only
+            differ by their values have the same fingerprint.
     """  # noqa
 
     start = models.DateTimeField()
@@ -227,6 +763,9 @@ class PGActivity(PGTable):
     client_addr = models.CharField(max_length=256, null=True)
     client_hostname = models.CharField(max_length=256, null=True)
     client_port = models.IntegerField()
+    query_id = models.BigIntegerField(null=True)
+    normalized_query = models.TextField()
+    fingerprint = models.CharField(max_length=16)
 
     objects = PGActivityQuerySet.as_manager()
 
@@ -234,3 +773,142 @@ class PGActivity(PGTable):
         managed = False
         db_table = "_pgactivity_activity_cte"
         default_manager_name = "no_objects"
+
+
+class PGBlocking(PGTable):
+    """
+    The tree of processes that are blocking one another on locks.
+
+    Blocked processes are found with Postgres's ``pg_blocking_pids`` function and joined
+    to ``pg_locks`` and ``pg_stat_activity`` in a single query. Every tree starts at a
+    root process that holds a lock but is not blocked itself. A process blocked by
+    multiple processes appears once under each of them.
+
+    Rows are ordered depth-first so that a tree can be rendered by indenting each
+    row by its depth.
+
+    Attributes:
+        id (models.IntegerField): The process ID.
+        blocked_by (models.IntegerField): The process ID blocking this process. Null for
+            root processes.
+        root (models.IntegerField): The process ID at the root of the tree.
+        depth (models.IntegerField): The depth in the tree. Root processes have a depth of 0.
+        path (ArrayField): The process IDs from the root to this process.
+        lock_mode (models.CharField): The lock mode this process is waiting to acquire,
+            such as "AccessExclusiveLock".
+        lock_type (models.CharField): The type of the lockable object, such as "relation".
+        relation (models.CharField): The name of the relation of the lock, if any.
+        state (models.CharField): The state of the query.
+        duration (models.DurationField): The duration of the query.
+        context (models.JSONField): Context tracked by ``pgactivity.context``.
+        query (models.TextField): The SQL.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    blocked_by = models.IntegerField(null=True)
+    root = models.IntegerField()
+    depth = models.IntegerField()
+    path = ArrayField(models.IntegerField())
+    lock_mode = models.CharField(max_length=64, null=True)
+    lock_type = models.CharField(max_length=64, null=True)
+    relation = models.CharField(max_length=256, null=True)
+    state = models.CharField(max_length=64, null=True)
+    duration = models.DurationField(null=True)
+    context = JSONField(null=True)
+    query = models.TextField(null=True)
+
+    objects = PGBlockingQuerySet.as_manager()
+
+    class Meta:
+        managed = False
+        db_table = "_pgactivity_blocking_cte"
+        default_manager_name = "no_objects"
+        ordering = ["root", "path"]
+
+
+class PGActivityHistory(models.Model):
+    """
+    Snapshots of ``pg_stat_activity`` recorded by the activity sampler.
+
+    The underlying table is partitioned by day on ``sampled_at``. Partitions
+    are created by the sampler and dropped once they are older than
+    ``settings.PGACTIVITY_HISTORY_RETENTION``.
+
+    Attributes:
+        sampled_at (models.DateTimeField): When the sample was taken.
+        pid (models.IntegerField): The process ID.
+        start (models.DateTimeField): The start of the query.
+        duration (models.DurationField): The duration of the query when sampled.
+        state (models.CharField): The state of the query.
+        wait_event_type (models.CharField): Type of event for which backend is waiting or null.
+        wait_event (models.CharField): Wait event name if backend is currently waiting.
+        backend_type (models.CharField): The type of backend.
+        context (models.JSONField): Context tracked by ``pgactivity.context``.
+        query (models.TextField): The SQL.
+        query_id (models.BigIntegerField): Identifier of the normalized query.
+            Matches ``PGStatement.id``.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    sampled_at = models.DateTimeField()
+    pid = models.IntegerField()
+    start = models.DateTimeField(null=True)
+    duration = models.DurationField(null=True)
+    state = models.CharField(max_length=64, null=True)
+    wait_event_type = models.CharField(max_length=32, null=True)
+    wait_event = models.CharField(max_length=64, null=True)
+    backend_type = models.CharField(max_length=64, null=True)
+    context = JSONField(null=True)
+    query = models.TextField(null=True)
+    query_id = models.BigIntegerField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["sampled_at"], name="pgactivity_history_sampled")]
+
+
+class PGStatement(PGTable):
+    """
+    Wraps the ``pg_stat_statements`` view of the
+    `pg_stat_statements extension <https://www.postgresql.org/docs/current/pgstatstatements.html>`__.
+
+    Every row is a normalized query of the current database. Statistics are cumulative
+    and summed across users. When the extension isn't installed, there are no rows.
+
+    Attributes:
+        id (models.BigIntegerField): The identifier of the normalized query. Matches the
+            ``query_id`` of ``PGActivity`` and ``PGActivityHistory``.
+        query (models.TextField): The normalized SQL.
+        calls (models.BigIntegerField): The number of times the query was executed.
+        total_exec_time (models.FloatField): The total execution time in milliseconds.
+        mean_exec_time (models.FloatField): The mean execution time in milliseconds.
+        rows (models.BigIntegerField): The total number of rows retrieved or affected.
+        shared_blks_hit (models.BigIntegerField): The number of shared block cache hits.
+        shared_blks_read (models.BigIntegerField): The number of shared blocks read.
+        temp_blks_written (models.BigIntegerField): The number of temp blocks written.
+    """  # noqa
+
+    id = models.BigIntegerField(primary_key=True)
+    query = models.TextField()
+    calls = models.BigIntegerField()
+    total_exec_time = models.FloatField()
+    mean_exec_time = models.FloatField(null=True)
+    rows = models.BigIntegerField()
+    shared_blks_hit = models.BigIntegerField()
+    shared_blks_read = models.BigIntegerField()
+    temp_blks_written = models.BigIntegerField()
+
+    objects = PGStatementQuerySet.as_manager()
+
+    class Meta:
+        managed = False
+        db_table = "_pgactivity_statement_cte"
+        default_manager_name = "no_objects"
+
+    def history(self) -> models.QuerySet:
+        """Return the sampled activity of this statement.
+
+        Requires the ``pgactivity_sample`` command to be running. Use it to find
+        the context of statements, for example
+        ``statement.history().values("context__url").annotate(count=Count("id"))``.
+        """
+        return PGActivityHistory.objects.using(self._state.db).filter(query_id=self.id)
@@ -0,0 +1,279 @@
+"""Profile where the database spends time by sampling wait events"""
+
+import collections
+import datetime as dt
+import itertools
+import time
+from typing import Counter, Dict, List, Tuple, Union
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from pgactivity import models, utils
+
+# The wait of an active backend that isn't waiting on anything
+CPU = "CPU"
+
+_profiler_ids = itertools.count()
+
+
+def fingerprint(query: str) -> str:
+    """Normalize a query so that queries differing only in values are grouped.
+
+    Comments are removed, literals and placeholders are replaced with ``?``,
+    lists of values are collapsed, and whitespace is condensed.
+
+    Example:
+        ``fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'a'")``
+        returns ``"SELECT * FROM t WHERE id IN (...) AND name = ?"``.
+    """
+    return utils.fingerprint(query)
+
+
+def _wait(wait_event_type: Union[str, None], wait_event: Union[str, None]) -> str:
+    if wait_event_type is None:
+        return CPU
+
+    return f"{wait_event_type}:{wait_event}"
+
+
+def _profile_sql(using: str):
+    """Return the SQL that selects active backends.
+
+    Only the columns needed by the profile are computed, and the state
+    filter is applied inside of the activity CTE.
+    """
+    activity = (
+        models.PGActivity.objects.using(using)
+        .filter(state="ACTIVE")
+        .values("id", "backend_type", "wait_event_type", "wait_event", "context", "query")
+    )
+    sql, params = activity.query.get_compiler(using=using).as_sql()
+    return (
+        "SELECT _pga_profile.backend_type, _pga_profile.wait_event_type,"
+        " _pga_profile.wait_event, _pga_profile.context, _pga_profile.query"
+        f" FROM ({sql}) AS _pga_profile"
+        " WHERE _pga_profile.id <> pg_backend_pid()"
+    ), params
+
+
+class Profile:
+    """Histograms of wait events collected by a ``Profiler``.
+
+    Every sample of an active backend counts once. With a sampling rate of
+    ``hz``, a count of ``n`` approximates ``n / hz`` seconds of database time.
+
+    Attributes:
+        num_samples: The number of times activity was sampled.
+        elapsed: How long activity was sampled.
+        stacks: Counts of every (backend type, fingerprint, wait event).
+        contexts: Counts of every (context key, context value, wait event).
+    """
+
+    def __init__(self):
+        self.num_samples = 0
+        self.elapsed = dt.timedelta()
+        self.stacks: Counter[Tuple[str, str, str]] = collections.Counter()
+        self.contexts: Counter[Tuple[str, str, str]] = collections.Counter()
+
+    def add(self, rows: List[tuple], context_keys: Union[List[str], None] = None) -> None:
+        """Add a sample of active backends to the profile."""
+        self.num_samples += 1
+        for backend_type, wait_event_type, wait_event, context, query in rows:
+            wait = _wait(wait_event_type, wait_event)
+            self.stacks[(backend_type, fingerprint(query or ""), wait)] += 1
+
+            # Raw cursors return contexts as JSON strings
+            for key, value in (utils.load_json(context) or {}).items():
+                if context_keys is None or key in context_keys:
+                    self.contexts[(key, str(value), wait)] += 1
+
+    def _histogram(self, counter: Dict[tuple, int], index: int) -> Dict[str, Counter[str]]:
+        histogram = collections.defaultdict(collections.Counter)
+        for stack, count in counter.items():
+            histogram[stack[index]][stack[-1]] += count
+
+        return dict(histogram)
+
+    @property
+    def waits(self) -> Counter[str]:
+        """Counts of every wait event."""
+        waits = collections.Counter()
+        for stack, count in self.stacks.items():
+            waits[stack[-1]] += count
+
+        return waits
+
+    @property
+    def by_backend_type(self) -> Dict[str, Counter[str]]:
+        """Counts of wait events per backend type."""
+        return self._histogram(self.stacks, 0)
+
+    @property
+    def by_fingerprint(self) -> Dict[str, Counter[str]]:
+        """Counts of wait events per query fingerprint."""
+        return self._histogram(self.stacks, 1)
+
+    def by_context(self, key: str) -> Dict[str, Counter[str]]:
+        """Counts of wait events per value of a context key."""
+        return self._histogram(
+            {stack[1:]: count for stack, count in self.contexts.items() if stack[0] == key}, 0
+        )
+
+    def folded(self) -> List[str]:
+        """Return the profile as folded stacks.
+
+        Every line is a semicolon-separated stack of backend type, query
+        fingerprint, and wait event followed by its count. Folded stacks
+        can be rendered with flame graph tools such as ``flamegraph.pl``
+        or speedscope.
+        """
+        return [
+            ";".join(part.replace(";", ",") for part in stack) + f" {count}"
+            for stack, count in sorted(self.stacks.items())
+        ]
+
+    def summary(self, *, min_percent: float = 1, width: int = 80) -> List[str]:
+        """Return a flame-style summary of the profile.
+
+        Backend types, query fingerprints, and wait events are shown as a
+        tree with the share of samples of every node. Nodes under
+        ``min_percent`` of samples are omitted.
+        """
+        total = sum(self.stacks.values())
+        lines = [
+            f"{self.num_samples} samples over {self.elapsed.total_seconds():.1f}s,"
+            f" {total} active backend samples"
+        ]
+        if not total:
+            return lines
+
+        def node(depth, label, count):
+            percent = 100 * count / total
+            prefix = f"{percent:5.1f}% {'  ' * depth}"
+            return (prefix + " ".join(label.split()))[:width]
+
+        def tree(counter, depth, levels):
+            children = collections.Counter()
+            for stack, count in counter.items():
+                children[stack[0]] += count
+
+            for label, count in sorted(children.items(), key=lambda item: (-item[1], item[0])):
+                if 100 * count / total < min_percent:
+                    continue
+
+                lines.append(node(depth, label, count))
+                if levels > 1:
+                    tree(
+                        {
+                            stack[1:]: count
+                            for stack, count in counter.items()
+                            if stack[0] == label
+                        },
+                        depth + 1,
+                        levels - 1,
+                    )
+
+        lines.extend(["", "Wait events"])
+        tree({(wait,): count for wait, count in self.waits.items()}, 1, 1)
+        lines.extend(["", "Backend types and queries"])
+        tree(self.stacks, 1, 3)
+
+        for key in sorted({stack[0] for stack in self.contexts}):
+            lines.extend(["", f"Context {key!r}"])
+            tree(
+                {stack[1:]: count for stack, count in self.contexts.items() if stack[0] == key},
+                1,
+                2,
+            )
+
+        return lines
+
+
+class Profiler:
+    """Sample wait events of active backends at a fixed rate.
+
+    Activity is polled with one prepared statement that only computes the
+    columns of the profile. Samples are aggregated in memory, so the only
+    load on the database is the cost of reading ``pg_stat_activity``.
+
+    Args:
+        duration: How long to profile.
+        hz: The number of samples per second.
+        context_keys: The context keys to profile. Defaults to every key.
+        using: The database to profile.
+
+    Example:
+        Profile the database for a minute::
+
+            profile = Profiler(duration="60s", hz=10).run()
+            print("\\n".join(profile.summary()))
+    """
+
+    def __init__(
+        self,
+        *,
+        duration: Union[dt.timedelta, int, float, str] = 60,
+        hz: float = 10,
+        context_keys: Union[List[str], None] = None,
+        using: str = DEFAULT_DB_ALIAS,
+    ):
+        if hz <= 0:
+            raise ValueError("hz must be positive.")
+
+        self.duration = utils.parse_interval(duration)
+        self.hz = hz
+        self.context_keys = context_keys
+        self.using = using
+        self._statement = f"pgactivity_profile_{next(_profiler_ids)}"
+        self._prepared = None
+
+    def sample(self) -> List[tuple]:
+        """Return the active backends of one sample."""
+        conn = connections[self.using]
+        conn.ensure_connection()
+
+        with conn.cursor() as cursor:
+            # Prepared statements belong to a connection, so they are prepared
+            # again if the connection was re-established
+            if self._prepared is not conn.connection:
+                sql, params = _profile_sql(self.using)
+                cursor.execute(f"PREPARE {self._statement} AS {sql}", params)
+                self._prepared = conn.connection
+
+            cursor.execute(f"EXECUTE {self._statement}")
+            return cursor.fetchall()
+
+    def run(self, profile: Union[Profile, None] = None) -> Profile:
+        """Sample activity for the duration of the profiler.
+
+        Samples are taken at a fixed cadence regardless of how long each
+        sample takes. Interrupting the profiler with ``KeyboardInterrupt``
+        stops sampling and returns the profile collected so far.
+
+        Args:
+            profile: A profile to add samples to.
+
+        Returns:
+            The profile.
+        """
+        profile = profile or Profile()
+        interval = 1 / self.hz
+        start = time.monotonic()
+        end = start + self.duration.total_seconds()
+        next_tick = start
+
+        try:
+            while True:
+                profile.add(self.sample(), self.context_keys)
+
+                next_tick += interval
+                if next_tick >= end:
+                    break
+
+                time.sleep(max(next_tick - time.monotonic(), 0))
+        except KeyboardInterrupt:  # pragma: no cover
+            pass
+        finally:
+            profile.elapsed += dt.timedelta(seconds=time.monotonic() - start)
+
+        return profile
@@ -0,0 +1,233 @@
+"""Cancel and terminate activity matching a configuration on a schedule"""
+
+import collections
+import datetime as dt
+import itertools
+import logging
+import threading
+import time
+from typing import Dict, List, Union
+
+from django.db import DatabaseError, connections
+from django.db.models.expressions import RawSQL
+
+from pgactivity import config, core, models, utils
+
+logger = logging.getLogger("pgactivity.reaper")
+
+
+class Reaper(threading.Thread):
+    """Cancel activity matching a configuration, optionally escalating to termination.
+
+    Activity from the configuration in ``settings.PGACTIVITY_CONFIGS`` is
+    evaluated every tick. Matching processes are canceled. When a grace
+    period is given, processes that still match after it are terminated.
+
+    Every tick runs one statement that filters and signals activity over
+    the same database connection. Every signal is logged to the
+    ``pgactivity.reaper`` logger with the event details in the ``pgactivity``
+    attribute of the log record.
+
+    Args:
+        config_name: The name of the configuration in
+            ``settings.PGACTIVITY_CONFIGS``.
+        interval: The time between ticks.
+        grace: How long a canceled process can keep matching before it
+            is terminated. Processes are never terminated by default.
+        limit: The maximum number of processes signaled per tick.
+        rate_limit: The maximum number of processes signaled per minute.
+            Processes due to be terminated are signaled first, followed by
+            the ones with the longest durations.
+        dry_run: Log the processes that would be signaled without
+            signaling them.
+
+    Example:
+        Cancel queries that match the "long-running" config every five
+        seconds::
+
+            reaper = Reaper("long-running", interval="5s")
+            reaper.start()
+    """
+
+    def __init__(
+        self,
+        config_name: str,
+        *,
+        interval: Union[dt.timedelta, int, float, str] = 5,
+        grace: Union[dt.timedelta, int, float, str, None] = None,
+        limit: Union[int, None] = None,
+        rate_limit: Union[int, None] = None,
+        dry_run: bool = False,
+    ):
+        super().__init__(name="pgactivity-reaper", daemon=True)
+        self.config_name = config_name
+        self.interval = utils.parse_interval(interval)
+        self.grace = utils.parse_interval(grace) if grace is not None else None
+        self.limit = limit
+        self.rate_limit = rate_limit
+        self.dry_run = dry_run
+        self.activity = models.PGActivity.objects.config(config_name)
+        self._stopped = threading.Event()
+        self._canceled: Dict[int, float] = {}
+        self._signaled = collections.deque()
+
+    def _budget(self, now):
+        if self.rate_limit is None:
+            return None
+
+        while self._signaled and now - self._signaled[0] >= 60:
+            self._signaled.popleft()
+
+        return max(self.rate_limit - len(self._signaled), 0)
+
+    def _reap_sql(self, escalate: List[int], limit: Union[int, None]):
+        activity = (
+            self.activity.exclude(id=RawSQL("pg_backend_pid()", []))
+            .order_by()
+            .values("id", "duration", "context", "query")
+        )
+        sql, params = activity.query.get_compiler(using=self.activity.db).as_sql()
+
+        # Processes due for escalation are ranked first so that the limit
+        # doesn't cut them in favor of longer-running processes
+        ranked_sql = (
+            "SELECT _pga_matched.*, row_number() OVER ("
+            "ORDER BY _pga_matched.id = ANY(%s::int[]) DESC, _pga_matched.duration DESC"
+            f") AS _pga_rank FROM ({sql}) AS _pga_matched"
+        )
+        params = [escalate, *params]
+
+        where_sql = ""
+        if limit is not None:
+            where_sql = " WHERE _pga_reap._pga_rank <= %s"
+            params.append(limit)
+
+        if self.dry_run:
+            signal_sql = "NULL"
+        else:
+            signal_sql = (
+                "CASE WHEN _pga_reap.id = ANY(%s::int[])"
+                f" THEN {core._signal_sql('terminate', '_pga_reap.id')}"
+                f" ELSE {core._signal_sql('cancel', '_pga_reap.id')} END"
+            )
+            params = [escalate, *params]
+
+        return (
+            "SELECT _pga_reap.id, _pga_reap.duration, _pga_reap.context, _pga_reap.query,"
+            f" {signal_sql} FROM ({ranked_sql}) AS _pga_reap{where_sql}"
+            " ORDER BY _pga_reap._pga_rank"
+        ), params
+
+    def reap(self) -> List[dict]:
+        """Run one tick.
+
+        Returns:
+            The events of every signaled process.
+        """
+        now = time.monotonic()
+        budget = self._budget(now)
+        if budget == 0:
+            logger.warning(
+                "Rate limit reached",
+                extra={"pgactivity": {"event": "rate_limited", "config": self.config_name}},
+            )
+            return []
+
+        escalate = [
+            pid
+            for pid, canceled_at in self._canceled.items()
+            if self.grace is not None and now - canceled_at >= self.grace.total_seconds()
+        ]
+        limit = min((val for val in (budget, self.limit) if val is not None), default=None)
+        sql, params = self._reap_sql(escalate, limit)
+
+        with connections[self.activity.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        # Processes that stopped matching no longer need to be escalated. When
+        # the limit cut the rows, unseen processes may still match and are kept
+        if limit is None or len(rows) < limit:
+            matched = {row[0] for row in rows}
+            self._canceled = {pid: at for pid, at in self._canceled.items() if pid in matched}
+
+        events = []
+        for pid, duration, context, query, succeeded in rows:
+            action = "terminate" if pid in escalate else "cancel"
+            if action == "cancel":
+                self._canceled.setdefault(pid, now)
+            else:
+                self._canceled.pop(pid, None)
+
+            self._signaled.append(now)
+            event = {
+                "event": action,
+                "config": self.config_name,
+                "pid": pid,
+                "succeeded": succeeded,
+                "dry_run": self.dry_run,
+                "duration": duration.total_seconds() if duration is not None else None,
+                "context": utils.load_json(context),
+                "query": query,
+            }
+            logger.info(
+                "%s process %s%s",
+                "Terminate" if action == "terminate" else "Cancel",
+                pid,
+                " (dry run)" if self.dry_run else "",
+                extra={"pgactivity": event},
+            )
+            events.append(event)
+
+        return events
+
+    def run(self):
+        try:
+            self.run_forever()
+        finally:
+            connections.close_all()
+
+    def run_forever(self, count: Union[int, None] = None) -> None:
+        """Run ticks until stopped or until ``count`` ticks have run.
+
+        Database errors are logged, and broken connections are
+        re-established on the next tick.
+        """
+        interval = self.interval.total_seconds()
+        next_tick = time.monotonic()
+
+        for tick in itertools.count(1):
+            try:
+                self.reap()
+            except DatabaseError:
+                logger.exception(
+                    "Failed to reap activity",
+                    extra={"pgactivity": {"event": "error", "config": self.config_name}},
+                )
+                connections[self.activity.db].close_if_unusable_or_obsolete()
+
+            if count is not None and tick >= count:
+                break
+
+            next_tick += interval
+            if self._stopped.wait(max(next_tick - time.monotonic(), 0)):
+                break
+
+    def stop(self) -> None:
+        """Stop reaping."""
+        self._stopped.set()
+
+
+def from_config(config_name: str, **overrides) -> Reaper:
+    """Create a reaper from a configuration in ``settings.PGACTIVITY_CONFIGS``.
+
+    The "interval", "grace", "limit", "rate_limit", and "dry_run" keys of the
+    configuration are used as reaper arguments.
+    """
+    cfg = {**config.get(config_name), **{k: v for k, v in overrides.items() if v is not None}}
+    kwargs = {
+        key: cfg[key]
+        for key in ("interval", "grace", "limit", "rate_limit", "dry_run")
+        if key in cfg
+    }
+    return Reaper(config_name, **kwargs)
@@ -0,0 +1,116 @@
+"""Map the threads, databases, and contexts of the process to backend process IDs"""
+
+import datetime as dt
+import threading
+from typing import Any, Dict, List, Tuple, Union
+
+from pgactivity import config, core, runtime
+
+# The backend of every thread and database alias, keyed by (thread ID, alias)
+_backends: Dict[Tuple[int, str], dict] = {}
+
+
+def _register(execute, sql, params, many, context):
+    conn = context["connection"]
+    key = (threading.get_ident(), conn.alias)
+    state = runtime._context.get()
+
+    # Entries are replaced instead of mutated so that readers in other
+    # threads never see a partially-updated entry
+    _backends[key] = entry = {
+        "thread_id": key[0],
+        "thread_name": threading.current_thread().name,
+        "database": conn.alias,
+        "pid": core._backend_pid(conn),
+        "context": state.metadata if state is not None else None,
+        "query": sql,
+        "active": True,
+        "start": dt.datetime.now(dt.timezone.utc),
+    }
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        _backends[key] = {**entry, "active": False}
+
+
+def install(connection, **kwargs):
+    """Install the registry execute wrapper on a connection.
+
+    Backends are only registered when ``settings.PGACTIVITY_REGISTRY`` is
+    ``True``. When the ``pgactivity`` app is loaded, the wrapper is installed
+    the first time a connection is opened.
+    """
+    if not config.registry():
+        return
+
+    core._install_execute_wrapper(connection, _register)
+
+
+def backends(
+    *,
+    thread: Union[threading.Thread, int, None] = None,
+    using: Union[str, None] = None,
+    context: Union[Dict[str, Any], None] = None,
+    active: Union[bool, None] = None,
+) -> List[dict]:
+    """Return the backends used by threads of the process.
+
+    Every thread has one backend per database alias. Backends of threads
+    that have exited are discarded.
+
+    Args:
+        thread: Only return backends of a thread or thread ID.
+        using: Only return backends of a database alias.
+        context: Only return backends whose last statement ran with
+            ``pgactivity.context`` metadata containing these keys and values.
+        active: Only return backends that are, or aren't, running a statement.
+
+    Returns:
+        The backends. Every backend has the ``thread_id``, ``thread_name``,
+        ``database`` alias, and ``pid``, along with the ``context``,
+        ``query``, and ``start`` of its last statement and whether the
+        statement is ``active``.
+    """
+    alive = {t.ident for t in threading.enumerate()}
+    for key in [key for key in list(_backends) if key[0] not in alive]:
+        _backends.pop(key, None)
+
+    thread_id = thread.ident if isinstance(thread, threading.Thread) else thread
+    return [
+        backend
+        for backend in list(_backends.values())
+        if (thread_id is None or backend["thread_id"] == thread_id)
+        and (using is None or backend["database"] == using)
+        and (active is None or backend["active"] == active)
+        and (
+            context is None
+            or all(
+                key in (backend["context"] or {}) and backend["context"][key] == val
+                for key, val in context.items()
+            )
+        )
+    ]
+
+
+def cancel(
+    *,
+    thread: Union[threading.Thread, int, None] = None,
+    using: Union[str, None] = None,
+    context: Union[Dict[str, Any], None] = None,
+) -> List[int]:
+    """Cancel the active statements of backends used by the process.
+
+    Backends are looked up in the registry instead of ``pg_stat_activity``.
+    Accepts the same filters as ``backends``. Every backend is canceled
+    with a connection to its own database alias.
+
+    Returns:
+        Canceled process IDs
+    """
+    pids = {}
+    for backend in backends(thread=thread, using=using, context=context, active=True):
+        pids.setdefault(backend["database"], []).append(backend["pid"])
+
+    return [
+        pid for alias, alias_pids in pids.items() for pid in core.cancel(*alias_pids, using=alias)
+    ]
@@ -1,23 +1,224 @@
 import contextlib
+import contextvars
+import copy
 import json
-import threading
+import random
+import time
 
-from django.db import connection
+from django.db import connections
 
-from pgactivity import config
+from pgactivity import config, core, utils
 
-_context = threading.local()
+_context = contextvars.ContextVar("pgactivity_context", default=None)
+_always = contextvars.ContextVar("pgactivity_always", default=False)
+_unknown = object()
 
 
-def _inject_context(execute, sql, params, many, context):
+class _State:
+    """The metadata of the current context along with its rendered SQL comment.
+
+    States are never mutated once they are visible to other tasks or threads.
+    Updating the context creates a new state.
+    """
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.comment = None
+        self.application_name = None
+        self.transport = config.context_transport()
+
+        # Sampling settings are read once per state instead of once per statement
+        min_transaction_age = config.context_min_transaction_age()
+        self.min_transaction_age = (
+            utils.parse_interval(min_transaction_age).total_seconds()
+            if min_transaction_age is not None
+            else None
+        )
+        self.sample_rate = config.context_sample_rate()
+        if self.sample_rate is None:
+            self.sample_rate = 1 if self.min_transaction_age is None else 0
+
+
+_COMMENT_PREFIX = "/*pga_context="
+_COMMENT_SUFFIX = "*/\n"
+_APPLICATION_NAME_PREFIX = "pga="
+# Postgres truncates application_name to NAMEDATALEN - 1 bytes
+_APPLICATION_NAME_MAX_BYTES = 63
+
+
+def _encode_context(metadata, max_bytes=None):
+    """Serialize metadata into compact JSON.
+
+    Keys are shortened with ``settings.PGACTIVITY_CONTEXT_KEY_ALIASES`` and
+    string values are truncated to ``settings.PGACTIVITY_CONTEXT_MAX_VALUE_LENGTH``.
+    If the result exceeds ``max_bytes``, trailing keys are dropped until it
+    fits. Returns ``None`` if not even an empty object fits.
+    """
+    aliases = config.context_key_aliases()
+    max_value_length = config.context_max_value_length()
+    encoder = config.json_encoder()
+
+    items = []
+    for key, val in metadata.items():
+        if max_value_length is not None and isinstance(val, str):
+            val = val[:max_value_length]
+
+        # Serialize each key/value pair on its own so that the byte budget
+        # can be applied without re-serializing the whole object
+        item = json.dumps({aliases.get(key, key): val}, cls=encoder, separators=(",", ":"))
+        items.append(item[1:-1])
+
+    # JSON is ASCII-encoded, so the number of characters is the number of bytes
+    size = 2 + sum(len(item) for item in items) + max(len(items) - 1, 0)
+    if max_bytes is not None:
+        while items and size > max_bytes:
+            size -= len(items.pop()) + (1 if items else 0)
+
+        if size > max_bytes:
+            return None
+
+    return "{" + ",".join(items) + "}"
+
+
+def _render_context(metadata):
     # Metadata is stored as a serialized JSON string and added as
     # a top-level comment to the SQL. This comment can be parsed
     # by the `PGActivity` model.
-    metadata_str = json.dumps(_context.value, cls=config.json_encoder())
-    sql = f"/*pga_context={metadata_str.replace('*', '-')}*/\n" + sql
+    max_bytes = config.context_max_bytes()
+    if max_bytes is not None:
+        max_bytes -= len(_COMMENT_PREFIX) + len(_COMMENT_SUFFIX)
+
+    metadata_str = _encode_context(metadata, max_bytes=max_bytes)
+    if metadata_str is None:
+        return ""
+
+    return f"{_COMMENT_PREFIX}{metadata_str.replace('*', '-')}{_COMMENT_SUFFIX}"
+
+
+def _get_comment(state):
+    # The rendered comment is cached until the metadata changes, avoiding
+    # serialization on every statement
+    if state.comment is None:
+        state.comment = _render_context(state.metadata)
+
+    return state.comment
+
+
+def _get_application_name(state):
+    if state.application_name is None:
+        max_bytes = _APPLICATION_NAME_MAX_BYTES - len(_APPLICATION_NAME_PREFIX)
+        state.application_name = _APPLICATION_NAME_PREFIX + _encode_context(
+            state.metadata, max_bytes=max_bytes
+        )
+
+    return state.application_name
+
+
+def _set_application_name(conn, application_name):
+    """Set application_name with its own statement, leaving the query text untouched"""
+    with conn.connection.cursor() as cursor:
+        if core._is_transaction_errored(cursor):
+            return False
+
+        if application_name is None:
+            cursor.execute("RESET application_name")
+        else:
+            cursor.execute("SELECT set_config('application_name', %s, false)", [application_name])
+
+    return True
+
+
+def _apply_application_name(state, conn):
+    """Set the application_name of a connection to the context if it changed.
+
+    The context is removed from application_name after the context exits.
+    """
+    application_name = _get_application_name(state) if state is not None else None
+
+    applied = getattr(conn, "_pgactivity_application_name", None)
+    if applied is not None:
+        applied_connection, applied_name, in_transaction = applied
+        if applied_connection is not conn.connection:
+            applied_name = None
+        elif in_transaction and core._is_transaction_idle(conn.connection):
+            # The transaction that set application_name may have been rolled back
+            applied_name = _unknown
+    else:
+        applied_name = None
+
+    if application_name != applied_name and _set_application_name(conn, application_name):
+        conn._pgactivity_application_name = (
+            conn.connection,
+            application_name,
+            conn.in_atomic_block or not conn.autocommit,
+        )
+
+
+def _record_transaction_start(conn):
+    """Record when the transaction of a connection started.
+
+    The transaction starts with its first statement, like the ``xact_start``
+    of ``pg_stat_activity``. Starts are keyed to the outermost atomic block,
+    and are recorded outside of contexts too, so that contexts entered in the
+    middle of a transaction see its age.
+    """
+    outermost = conn.atomic_blocks[0] if conn.atomic_blocks else None
+    start = getattr(conn, "_pgactivity_transaction_start", None)
+    if start is None or start[0] is not outermost or core._is_transaction_idle(conn.connection):
+        conn._pgactivity_transaction_start = (outermost, time.monotonic())
+
+
+def _transaction_age(conn):
+    """Return the seconds since the transaction of a connection started"""
+    if not conn.in_atomic_block:
+        return None
+
+    start = getattr(conn, "_pgactivity_transaction_start", None)
+    return time.monotonic() - start[1] if start is not None else 0
+
+
+def _should_inject(state, context):
+    if state.sample_rate >= 1 or _always.get():
+        return True
+
+    if state.min_transaction_age is not None:
+        age = _transaction_age(context["connection"])
+        if age is not None and age >= state.min_transaction_age:
+            return True
+
+    return random.random() < state.sample_rate
+
+
+def _inject_context(execute, sql, params, many, context):
+    conn = context.get("connection")
+    if conn is not None and conn.in_atomic_block:
+        _record_transaction_start(conn)
+
+    state = _context.get()
+    if state is not None and state.transport == "comment":
+        if _should_inject(state, context):
+            sql = _get_comment(state) + sql
+    elif state is not None or getattr(conn, "_pgactivity_application_name", None):
+        _apply_application_name(state, conn)
+
     return execute(sql, params, many, context)
 
 
+def install(connection, **kwargs):
+    """Install the pgactivity execute wrapper on a connection.
+
+    The wrapper is a no-op for statements executed outside of
+    ``pgactivity.context``. When the ``pgactivity`` app is loaded, it is
+    installed the first time a connection to one of the databases in
+    ``settings.PGACTIVITY_CONTEXT_DATABASES`` is opened.
+    """
+    databases = config.context_databases()
+    if databases != "__all__" and connection.alias not in databases:
+        return
+
+    core._install_execute_wrapper(connection, _inject_context)
+
+
 class context(contextlib.ContextDecorator):
     """
     A context manager that adds additional metadata to SQL statements.
@@ -31,6 +232,10 @@ class context(contextlib.ContextDecorator):
     ``pgactivity.context`` has previously been entered. Otherwise it will
     be ignored.
 
+    Context is stored in a context variable. It follows code across
+    ``asyncio`` tasks and ``asgiref.sync.sync_to_async`` calls. Use
+    ``contextvars.copy_context`` when submitting work to thread pools directly.
+
     Args:
         metadata (dict): Metadata that should be attached to the activity
             context
@@ -51,20 +256,61 @@ class context(contextlib.ContextDecorator):
 
     def __init__(self, **metadata):
         self.metadata = metadata
-        self._pre_execute_hook = None
+        self._token = None
+
+        state = _context.get()
+        if state is not None:
+            _context.set(_State({**state.metadata, **self.metadata}))
 
-        if hasattr(_context, "value"):
-            _context.value.update(**self.metadata)
+    def _recreate_cm(self):
+        # Decorated functions may run concurrently. Give each call its own token
+        return copy.copy(self)
 
     def __enter__(self):
-        if not hasattr(_context, "value"):
-            self._pre_execute_hook = connection.execute_wrapper(_inject_context)
-            self._pre_execute_hook.__enter__()
-            _context.value = self.metadata
+        state = _context.get()
+        if state is None:
+            # Connections opened before the app was loaded are not
+            # instrumented by the connection_created signal
+            for conn in connections.all(initialized_only=True):
+                if conn.connection is not None:
+                    install(conn)
+
+            state = _State(self.metadata)
+            self._token = _context.set(state)
+
+        return state.metadata
+
+    def __exit__(self, *exc):
+        if self._token:
+            _context.reset(self._token)
+            self._token = None
+
+
+class always_context(contextlib.ContextDecorator):
+    """
+    Attach context to every statement, regardless of context sampling.
+
+    Use this for slow or important code paths when
+    ``settings.PGACTIVITY_CONTEXT_SAMPLE_RATE`` or
+    ``settings.PGACTIVITY_CONTEXT_MIN_TRANSACTION_AGE`` are configured.
 
-        return _context.value
+    Example:
+        Always attach context to statements of a report::
+
+            @pgactivity.always_context()
+            def generate_report():
+                ...
+    """
+
+    def __init__(self):
+        self._token = None
+
+    def _recreate_cm(self):
+        return copy.copy(self)
+
+    def __enter__(self):
+        self._token = _always.set(True)
 
     def __exit__(self, *exc):
-        if self._pre_execute_hook:
-            delattr(_context, "value")
-            self._pre_execute_hook.__exit__(*exc)
+        _always.reset(self._token)
+        self._token = None
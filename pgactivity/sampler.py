@@ -0,0 +1,226 @@
+"""Record snapshots of pg_stat_activity into the activity history table"""
+
+import datetime as dt
+import itertools
+import logging
+import threading
+import time
+from typing import List, Union
+
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from pgactivity import config, models, utils
+
+logger = logging.getLogger("pgactivity.sampler")
+
+# The columns of PGActivityHistory that are populated from PGActivity
+_columns = {
+    "pid": "id",
+    "start": "start",
+    "duration": "duration",
+    "state": "state",
+    "wait_event_type": "wait_event_type",
+    "wait_event": "wait_event",
+    "backend_type": "backend_type",
+    "context": "context",
+    "query": "query",
+    "query_id": "query_id",
+}
+_sampler_ids = itertools.count()
+
+
+def _partition_name(day: dt.date) -> str:
+    return f"{models.PGActivityHistory._meta.db_table}_p{day:%Y%m%d}"
+
+
+def _sample_sql(using: str):
+    """
+    Return the SQL that inserts a snapshot of activity into the history table.
+
+    Rows are selected and inserted in one statement, so no rows are sent
+    to the client.
+    """
+    activity = models.PGActivity.objects.using(using).values(*_columns.values())
+    sql, params = activity.query.get_compiler(using=using).as_sql()
+    table = models.PGActivityHistory._meta.db_table
+    insert_columns = ", ".join(["sampled_at", *_columns])
+    select_columns = ", ".join(f"_pga_sample.{col}" for col in _columns.values())
+    return (
+        f"INSERT INTO {table} ({insert_columns})"
+        f" SELECT STATEMENT_TIMESTAMP(), {select_columns} FROM ({sql}) AS _pga_sample"
+        " WHERE _pga_sample.id <> pg_backend_pid()"
+    ), params
+
+
+def ensure_partitions(day: dt.date, *, using: str = DEFAULT_DB_ALIAS) -> None:
+    """Create history partitions for the day before, of, and after the given day.
+
+    Args:
+        day: The day.
+        using: The database to use.
+    """
+    table = models.PGActivityHistory._meta.db_table
+    with connections[using].cursor() as cursor:
+        for offset in (-1, 0, 1):
+            start = day + dt.timedelta(days=offset)
+            end = start + dt.timedelta(days=1)
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {_partition_name(start)}"
+                f" PARTITION OF {table}"
+                f" FOR VALUES FROM ('{start.isoformat()} 00:00:00+00')"
+                f" TO ('{end.isoformat()} 00:00:00+00')"
+            )
+
+
+def drop_expired_partitions(
+    *,
+    retention: Union[dt.timedelta, str, None] = None,
+    using: str = DEFAULT_DB_ALIAS,
+) -> List[str]:
+    """Drop history partitions that only contain activity older than the retention.
+
+    Args:
+        retention: How long history is kept. Defaults to
+            ``settings.PGACTIVITY_HISTORY_RETENTION``.
+        using: The database to use.
+
+    Returns:
+        The names of the dropped partitions.
+    """
+    retention = utils.parse_interval(retention or config.history_retention())
+    cutoff = dt.datetime.now(dt.timezone.utc) - retention
+    prefix = f"{models.PGActivityHistory._meta.db_table}_p"
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            """,
+            [models.PGActivityHistory._meta.db_table],
+        )
+        partitions = [row[0] for row in cursor.fetchall()]
+
+        dropped = []
+        for partition in sorted(partitions):
+            if not partition.startswith(prefix):  # pragma: no cover
+                continue
+
+            day = dt.datetime.strptime(partition[len(prefix) :], "%Y%m%d")
+            if day.replace(tzinfo=dt.timezone.utc) + dt.timedelta(days=1) <= cutoff:
+                cursor.execute(f"DROP TABLE {partition}")
+                dropped.append(partition)
+
+    return dropped
+
+
+class Sampler(threading.Thread):
+    """Record activity into the ``PGActivityHistory`` model at a fixed interval.
+
+    Each tick runs one prepared statement per database that selects activity
+    and inserts it into the history table. Partitions are created and expired
+    partitions are dropped when the day changes.
+
+    Args:
+        interval: The time between samples. Accepts seconds or strings
+            such as "1s" or "500ms".
+        databases: The databases to sample. Activity is stored in the database
+            from which it is sampled.
+        retention: How long history is kept. Defaults to
+            ``settings.PGACTIVITY_HISTORY_RETENTION``.
+
+    Example:
+        Sample activity every second in the background::
+
+            sampler = Sampler(interval="1s")
+            sampler.start()
+            ...
+            sampler.stop()
+    """
+
+    def __init__(
+        self,
+        interval: Union[dt.timedelta, int, float, str] = 1,
+        *,
+        databases: Union[List[str], None] = None,
+        retention: Union[dt.timedelta, str, None] = None,
+    ):
+        super().__init__(name="pgactivity-sampler", daemon=True)
+        self.interval = utils.parse_interval(interval)
+        self.databases = databases or [DEFAULT_DB_ALIAS]
+        self.retention = retention
+        self._stopped = threading.Event()
+        self._statement = f"pgactivity_sample_{next(_sampler_ids)}"
+        self._prepared = {}
+        self._partitioned = {}
+
+    def _execute_sample(self, using: str) -> int:
+        conn = connections[using]
+        conn.ensure_connection()
+
+        with conn.cursor() as cursor:
+            # Prepared statements belong to a connection, so they are prepared
+            # again if the connection was re-established
+            if self._prepared.get(using) is not conn.connection:
+                sql, params = _sample_sql(using)
+                cursor.execute(f"PREPARE {self._statement} AS {sql}", params)
+                self._prepared[using] = conn.connection
+
+            cursor.execute(f"EXECUTE {self._statement}")
+            return cursor.rowcount
+
+    def sample(self) -> int:
+        """Take a sample of every database.
+
+        Returns:
+            The number of recorded rows.
+        """
+        today = dt.datetime.now(dt.timezone.utc).date()
+        num_rows = 0
+
+        for using in self.databases:
+            if self._partitioned.get(using) != today:
+                ensure_partitions(today, using=using)
+                drop_expired_partitions(retention=self.retention, using=using)
+                self._partitioned[using] = today
+
+            num_rows += self._execute_sample(using)
+
+        return num_rows
+
+    def run(self):
+        try:
+            self.run_forever()
+        finally:
+            connections.close_all()
+
+    def run_forever(self, count: Union[int, None] = None) -> None:
+        """Take samples until stopped or until ``count`` samples are taken.
+
+        Samples are taken at a fixed cadence regardless of how long each
+        sample takes. Database errors are logged to the ``pgactivity.sampler``
+        logger, and broken connections are re-established on the next sample.
+        """
+        interval = self.interval.total_seconds()
+        next_tick = time.monotonic()
+
+        for tick in itertools.count(1):
+            try:
+                self.sample()
+            except DatabaseError:
+                logger.exception("Failed to sample activity")
+                for using in self.databases:
+                    connections[using].close_if_unusable_or_obsolete()
+
+            if count is not None and tick >= count:
+                break
+
+            next_tick += interval
+            if self._stopped.wait(max(next_tick - time.monotonic(), 0)):
+                break
+
+    def stop(self) -> None:
+        """Stop sampling."""
+        self._stopped.set()
@@ -0,0 +1,138 @@
+"""Record the slowest statements of the process, as timed by the client"""
+
+import datetime as dt
+import heapq
+import itertools
+import sys
+import threading
+import time
+from typing import List
+
+from pgactivity import config, core, runtime
+
+# Frames of these packages and modules are skipped when finding the call site
+# of a statement
+_internal_packages = ("asgiref", "contextlib", "django", "pgactivity")
+
+
+class _Buffer:
+    """A bounded min-heap of the slowest statements.
+
+    The duration of the fastest kept statement is read without a lock, so
+    statements that are too fast to be kept never acquire the lock.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.heap = []
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+
+    def accepts(self, duration):
+        heap = self.heap
+        return len(heap) < self.size or bool(heap) and duration > heap[0][0]
+
+    def add(self, duration, entry):
+        item = (duration, next(self.ids), entry)
+        with self.lock:
+            if len(self.heap) < self.size:
+                heapq.heappush(self.heap, item)
+            elif duration > self.heap[0][0]:
+                heapq.heapreplace(self.heap, item)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def _get_buffer():
+    global _buffer
+
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = _Buffer(config.slow_statements())
+
+    return _buffer
+
+
+def _call_site():
+    """Return the first frame of the stack outside of Django and pgactivity"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if not any(module == pkg or module.startswith(f"{pkg}.") for pkg in _internal_packages):
+            return f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+
+        frame = frame.f_back
+
+    return None
+
+
+def _time_statement(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        buffer = _get_buffer()
+        if buffer.accepts(duration):
+            state = runtime._context.get()
+            buffer.add(
+                duration,
+                {
+                    "duration": dt.timedelta(seconds=duration),
+                    "recorded_at": dt.datetime.now(dt.timezone.utc),
+                    "database": context["connection"].alias,
+                    "sql": sql,
+                    "many": many,
+                    "context": state.metadata if state is not None else None,
+                    "call_site": _call_site(),
+                },
+            )
+
+
+def install(connection, **kwargs):
+    """Install the timing execute wrapper on a connection.
+
+    Statements are only timed when ``settings.PGACTIVITY_SLOW_STATEMENTS``
+    is set. When the ``pgactivity`` app is loaded, the wrapper is installed
+    the first time a connection is opened.
+    """
+    if not config.slow_statements():
+        return
+
+    core._install_execute_wrapper(connection, _time_statement)
+
+
+def statements() -> List[dict]:
+    """Return the slowest statements of the process.
+
+    Up to ``settings.PGACTIVITY_SLOW_STATEMENTS`` statements are kept.
+    Durations are wall time measured around the database driver, so they
+    include network and driver latency along with server time.
+
+    Returns:
+        The slowest statements, slowest first. Every statement has its
+        ``duration``, when it was ``recorded_at``, the ``database`` alias,
+        the ``sql`` without parameters, whether it was an ``executemany``
+        call (``many``), the ``pgactivity.context`` metadata, and the
+        ``call_site`` outside of Django that executed it.
+    """
+    buffer = _get_buffer()
+    with buffer.lock:
+        items = list(buffer.heap)
+
+    return [entry for _, _, entry in sorted(items, key=lambda item: (-item[0], item[1]))]
+
+
+def reset() -> None:
+    """Discard recorded statements.
+
+    The number of kept statements is read again from
+    ``settings.PGACTIVITY_SLOW_STATEMENTS``.
+    """
+    global _buffer
+
+    with _buffer_lock:
+        _buffer = _Buffer(config.slow_statements())
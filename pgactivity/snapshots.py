@@ -0,0 +1,233 @@
+"""Filter cached snapshots of activity in memory"""
+
+import datetime as dt
+import functools
+import hashlib
+import operator
+import re
+from typing import Any, Callable, Dict, Iterator, List, Union
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import DEFAULT_DB_ALIAS, connections, models
+
+from pgactivity import utils
+
+
+def _contains(val, arg):
+    if isinstance(val, dict) and isinstance(arg, dict):
+        return all(key in val and val[key] == item for key, item in arg.items())
+
+    return arg in val
+
+
+def _icontains(val, arg):
+    return str(arg).lower() in str(val).lower()
+
+
+def _regex(val, arg):
+    return re.search(arg, str(val)) is not None
+
+
+# Lookups are only evaluated against values that aren't null, like in SQL
+_lookups: Dict[str, Callable[[Any, Any], bool]] = {
+    "exact": operator.eq,
+    "iexact": lambda val, arg: str(val).lower() == str(arg).lower(),
+    "contains": _contains,
+    "icontains": _icontains,
+    "in": lambda val, arg: val in arg,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "startswith": lambda val, arg: str(val).startswith(str(arg)),
+    "istartswith": lambda val, arg: str(val).lower().startswith(str(arg).lower()),
+    "endswith": lambda val, arg: str(val).endswith(str(arg)),
+    "iendswith": lambda val, arg: str(val).lower().endswith(str(arg).lower()),
+    "regex": _regex,
+}
+
+
+def _normalized_query(row):
+    return utils.fingerprint(row["query"]) if row["query"] is not None else None
+
+
+def _fingerprint(row):
+    normalized_query = _normalized_query(row)
+    if normalized_query is None:
+        return None
+
+    return hashlib.md5(normalized_query.encode()).hexdigest()[:16]
+
+
+# Columns that are expensive to compute in SQL. Snapshots compute them from
+# the query when they're used, matching the SQL of PGActivity
+_computed_columns = {"normalized_query": _normalized_query, "fingerprint": _fingerprint}
+
+
+@functools.lru_cache(maxsize=256)
+def _cast_interval(value, using):
+    """Parse an interval with Postgres, which accepts every interval format"""
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT %s::interval", [value])
+        return cursor.fetchone()[0]
+
+
+def _to_python(field, lookup, arg, using):
+    """Convert a filter value to the type of the field, like Django does in SQL"""
+    if field is None or lookup in ("contains", "icontains", "regex") or arg is None:
+        return arg
+
+    if lookup == "in":
+        return [_to_python(field, "exact", item, using) for item in arg]
+
+    if isinstance(field, models.DurationField) and isinstance(arg, str):
+        # Durations are compared by Postgres in SQL, so intervals such as
+        # "1 minute" are cast by Postgres if they can't be parsed here
+        try:
+            return field.to_python(arg)
+        except ValidationError:
+            pass
+
+        try:
+            return utils.parse_interval(arg)
+        except ValueError:
+            return _cast_interval(arg, using)
+
+    return field.to_python(arg)
+
+
+class ActivitySnapshot:
+    """Activity read from a cached snapshot, filtered in memory.
+
+    Create snapshots with ``PGActivity.objects.cached()``. Snapshots support
+    a subset of the queryset API. ``filter`` and ``exclude`` accept field
+    lookups such as ``state="ACTIVE"``, ``duration__gt="1m"``, or
+    ``context__url__startswith="/api/"``.
+
+    Attributes:
+        taken_at: When the snapshot was taken.
+    """
+
+    def __init__(
+        self,
+        model: type,
+        rows: List[dict],
+        taken_at: dt.datetime,
+        *,
+        using: str = DEFAULT_DB_ALIAS,
+    ):
+        self.model = model
+        self.taken_at = taken_at
+        self.using = using
+        self._rows = rows
+        self._fields = None
+
+    def _clone(self, rows: List[dict]) -> "ActivitySnapshot":
+        clone = ActivitySnapshot(self.model, rows, self.taken_at, using=self.using)
+        clone._fields = self._fields
+        return clone
+
+    def _compute(self, names, rows=None) -> None:
+        """Compute the columns that aren't selected by snapshots"""
+        for name in names:
+            compute = _computed_columns.get(name)
+            if compute is not None:
+                for row in self._rows if rows is None else rows:
+                    if name not in row:
+                        row[name] = compute(row)
+
+    def _matcher(self, key: str, arg: Any) -> Callable[[dict], bool]:
+        parts = key.split("__")
+        lookup = parts.pop() if len(parts) > 1 and parts[-1] in (*_lookups, "isnull") else "exact"
+        name, path = parts[0], parts[1:]
+        if name == "pk":
+            name = "id"
+
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist as exc:
+            raise ValueError(f'Cannot filter snapshots by "{key}"') from exc
+
+        if lookup != "isnull" and not path:
+            arg = _to_python(field, lookup, arg, self.using)
+
+        self._compute([name])
+
+        def matches(row):
+            val = row.get(name)
+            for part in path:
+                val = val.get(part) if isinstance(val, dict) else None
+
+            if lookup == "isnull":
+                return (val is None) == bool(arg)
+            elif val is None:
+                return False
+            else:
+                return _lookups[lookup](val, arg)
+
+        return matches
+
+    def _filter(self, negate: bool, kwargs: Dict[str, Any]) -> "ActivitySnapshot":
+        matchers = [self._matcher(key, arg) for key, arg in kwargs.items()]
+        return self._clone(
+            [row for row in self._rows if all(matcher(row) for matcher in matchers) is not negate]
+        )
+
+    def filter(self, **kwargs: Any) -> "ActivitySnapshot":
+        """Return activity matching every lookup."""
+        return self._filter(False, kwargs)
+
+    def exclude(self, **kwargs: Any) -> "ActivitySnapshot":
+        """Return activity that doesn't match every lookup."""
+        return self._filter(True, kwargs)
+
+    def order_by(self, *fields: str) -> "ActivitySnapshot":
+        """Order activity by fields. Prefix fields with "-" to descend.
+
+        Nulls are always last.
+        """
+        self._compute(field.lstrip("-") for field in fields)
+        rows = list(self._rows)
+        for field in reversed(fields):
+            name = field.lstrip("-")
+            non_null = [row for row in rows if row.get(name) is not None]
+            non_null.sort(key=operator.itemgetter(name), reverse=field.startswith("-"))
+            rows = non_null + [row for row in rows if row.get(name) is None]
+
+        return self._clone(rows)
+
+    def values(self, *fields: str) -> "ActivitySnapshot":
+        """Return dictionaries of fields instead of model instances."""
+        clone = self._clone(self._rows)
+        clone._fields = list(fields) or [
+            field.attname for field in self.model._meta.concrete_fields
+        ]
+        return clone
+
+    def count(self) -> int:
+        """Return the number of processes."""
+        return len(self._rows)
+
+    def _instance(self, row: dict) -> Union[models.Model, dict]:
+        if self._fields is not None:
+            return {field: row.get(field) for field in self._fields}
+
+        return self.model(**row)
+
+    def __iter__(self) -> Iterator[Union[models.Model, dict]]:
+        self._compute(self._fields or _computed_columns)
+        return (self._instance(row) for row in self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __bool__(self) -> bool:
+        return bool(self._rows)
+
+    def __getitem__(self, key: Union[int, slice]):
+        if isinstance(key, slice):
+            return self._clone(self._rows[key])
+
+        row = self._rows[key]
+        self._compute(self._fields or _computed_columns, [row])
+        return self._instance(row)
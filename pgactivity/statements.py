@@ -0,0 +1,67 @@
+"""Compare snapshots of cumulative statement statistics"""
+
+import datetime as dt
+from typing import Dict, List
+
+# The cumulative counters of PGStatement that are compared between snapshots
+COUNTERS = [
+    "calls",
+    "total_exec_time",
+    "rows",
+    "shared_blks_hit",
+    "shared_blks_read",
+    "temp_blks_written",
+]
+
+
+class Snapshot:
+    """Cumulative statement statistics at a point in time.
+
+    Take snapshots with ``PGStatement.objects.snapshot()``.
+
+    Attributes:
+        taken_at: When the snapshot was taken.
+        statements: The statistics of every statement, keyed by statement ID.
+    """
+
+    def __init__(self, taken_at: dt.datetime, statements: Dict[int, dict]):
+        self.taken_at = taken_at
+        self.statements = statements
+
+    def diff(self, earlier: "Snapshot") -> List[dict]:
+        """Return the statistics accumulated since an earlier snapshot.
+
+        Counters that decreased, such as when statistics were reset, are
+        treated as if they started from zero. Statements without calls
+        between the snapshots are omitted.
+
+        Args:
+            earlier: The earlier snapshot.
+
+        Returns:
+            The statistics of every statement, ordered by total execution
+            time. Along with the difference of every counter, each statement
+            has a ``mean_exec_time`` and a per-second rate of every counter,
+            such as ``calls_per_second``.
+        """
+        seconds = (self.taken_at - earlier.taken_at).total_seconds()
+
+        diffs = []
+        for statement_id, stats in self.statements.items():
+            before = earlier.statements.get(statement_id, {})
+            reset = stats["calls"] < before.get("calls", 0)
+
+            diff = {"id": statement_id, "query": stats["query"]}
+            for counter in COUNTERS:
+                diff[counter] = stats[counter] - (0 if reset else before.get(counter, 0))
+
+            if not diff["calls"]:
+                continue
+
+            diff["mean_exec_time"] = diff["total_exec_time"] / diff["calls"]
+            for counter in COUNTERS:
+                diff[f"{counter}_per_second"] = diff[counter] / seconds if seconds else None
+
+            diffs.append(diff)
+
+        return sorted(diffs, key=lambda diff: diff["total_exec_time"], reverse=True)
@@ -0,0 +1,57 @@
+import threading
+import time
+
+import pytest
+from django.db import connection, connections, transaction
+
+from pgactivity.models import PGActivity
+
+
+@pytest.fixture
+def other_connection():
+    """Open another connection so that there is activity to sample"""
+    conn = connections.create_connection("default")
+    conn.ensure_connection()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def blocked_processes(reraise):
+    """Block one process on a lock held by another"""
+    locked = threading.Event()
+    done = threading.Event()
+
+    @reraise.wrap
+    def hold_lock():
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("LOCK auth_user IN ACCESS EXCLUSIVE MODE")
+            locked.set()
+            done.wait(timeout=5)
+
+        connection.close()
+
+    @reraise.wrap
+    def wait_for_lock():
+        locked.wait(timeout=5)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("LOCK auth_user IN ACCESS SHARE MODE")
+
+        connection.close()
+
+    threads = [threading.Thread(target=hold_lock), threading.Thread(target=wait_for_lock)]
+    for thread in threads:
+        thread.start()
+
+    # Wait until the second process is blocked
+    for _ in range(50):  # pragma: no branch
+        if PGActivity.objects.filter(wait_event_type="LOCK").exists():
+            break
+
+        time.sleep(0.1)
+
+    yield
+
+    done.set()
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,53 @@
+import threading
+import time
+
+from django.core.cache import caches
+
+from pgactivity import cache
+
+
+def test_get_or_refresh_single_flight():
+    calls = []
+
+    def refresh():
+        calls.append(1)
+        time.sleep(0.1)
+        return len(calls)
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cache.get_or_refresh("test_single_flight", refresh, 60))
+        )
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [1] * 5
+    assert len(calls) == 1
+
+    # Expired values are refreshed
+    assert cache.get_or_refresh("test_single_flight", refresh, 0) == 2
+
+
+def test_get_or_refresh_cold_cache():
+    # Another process is refreshing a value that isn't cached yet
+    django_cache = caches["default"]
+    django_cache.add("pgactivity:test_cold_cache:lock", True)
+
+    def finish_refresh():
+        django_cache.set("pgactivity:test_cold_cache", (time.time(), "refreshed"))
+        django_cache.delete("pgactivity:test_cold_cache:lock")
+
+    def refresh():
+        raise AssertionError("Only the process holding the lock refreshes")
+
+    timer = threading.Timer(0.1, finish_refresh)
+    timer.start()
+    try:
+        assert cache.get_or_refresh("test_cold_cache", refresh, 60) == "refreshed"
+    finally:
+        timer.join()
@@ -1,8 +1,22 @@
+import datetime as dt
+
 import pytest
 
-from pgactivity import config
+from pgactivity import config, utils
 
 
 def test_name_invalid():
     with pytest.raises(ValueError, match="not a valid config"):
         config.get("invalid")
+
+
+def test_parse_interval():
+    assert utils.parse_interval("500ms") == dt.timedelta(milliseconds=500)
+    assert utils.parse_interval("1.5s") == dt.timedelta(seconds=1.5)
+    assert utils.parse_interval("2") == dt.timedelta(seconds=2)
+    assert utils.parse_interval("5m") == dt.timedelta(minutes=5)
+    assert utils.parse_interval(3) == dt.timedelta(seconds=3)
+    assert utils.parse_interval(dt.timedelta(hours=1)) == dt.timedelta(hours=1)
+
+    with pytest.raises(ValueError, match="not a valid interval"):
+        utils.parse_interval("1 fortnight")
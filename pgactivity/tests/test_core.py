@@ -1,14 +1,20 @@
+import contextlib
+import time
+
 import ddf
 import pytest
 from django.contrib.auth.models import User
 from django.db import connection, transaction
-from django.db.utils import IntegrityError
+from django.db.utils import IntegrityError, OperationalError
 
 import pgactivity
+from pgactivity import core
 
 
+@pytest.mark.parametrize("defer", [False, True])
 @pytest.mark.django_db(transaction=True)
-def test_timeout():
+def test_timeout(settings, defer):
+    settings.PGACTIVITY_TIMEOUT_DEFER = defer
     ddf.G("auth.User", username="hello")
 
     def get_timeout():
@@ -54,6 +60,128 @@ def test_timeout():
 
         assert get_timeout() == "1s"
 
+    assert get_timeout() == "0"
+
+
+@pytest.mark.parametrize("defer, num_queries", [(False, 5), (True, 1)])
+@pytest.mark.django_db(transaction=True)
+def test_timeout_round_trips(django_assert_num_queries, defer, num_queries):
+    """Count the statements sent to apply and restore timeouts"""
+    with django_assert_num_queries(num_queries):
+        with pgactivity.timeout(1, defer=defer):
+            with pgactivity.timeout(2, defer=defer):
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+
+    # Restoring a timeout that was never applied is skipped
+    with django_assert_num_queries(2 if not defer else 0):
+        with pgactivity.timeout(1, defer=defer):
+            with pgactivity.timeout(1, defer=defer):
+                pass
+
+    with django_assert_num_queries(1):
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW statement_timeout")
+            assert cursor.fetchone()[0] == "0"
+
+
+@pytest.mark.parametrize("atomic", [False, True])
+@pytest.mark.django_db(transaction=True)
+def test_deferred_timeout_server_side_cursor(atomic):
+    """Deferred timeouts are applied before statements of server-side cursors"""
+    ddf.G("auth.User", username="hello")
+
+    with transaction.atomic() if atomic else contextlib.nullcontext():
+        with pgactivity.timeout(5, defer=True):
+            assert [user.username for user in User.objects.iterator()] == ["hello"]
+
+            with connection.cursor() as cursor:
+                cursor.execute("SHOW statement_timeout")
+                assert cursor.fetchone()[0] == "5s"
+
+
+@pytest.mark.django_db
+def test_deferred_timeout_with_context():
+    """The context comment stays at the start of statements with deferred timeouts"""
+    with pgactivity.context(key="value"), pgactivity.timeout(1, defer=True):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_query()")
+            assert cursor.fetchone()[0] == (
+                '/*pga_context={"key":"value"}*/\n'
+                "SET LOCAL statement_timeout = 1000; SELECT current_query()"
+            )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_deadline(django_assert_num_queries):
+    def get_timeout():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_setting('statement_timeout'), current_query()")
+            return cursor.fetchone()
+
+    with pgactivity.deadline(seconds=2):
+        # The remaining time is applied along with every statement
+        with django_assert_num_queries(1):
+            timeout, query = get_timeout()
+
+        assert 1900 < int(timeout.removesuffix("ms")) < 2000
+        assert query.startswith("SET statement_timeout = ")
+
+        # Timeouts are only sent when they change, which is every millisecond
+        time.sleep(0.002)
+        with transaction.atomic():
+            timeout, query = get_timeout()
+            assert query.startswith("SET LOCAL statement_timeout = ")
+
+        # Shorter timeouts take precedence and deadlines can't be extended
+        with pgactivity.timeout(1):
+            assert get_timeout()[0] == "1s"
+
+        with pgactivity.deadline(10):
+            assert int(get_timeout()[0].removesuffix("ms")) < 2000
+
+    # The timeout is restored along with the next statement
+    with django_assert_num_queries(1):
+        timeout, query = get_timeout()
+
+    assert timeout == "0"
+    assert query.startswith("SET statement_timeout = DEFAULT; SELECT")
+
+
+@pytest.mark.parametrize("atomic", [False, True])
+@pytest.mark.django_db(transaction=True)
+def test_deadline_server_side_cursor(atomic):
+    ddf.G("auth.User", username="hello")
+
+    with transaction.atomic() if atomic else contextlib.nullcontext():
+        with pgactivity.deadline(seconds=2):
+            assert [user.username for user in User.objects.iterator()] == ["hello"]
+
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT current_setting('statement_timeout')")
+                assert 1900 < int(cursor.fetchone()[0].removesuffix("ms")) < 2000
+
+
+@pytest.mark.django_db(transaction=True)
+def test_deadline_exceeded():
+    with pgactivity.deadline("200ms"):
+        with pytest.raises(OperationalError, match="canceling statement"):
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_sleep(1)")
+
+        # Statements fail without being sent once the deadline has passed
+        time.sleep(0.05)
+        with pytest.raises(pgactivity.DeadlineExceeded):
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+    with pytest.raises(ValueError, match="Must supply a value"):
+        with pgactivity.deadline():
+            pass
+
 
 def test_timeout_args():
     with pytest.raises(ValueError, match="Must supply a value"):
@@ -88,6 +216,39 @@ def test_terminate():
 
 
 @pytest.mark.django_db
-def test_pid():
-    pid = pgactivity.pid()
-    assert isinstance(pid, int)
+def test_pid(django_assert_num_queries):
+    # The process ID is read from the driver
+    with django_assert_num_queries(0):
+        pid = pgactivity.pid()
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid()")
+        assert cursor.fetchone()[0] == pid
+
+
+@pytest.mark.django_db(transaction=True)
+def test_signal(other_connection):
+    other_pid = other_connection.connection.get_backend_pid()
+    assert core.signal("cancel", other_pid, 1000000000) == [
+        (other_pid, True),
+        (1000000000, False),
+    ]
+
+    with pytest.raises(ValueError, match="Method"):
+        core.signal("kill", other_pid)
+
+    with pytest.raises(ValueError, match="timeout"):
+        core.signal("cancel", other_pid, timeout=1)
+
+    assert core.signal("terminate", other_pid) == [(other_pid, True)]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_signal_timeout(other_connection, monkeypatch):
+    other_pid = other_connection.connection.get_backend_pid()
+    if connection.pg_version >= 140000:
+        assert core.signal("terminate", other_pid, timeout="1s") == [(other_pid, True)]
+
+    monkeypatch.setattr(connection, "pg_version", 130016)
+    with pytest.raises(ValueError, match="Postgres 14"):
+        core.signal("terminate", other_pid, timeout="1s")
@@ -1,10 +1,13 @@
+import csv
 import io
+import json
 import random
 import threading
 import time
 
 import pytest
-from django.core.management import call_command
+from django.core.management import CommandError, call_command
+from django.core.management.base import OutputWrapper
 from django.db import connection
 from django.db.utils import OperationalError
 
@@ -177,3 +180,161 @@ def test_handle_user_input(mocker):
         cfg={"cancel": True}, num_queries=0, stdout=stdout
     )
     assert stdout.getvalue() == "No queries to cancel."
+
+
+@pytest.mark.django_db
+def test_watch(capsys, mocker):
+    mocker.patch(
+        "pgactivity.management.commands.pgactivity.get_terminal_height",
+        autospec=True,
+        return_value=24,
+    )
+    sleep = mocker.patch(
+        "pgactivity.management.commands.pgactivity.time.sleep",
+        autospec=True,
+        side_effect=[None, None, KeyboardInterrupt],
+    )
+    call_command("pgactivity", "--watch", "1s", "-o", "id", "-a", "id", "-a", "state")
+    captured = capsys.readouterr()
+
+    # The screen is cleared once and only changed lines are redrawn afterwards
+    assert captured.out.count("\033[2J") == 1
+    assert captured.out.count("\033[2;1H") >= 1
+    assert "Every 1s" in captured.out
+    sleep.assert_called_with(1.0)
+
+
+@pytest.mark.django_db
+def test_watch_scrolled_into_view(capsys, mocker, other_connection):
+    # Only one row fits in the first frame. The rest scroll into view in the
+    # second frame and were already running, so none of them are new
+    mocker.patch(
+        "pgactivity.management.commands.pgactivity.get_terminal_height",
+        autospec=True,
+        side_effect=[3, 24],
+    )
+    mocker.patch(
+        "pgactivity.management.commands.pgactivity.time.sleep",
+        autospec=True,
+        side_effect=[None, KeyboardInterrupt],
+    )
+    call_command("pgactivity", "--watch", "1s", "-o", "id", "-a", "id", "-a", "state")
+    captured = capsys.readouterr()
+
+    assert "H+ " not in captured.out
+
+
+def test_screen():
+    stdout = io.StringIO()
+    screen = pgactivity_command._Screen(OutputWrapper(stdout))
+    screen.draw(["header", "+ 1 | ACTIVE", "+ 2 | IDLE"])
+    assert stdout.getvalue() == (
+        "\033[2J\033[1;1Hheader\033[K\033[2;1H+ 1 | ACTIVE\033[K\033[3;1H+ 2 | IDLE\033[K\033[4;1H"
+    )
+
+    stdout.seek(0)
+    stdout.truncate()
+    screen.draw(["header", "~ 1 | IDLE"])
+    assert stdout.getvalue() == "\033[2;1H~ 1 | IDLE\033[K\033[3;1H\033[K\033[3;1H"
+
+
+def test_delta():
+    assert pgactivity_command._delta({"id": 1, "state": "ACTIVE"}, None) == " "
+    assert pgactivity_command._delta({"id": 1, "state": "ACTIVE"}, {2: "ACTIVE"}) == "+"
+    assert pgactivity_command._delta({"id": 1, "state": "ACTIVE"}, {1: "IDLE"}) == "~"
+    assert pgactivity_command._delta({"id": 1, "state": "ACTIVE"}, {1: "ACTIVE"}) == " "
+
+
+@pytest.mark.django_db(transaction=True)
+def test_tree(capsys, blocked_processes):
+    call_command("pgactivity", "--tree")
+    root, blocked = capsys.readouterr().out.strip().split("\n")
+    assert "| IDLE_IN_TRANSACTION |" in root
+    assert blocked.startswith("└─ ")
+    assert "AccessShareLock on auth_user | ACTIVE" in blocked
+
+
+@pytest.mark.django_db
+def test_tree_empty(capsys):
+    call_command("pgactivity", "--tree", "1")
+    assert capsys.readouterr().out == "No blocked processes.\n"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_all_databases(capsys, other_connection):
+    call_command("pgactivity", "--all-databases", "-a", "id", "-a", "state")
+    lines = capsys.readouterr().out.splitlines()
+    assert lines
+    assert all(line.startswith("default | ") for line in lines)
+
+    with pytest.raises(CommandError, match="--all-databases"):
+        call_command("pgactivity", "--all-databases", "--cancel")
+
+
+@pytest.mark.parametrize("output_format", ["json", "jsonl", "csv"])
+@pytest.mark.django_db(transaction=True)
+def test_output_formats(other_connection, output_format):
+    key = str(random.random())
+    with other_connection.cursor() as cursor:
+        cursor.execute(f'/*pga_context={{"key":"{key}"}}*/\nSELECT 1')
+
+    stdout = io.StringIO()
+    call_command(
+        "pgactivity",
+        "-f",
+        f"context__key={key}",
+        "-a",
+        "id",
+        "-a",
+        "duration",
+        "-a",
+        "context",
+        "-a",
+        "query",
+        "--format",
+        output_format,
+        stdout=stdout,
+    )
+    output = stdout.getvalue()
+    pid = other_connection.connection.get_backend_pid()
+
+    if output_format == "json":
+        [row] = json.loads(output)
+    elif output_format == "jsonl":
+        [row] = [json.loads(line) for line in output.splitlines()]
+    else:
+        [row] = list(csv.DictReader(io.StringIO(output)))
+        row["id"] = int(row["id"])
+        row["context"] = json.loads(row["context"])
+
+    assert row["id"] == pid
+    assert row["context"] == {"key": key}
+    assert row["query"] == "SELECT 1"
+    assert row["duration"].startswith("P0D")
+
+
+@pytest.mark.django_db(transaction=True)
+def test_group(capsys, other_connection):
+    marker = f"marker_{random.randint(0, 10**9)}"
+    with other_connection.cursor() as cursor:
+        cursor.execute(f"SELECT 1 AS {marker}")
+
+    call_command("pgactivity", "--group", "-f", f"normalized_query__contains={marker}")
+    [line] = capsys.readouterr().out.splitlines()
+    assert line.startswith("1 | ")
+    assert line.endswith(f" | SELECT ? AS {marker}")
+
+    call_command(
+        "pgactivity",
+        "--group",
+        "-f",
+        f"normalized_query__contains={marker}",
+        "--format",
+        "jsonl",
+    )
+    [row] = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert row["count"] == 1
+    assert len(row["fingerprint"]) == 16
+
+    with pytest.raises(CommandError, match="--group"):
+        call_command("pgactivity", "--group", "--watch", "1s")
@@ -0,0 +1,81 @@
+import pytest
+from django.core.cache import cache
+from django.db import connections
+
+from pgactivity import metrics
+from pgactivity.models import PGActivity
+
+
+@pytest.fixture
+def url_connections():
+    """Open idle connections whose last query was annotated with a url"""
+    conns = []
+    for url in ["/a/", "/a/", "/b/"]:
+        conn = connections.create_connection("default")
+        with conn.cursor() as cursor:
+            cursor.execute(f'/*pga_context={{"url":"{url}"}}*/\nSELECT 1')
+
+        conns.append(conn)
+
+    yield
+
+    for conn in conns:
+        conn.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_metrics(settings, url_connections):
+    settings.PGACTIVITY_METRICS_CACHE_TIMEOUT = 0
+    settings.PGACTIVITY_METRICS_QUANTILES = [0.5]
+
+    lines = metrics.collect().splitlines()
+    assert "# TYPE pgactivity_backends gauge" in lines
+    assert 'pgactivity_backends{context_url="/a/"} 2.0' in lines
+    assert 'pgactivity_backends{context_url="/b/"} 1.0' in lines
+    assert 'pgactivity_backends{state="IDLE"}' in {line.rsplit(" ", 1)[0] for line in lines}
+    assert any(
+        line.startswith('pgactivity_duration_seconds_max{context_url="/a/"}') for line in lines
+    )
+    assert any(
+        line.startswith('pgactivity_duration_seconds{context_url="/a/",quantile="0.5"}')
+        for line in lines
+    )
+
+    # Values beyond the cardinality limit are folded together
+    settings.PGACTIVITY_METRICS_MAX_LABEL_VALUES = 1
+    lines = metrics.collect().splitlines()
+    assert 'pgactivity_backends{context_url="/a/"} 2.0' in lines
+    assert 'pgactivity_backends{context_url="/b/"} 1.0' not in lines
+    assert any(line.startswith('pgactivity_backends{context_url="__other__"}') for line in lines)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_metrics_params(settings, mocker, url_connections):
+    """Parameters of the activity query are bound after the quantiles"""
+    settings.PGACTIVITY_METRICS_CACHE_TIMEOUT = 0
+    settings.PGACTIVITY_METRICS_QUANTILES = [0.5]
+    activity = PGActivity.objects.get_queryset()
+    mocker.patch.object(
+        PGActivity.objects, "using", lambda using: activity.filter(id__gt=0).using(using)
+    )
+
+    assert 'pgactivity_backends{context_url="/a/"} 2.0' in metrics.collect().splitlines()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_metrics_cached(settings, django_assert_num_queries):
+    settings.PGACTIVITY_METRICS_CACHE_TIMEOUT = 60
+    cache.clear()
+
+    with django_assert_num_queries(1):
+        assert metrics.collect() == metrics.collect()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_metrics_view(client, settings):
+    settings.PGACTIVITY_METRICS_CACHE_TIMEOUT = 0
+
+    response = client.get("/pgactivity/metrics/")
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain")
+    assert b"# TYPE pgactivity_backends gauge" in response.content
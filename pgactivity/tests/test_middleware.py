@@ -1,13 +1,20 @@
+import asyncio
 import threading
 import time
+from unittest import mock
 
 import ddf
 import pytest
+from asgiref.sync import async_to_sync
+from django.core.asgi import get_asgi_application
 from django.core.management import call_command
 from django.db import connection, transaction
 from django.db.utils import OperationalError
+from django.test import AsyncClient
 
 import pgactivity
+from pgactivity import middleware
+from pgactivity.tests import urls as test_urls
 
 
 @pytest.mark.django_db
@@ -53,3 +60,135 @@ def test_middleware(client, capsys, reraise):
     lock_user_table_thread.join()
     load_admin_thread.join()
     check_middleware_thread.join()
+
+
+@pytest.mark.django_db
+def test_async_middleware():
+    response = async_to_sync(AsyncClient().get)("/async-context/")
+    assert response.json() == {
+        "task_metadata": {"url": "/async-context/", "method": "GET"},
+        "query": '/*pga_context={"url":"/async-context/","method":"GET"}*/\n'
+        "SELECT current_query()",
+    }
+
+
+@pytest.mark.parametrize(
+    "route_timeouts, expected",
+    [
+        ({}, "0"),
+        ({"statement_timeout": 2}, "2s"),
+        ({"^/statement-": 3, "^/statement-timeout/": 4}, "3s"),
+        ({"^/statement-": 3, "statement_timeout": 2}, "2s"),
+        ({"^/other/": 3, "other": 2}, "0"),
+    ],
+)
+@pytest.mark.django_db
+def test_route_timeouts(client, settings, route_timeouts, expected):
+    settings.PGACTIVITY_ROUTE_TIMEOUTS = route_timeouts
+
+    assert client.get("/statement-timeout/").json() == {"statement_timeout": expected}
+    assert async_to_sync(AsyncClient().get)("/statement-timeout/").json() == {
+        "statement_timeout": expected
+    }
+
+    # The timeout is restored after the request
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW statement_timeout")
+        assert cursor.fetchone()[0] == "0"
+
+
+def test_route_index():
+    names, regex, pattern_timeouts = middleware._route_index(
+        (("api:orders", 1), (r"^/reports/", 30), ("^/reports/(daily|weekly)/", 60))
+    )
+    assert names == {"api:orders": 1}
+    assert pattern_timeouts[regex.match("/reports/weekly/").lastgroup] == 30
+    assert regex.match("/orders/") is None
+
+
+@pytest.mark.parametrize("timeout", ["2s", 0, -1])
+def test_route_index_invalid_timeout(timeout):
+    with pytest.raises(ValueError, match="api:orders"):
+        middleware._route_index((("api:orders", timeout),))
+
+
+def test_route_index_setting_changed(settings):
+    settings.PGACTIVITY_ROUTE_TIMEOUTS = {"api:orders": 1}
+    index = middleware._get_route_index()
+    assert middleware._get_route_index() is index
+    assert index[0] == {"api:orders": 1}
+
+    settings.PGACTIVITY_ROUTE_TIMEOUTS = {"api:orders": 2}
+    assert middleware._get_route_index()[0] == {"api:orders": 2}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_request_deadline(client, settings):
+    settings.PGACTIVITY_REQUEST_DEADLINE = "2s"
+
+    timeout = client.get("/statement-timeout/").json()["statement_timeout"]
+    assert 1900 < int(timeout.removesuffix("ms")) <= 2000
+    timeout = async_to_sync(AsyncClient().get)("/statement-timeout/").json()["statement_timeout"]
+    assert 1900 < int(timeout.removesuffix("ms")) <= 2000
+
+    # Route timeouts that are shorter than the deadline take precedence
+    settings.PGACTIVITY_ROUTE_TIMEOUTS = {"statement_timeout": 1}
+    assert client.get("/statement-timeout/").json() == {"statement_timeout": "1s"}
+
+    # Server-side cursors run under the deadline
+    ddf.G("auth.User", username="hello")
+    assert client.get("/usernames/").json() == {"usernames": ["hello"]}
+
+
+async def _disconnect_during(path, after):
+    """Request a path with ASGI and disconnect the client after a delay"""
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+
+        await asyncio.sleep(after)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [],
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 1),
+    }
+    await get_asgi_application()(scope, receive, send)
+
+
+@pytest.mark.parametrize("cancel_on_disconnect", [True, False])
+@pytest.mark.django_db(transaction=True)
+def test_cancel_on_disconnect(settings, cancel_on_disconnect):
+    settings.PGACTIVITY_CANCEL_ON_DISCONNECT = cancel_on_disconnect
+    test_urls.sleep_errors.clear()
+
+    start = time.monotonic()
+    if cancel_on_disconnect:
+        async_to_sync(_disconnect_during)("/sleep/", 0.2)
+
+        # The query is canceled instead of running to completion
+        assert time.monotonic() - start < 1.5
+        [error] = test_urls.sleep_errors
+        assert isinstance(error, OperationalError)
+        assert "canceling statement" in str(error)
+    else:
+        with mock.patch.object(middleware, "_cancel_backends") as cancel_backends:
+            async_to_sync(_disconnect_during)("/sleep/", 0.2)
+
+        assert not cancel_backends.called
+        assert not test_urls.sleep_errors
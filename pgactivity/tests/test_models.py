@@ -0,0 +1,156 @@
+import random
+
+import pytest
+from django.db import connection, connections
+
+import pgactivity
+from pgactivity import utils
+from pgactivity.models import PGActivity, PGBlocking
+
+
+@pytest.mark.django_db
+def test_context_key_aliases(settings):
+    settings.PGACTIVITY_CONTEXT_KEY_ALIASES = {"url": "u", "method": "m"}
+
+    with pgactivity.context(url="/url/", method="GET", other="val"):
+        activity = PGActivity.objects.pid(pgactivity.pid()).get()
+
+    assert activity.context == {"url": "/url/", "method": "GET", "other": "val"}
+
+
+@pytest.mark.django_db
+def test_context_key_aliases_empty(settings):
+    settings.PGACTIVITY_CONTEXT_KEY_ALIASES = {"url": "u"}
+
+    with pgactivity.context():
+        activity = PGActivity.objects.pid(pgactivity.pid()).get()
+
+    assert activity.context == {}
+
+
+@pytest.mark.django_db
+def test_only_used_columns_computed():
+    activity = PGActivity.objects.filter(state="ACTIVE", backend_type__in=["CLIENT_BACKEND"])
+    sql, params = activity.values("id", "state").query.get_compiler(using="default").as_sql()
+
+    assert "jsonb" not in sql
+    assert "wait_event" not in sql
+    # Filters on raw columns are repeated inside of the CTE
+    assert "AND UPPER(REPLACE(state, ' ', '_')) IN (%s)" in sql
+    assert "AND UPPER(REPLACE(backend_type, ' ', '_')) IN (%s)" in sql
+    assert sorted(params[:2]) == sorted(params[2:]) == ["ACTIVE", "CLIENT_BACKEND"]
+
+    assert {"id": pgactivity.pid(), "state": "ACTIVE"} in activity.values("id", "state")
+
+    # Negated and OR filters are not pushed down
+    sql, params = (
+        PGActivity.objects.exclude(state="IDLE").query.get_compiler(using="default").as_sql()
+    )
+    assert "AND UPPER" not in sql
+    assert params == ("IDLE",)
+
+
+@pytest.mark.django_db
+def test_query_id(monkeypatch):
+    activity = PGActivity.objects.pid(pgactivity.pid())
+    if connection.pg_version >= 140000:
+        assert "query_id AS query_id" in str(activity.query)
+
+    # Postgres 13 doesn't have query_id
+    monkeypatch.setattr(connection, "pg_version", 130016)
+    assert "NULL::bigint AS query_id" in str(activity.query)
+    assert activity.get().query_id is None
+
+
+@pytest.mark.django_db
+def test_context_parsing():
+    rand_val = str(random.random())
+    with pgactivity.context(key=rand_val):
+        activity = PGActivity.objects.pid(pgactivity.pid()).values("context", "query").get()
+
+    assert activity["context"] == {"key": rand_val}
+    assert activity["query"].startswith("WITH")
+
+
+@pytest.mark.django_db(transaction=True)
+def test_blocking(blocked_processes):
+    root, blocked = PGBlocking.objects.all()
+
+    assert root.depth == 0
+    assert root.blocked_by is None
+    assert root.lock_mode is None
+    assert root.state == "IDLE_IN_TRANSACTION"
+    assert root.query == "LOCK auth_user IN ACCESS EXCLUSIVE MODE"
+
+    assert blocked.depth == 1
+    assert blocked.blocked_by == blocked.root == root.id
+    assert blocked.path == [root.id, blocked.id]
+    assert blocked.lock_mode == "AccessShareLock"
+    assert blocked.lock_type == "relation"
+    assert blocked.relation == "auth_user"
+    assert blocked.state == "ACTIVE"
+
+    assert list(PGBlocking.objects.pid(blocked.id).values_list("id", flat=True)) == [blocked.id]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_signal(other_connection, django_assert_num_queries):
+    other_pid = other_connection.connection.get_backend_pid()
+
+    # Activity is filtered and signaled in one statement
+    with django_assert_num_queries(1):
+        assert PGActivity.objects.pid(other_pid).signal("cancel") == [(other_pid, True)]
+
+    assert PGActivity.objects.pid(1000000000).cancel() == []
+    if connection.pg_version >= 140000:
+        assert PGActivity.objects.pid(other_pid).terminate(timeout="1s") == [other_pid]
+    else:
+        with pytest.raises(ValueError, match="Postgres 14"):
+            PGActivity.objects.pid(other_pid).terminate(timeout="1s")
+
+        assert PGActivity.objects.pid(other_pid).terminate() == [other_pid]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_across(other_connection):
+    activity = PGActivity.objects.order_by("-backend_start", "id").values("id", "backend_start")
+    # Results are merged using the ordering of the queryset
+    results = activity.across("default", "default")
+    assert len(results) >= 4
+    assert {alias for alias, _ in results} == {"default"}
+    backend_starts = [row["backend_start"] for _, row in results]
+    assert backend_starts == sorted(backend_starts, reverse=True)
+
+    # Slices are applied to the merged results
+    assert len(activity[:1].across("default", "default")) == 1
+    assert PGActivity.objects.pid(0).across() == []
+
+    with pytest.raises(ValueError, match="must be selected"):
+        activity.values("id").across()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_group_by_fingerprint(other_connection):
+    marker = f"marker_{random.randint(0, 10**9)}"
+    another_connection = connections.create_connection("default")
+    try:
+        for num, conn in enumerate([other_connection, another_connection]):
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT {num} AS {marker} WHERE 'a' IN ('{num}', 'b')")
+
+        activity = PGActivity.objects.filter(normalized_query__contains=marker)
+        assert {row.normalized_query for row in activity} == {
+            f"SELECT ? AS {marker} WHERE ? IN (...)"
+        }
+        assert len({row.fingerprint for row in activity}) == 1
+
+        # Queries are normalized once per row
+        sql = str(activity.values("normalized_query", "fingerprint").query)
+        assert sql.count("REGEXP_REPLACE(") == len(utils.fingerprint_patterns)
+
+        [group] = activity.group_by_fingerprint()
+        assert group["fingerprint"] == activity[0].fingerprint
+        assert group["count"] == 2
+        assert group["max_duration"] >= group["mean_duration"]
+    finally:
+        another_connection.close()
@@ -0,0 +1,126 @@
+import io
+import threading
+
+import pytest
+from django.core.management import call_command
+
+from pgactivity import profiler
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        (
+            "SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'a''b'",
+            "SELECT * FROM t WHERE id IN (...) AND name = ?",
+        ),
+        (
+            '/*pga_context={"key":"value"}*/\nSELECT  t1.a\n FROM t1 -- comment',
+            "SELECT t1.a FROM t1",
+        ),
+        ("INSERT INTO t VALUES ($1, $2), ($3, $4)", "INSERT INTO t VALUES (...)"),
+        ("SELECT ARRAY[1.5, 2e10] IS NULL", "SELECT ARRAY[...] IS ?"),
+    ],
+)
+def test_fingerprint(query, expected):
+    assert profiler.fingerprint(query) == expected
+
+
+def test_profile():
+    profile = profiler.Profile()
+    profile.add(
+        [
+            ("CLIENT_BACKEND", None, None, {"url": "/a/"}, "SELECT 1"),
+            ("CLIENT_BACKEND", "LOCK", "TRANSACTION_ID", {"url": "/b/"}, "SELECT 2"),
+        ]
+    )
+    profile.add(
+        [
+            ("CLIENT_BACKEND", "LOCK", "TRANSACTION_ID", {"url": "/b/", "user": 1}, "SELECT 3"),
+            ("AUTOVACUUM_WORKER", "IO", "DATA_FILE_READ", None, "autovacuum: VACUUM t"),
+        ]
+    )
+
+    assert profile.num_samples == 2
+    assert profile.waits == {"CPU": 1, "LOCK:TRANSACTION_ID": 2, "IO:DATA_FILE_READ": 1}
+    assert profile.by_backend_type == {
+        "CLIENT_BACKEND": {"CPU": 1, "LOCK:TRANSACTION_ID": 2},
+        "AUTOVACUUM_WORKER": {"IO:DATA_FILE_READ": 1},
+    }
+    assert profile.by_fingerprint["SELECT ?"] == {"CPU": 1, "LOCK:TRANSACTION_ID": 2}
+    assert profile.by_context("url") == {"/a/": {"CPU": 1}, "/b/": {"LOCK:TRANSACTION_ID": 2}}
+    assert profile.by_context("user") == {"1": {"LOCK:TRANSACTION_ID": 1}}
+
+    assert profile.folded() == [
+        "AUTOVACUUM_WORKER;autovacuum: VACUUM t;IO:DATA_FILE_READ 1",
+        "CLIENT_BACKEND;SELECT ?;CPU 1",
+        "CLIENT_BACKEND;SELECT ?;LOCK:TRANSACTION_ID 2",
+    ]
+
+    summary = profile.summary(min_percent=30)
+    assert summary[1:] == [
+        "",
+        "Wait events",
+        " 50.0%   LOCK:TRANSACTION_ID",
+        "",
+        "Backend types and queries",
+        " 75.0%   CLIENT_BACKEND",
+        " 75.0%     SELECT ?",
+        " 50.0%       LOCK:TRANSACTION_ID",
+        "",
+        "Context 'url'",
+        " 50.0%   /b/",
+        " 50.0%     LOCK:TRANSACTION_ID",
+        "",
+        "Context 'user'",
+    ]
+
+    # Only the requested context keys are profiled
+    profile = profiler.Profile()
+    profile.add([("CLIENT_BACKEND", None, None, {"url": "/a/", "user": 1}, "")], ["user"])
+    assert list(profile.contexts) == [("user", "1", "CPU")]
+
+
+@pytest.fixture
+def sleeping_connection(other_connection):
+    """Run a sleeping query with a context in another connection"""
+    thread = threading.Thread(
+        target=lambda: other_connection.connection.cursor().execute(
+            '/*pga_context={"url":"/a/"}*/\nSELECT pg_sleep(1)'
+        )
+    )
+    thread.start()
+    yield other_connection
+    thread.join()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_profiler(sleeping_connection, django_assert_num_queries):
+    activity_profiler = profiler.Profiler(duration="300ms", hz=20)
+
+    # The statement is only prepared once
+    with django_assert_num_queries(3):
+        activity_profiler.sample()
+        activity_profiler.sample()
+
+    profile = activity_profiler.run()
+    assert 3 <= profile.num_samples <= 7
+    assert profile.by_fingerprint["SELECT pg_sleep(...)"]["TIMEOUT:PG_SLEEP"] >= 1
+    assert profile.by_context("url")["/a/"]["TIMEOUT:PG_SLEEP"] >= 1
+
+    with pytest.raises(ValueError, match="hz"):
+        profiler.Profiler(hz=0)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_profile_command(sleeping_connection):
+    stdout = io.StringIO()
+    call_command("pgactivity_profile", "--duration", "200ms", "--hz", "20", stdout=stdout)
+    assert "SELECT pg_sleep(...)" in stdout.getvalue()
+    assert "TIMEOUT:PG_SLEEP" in stdout.getvalue()
+
+    stdout = io.StringIO()
+    call_command(
+        "pgactivity_profile", "--duration", "200ms", "--hz", "20", "--folded", stdout=stdout
+    )
+    assert "CLIENT_BACKEND;SELECT pg_sleep(...);TIMEOUT:PG_SLEEP " in stdout.getvalue()
@@ -0,0 +1,132 @@
+import io
+import logging
+import random
+import time
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections
+
+from pgactivity import reaper
+
+
+@pytest.fixture
+def reap_config(settings, other_connection):
+    """Configure a config that matches the other connection"""
+    key = str(random.random())
+    with other_connection.cursor() as cursor:
+        cursor.execute(f'/*pga_context={{"key":"{key}"}}*/\nSELECT 1')
+
+    settings.PGACTIVITY_CONFIGS = {"reap": {"filters": [f"context__key={key}"]}}
+    return other_connection.connection.get_backend_pid()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reaper(reap_config, django_assert_num_queries):
+    activity_reaper = reaper.Reaper("reap", grace=0)
+
+    # Every tick is one statement
+    with django_assert_num_queries(1):
+        events = activity_reaper.reap()
+
+    assert [(e["event"], e["pid"], e["succeeded"]) for e in events] == [
+        ("cancel", reap_config, True)
+    ]
+    assert events[0]["context"] == {"key": mock.ANY}
+
+    # Processes that still match after the grace period are terminated
+    events = activity_reaper.reap()
+    assert [(e["event"], e["pid"], e["succeeded"]) for e in events] == [
+        ("terminate", reap_config, True)
+    ]
+    assert activity_reaper.reap() == []
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reaper_defaults(reap_config, settings):
+    # Another process matches the config
+    key = settings.PGACTIVITY_CONFIGS["reap"]["filters"][0].split("=")[1]
+    conn = connections.create_connection("default")
+    with conn.cursor() as cursor:
+        cursor.execute(f'/*pga_context={{"key":"{key}"}}*/\nSELECT 1')
+
+    try:
+        # Processes aren't terminated unless there is a grace period
+        activity_reaper = reaper.from_config("reap")
+        for _ in range(2):
+            assert [e["event"] for e in activity_reaper.reap()] == ["cancel", "cancel"]
+
+        # The limit of the config caps the processes signaled per tick
+        settings.PGACTIVITY_CONFIGS["reap"]["limit"] = 1
+        assert len(reaper.from_config("reap").reap()) == 1
+    finally:
+        conn.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reaper_limit_escalation(reap_config, settings):
+    # Another process matches the config and has been running for less time
+    key = settings.PGACTIVITY_CONFIGS["reap"]["filters"][0].split("=")[1]
+    conn = connections.create_connection("default")
+    with conn.cursor() as cursor:
+        cursor.execute(f'/*pga_context={{"key":"{key}"}}*/\nSELECT 1')
+
+    try:
+        other_pid = conn.connection.get_backend_pid()
+
+        # Processes cut by the limit stay canceled until they can be escalated
+        activity_reaper = reaper.Reaper("reap", grace="1h", limit=1, dry_run=True)
+        activity_reaper._canceled = {other_pid: time.monotonic()}
+        assert [e["pid"] for e in activity_reaper.reap()] == [reap_config]
+        assert other_pid in activity_reaper._canceled
+
+        # Processes due for escalation are signaled before longer-running ones
+        activity_reaper = reaper.Reaper("reap", grace=0, limit=1, dry_run=True)
+        activity_reaper._canceled = {other_pid: time.monotonic()}
+        events = activity_reaper.reap()
+        assert [(e["event"], e["pid"]) for e in events] == [("terminate", other_pid)]
+    finally:
+        conn.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reaper_errors(reap_config, caplog, mocker):
+    activity_reaper = reaper.Reaper("reap", interval="1ms")
+    reap = mocker.patch.object(
+        activity_reaper, "reap", side_effect=[DatabaseError("connection lost"), []]
+    )
+    close = mocker.patch.object(connection, "close_if_unusable_or_obsolete")
+
+    # Database errors don't stop the reaper
+    with caplog.at_level(logging.ERROR, logger="pgactivity.reaper"):
+        activity_reaper.run_forever(count=2)
+
+    assert reap.call_count == 2
+    assert close.call_count == 1
+    assert caplog.records[0].pgactivity["event"] == "error"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reaper_dry_run_and_rate_limit(reap_config, caplog):
+    caplog.set_level(logging.INFO, logger="pgactivity.reaper")
+    activity_reaper = reaper.Reaper("reap", grace=0, rate_limit=1, dry_run=True)
+
+    events = activity_reaper.reap()
+    assert [(e["event"], e["pid"], e["succeeded"]) for e in events] == [
+        ("cancel", reap_config, None)
+    ]
+    assert caplog.records[-1].pgactivity["dry_run"]
+
+    assert activity_reaper.reap() == []
+    assert caplog.records[-1].pgactivity["event"] == "rate_limited"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reap_command(reap_config, settings):
+    settings.PGACTIVITY_CONFIGS["reap"]["dry_run"] = True
+    stdout = io.StringIO()
+
+    call_command("pgactivity_reap", "-c", "reap", "-i", "10ms", "-n", "2", stdout=stdout)
+    assert f"Cancel process {reap_config} (dry run)" in stdout.getvalue()
+    assert f"Terminate process {reap_config} (dry run)" not in stdout.getvalue()
@@ -0,0 +1,78 @@
+import threading
+import time
+import types
+
+import pytest
+from django.db import connection, connections
+from django.db.utils import OperationalError
+
+import pgactivity
+from pgactivity import core, registry
+
+
+@pytest.fixture
+def registered(settings):
+    """Register the backends of connections"""
+    settings.PGACTIVITY_REGISTRY = True
+    registry.install(connection)
+    yield
+    connection.execute_wrappers.remove(registry._register)
+
+
+def test_install_in_execute_wrapper(settings):
+    """Installing doesn't displace a wrapper added by connection.execute_wrapper"""
+    settings.PGACTIVITY_REGISTRY = True
+    conn = types.SimpleNamespace(alias="default", execute_wrappers=[])
+    core.install(conn)
+    conn.execute_wrappers.append(print)
+
+    registry.install(conn)
+    assert conn.execute_wrappers.pop() is print
+    assert conn.execute_wrappers == [core._apply_timeout, registry._register]
+
+
+@pytest.mark.django_db
+def test_backends(registered):
+    with pgactivity.context(url="/a/"):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+    [backend] = registry.backends(thread=threading.current_thread())
+    assert backend["pid"] == pgactivity.pid()
+    assert backend["database"] == "default"
+    assert backend["context"] == {"url": "/a/"}
+    assert backend["query"].endswith("SELECT 1")
+    assert not backend["active"]
+
+    assert registry.backends(context={"url": "/a/"}) == [backend]
+    assert registry.backends(context={"url": "/b/"}) == []
+    assert registry.backends(using="other") == []
+    assert registry.backends(active=True) == []
+
+
+@pytest.mark.django_db(transaction=True)
+def test_cancel(settings):
+    settings.PGACTIVITY_REGISTRY = True
+    errors = []
+
+    def sleep():
+        try:
+            with pgactivity.context(job="sleep"), connection.cursor() as cursor:
+                cursor.execute("SELECT pg_sleep(2)")
+        except OperationalError as exc:
+            errors.append(exc)
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=sleep)
+    thread.start()
+    while not registry.backends(thread=thread, active=True):  # pragma: no branch
+        time.sleep(0.01)
+
+    [backend] = registry.backends(context={"job": "sleep"}, active=True)
+    assert registry.cancel(thread=thread) == [backend["pid"]]
+    thread.join()
+    assert "canceling statement" in str(errors[0])
+
+    # Backends of exited threads are discarded
+    assert registry.backends(thread=thread) == []
@@ -0,0 +1,268 @@
+import asyncio
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection, connections, transaction
+
+import pgactivity
+from pgactivity import runtime
+from pgactivity.models import PGActivity
+
+
+def _execute(sql, params, many, context):
+    return sql
+
+
+def test_context_comment_caching():
+    with pgactivity.context(key="value") as metadata:
+        assert metadata == {"key": "value"}
+        comment = runtime._get_comment(runtime._context.get())
+        assert comment == '/*pga_context={"key":"value"}*/\n'
+        assert runtime._get_comment(runtime._context.get()) is comment
+
+        # Updating the context creates a new state with a new comment
+        pgactivity.context(other="value")
+        assert runtime._get_comment(runtime._context.get()) == (
+            '/*pga_context={"key":"value","other":"value"}*/\n'
+        )
+
+        with pgactivity.context(nested="*value*"):
+            assert runtime._inject_context(_execute, "SELECT 1", None, False, {}) == (
+                '/*pga_context={"key":"value","other":"value","nested":"-value-"}*/\n' "SELECT 1"
+            )
+
+
+@pytest.mark.parametrize("num_queries", [10000])
+def test_inject_context_benchmark(num_queries, mocker):
+    """Run statements through the execute wrapper with and without comment caching"""
+    render_context = mocker.spy(runtime, "_render_context")
+
+    def run(cached):
+        state = runtime._context.get()
+        start = time.perf_counter()
+        for _ in range(num_queries):
+            if not cached:
+                state.comment = None
+
+            runtime._inject_context(_execute, "SELECT 1", None, False, {})
+
+        return time.perf_counter() - start
+
+    with pgactivity.context(url="/some/path/", method="GET", user=1):
+        uncached_time = run(cached=False)
+        assert render_context.call_count == num_queries
+
+        runtime._context.get().comment = None
+        render_context.reset_mock()
+        cached_time = run(cached=True)
+
+    # The comment is rendered once and reused by every statement
+    assert render_context.call_count == 1
+    print(f"uncached: {uncached_time:.4f}s, cached: {cached_time:.4f}s")
+
+
+def test_context_outside_of_context():
+    assert runtime._inject_context(_execute, "SELECT 1", None, False, {}) == "SELECT 1"
+
+    # Calling context without entering it does nothing when no context is active
+    pgactivity.context(key="value")
+    assert runtime._context.get() is None
+
+
+def test_context_isolation():
+    """Context is isolated between tasks and follows sync_to_async"""
+
+    async def update_in_task():
+        pgactivity.context(task="child")
+        return runtime._context.get().metadata
+
+    async def run():
+        with pgactivity.context(key="value"):
+            child_metadata = await asyncio.create_task(update_in_task())
+            sync_metadata = await sync_to_async(lambda: runtime._context.get().metadata)()
+            return child_metadata, sync_metadata, runtime._context.get().metadata
+
+    child_metadata, sync_metadata, parent_metadata = async_to_sync(run)()
+    assert child_metadata == {"key": "value", "task": "child"}
+    assert sync_metadata == parent_metadata == {"key": "value"}
+
+    # Other threads don't see the context
+    seen = []
+    with pgactivity.context(key="value"):
+        thread = threading.Thread(target=lambda: seen.append(runtime._context.get()))
+        thread.start()
+        thread.join()
+
+    assert seen == [None]
+
+
+def test_context_decorator_reentrant():
+    @pgactivity.context(key="value")
+    def func(depth):
+        if depth:
+            return func(depth - 1)
+
+        return runtime._context.get().metadata
+
+    assert func(2) == {"key": "value"}
+    assert runtime._context.get() is None
+
+
+@pytest.mark.parametrize(
+    "databases, alias, installed",
+    [
+        (["default"], "default", True),
+        (["default"], "replica", False),
+        (["default", "replica"], "replica", True),
+        ("__all__", "replica", True),
+    ],
+)
+def test_install(settings, databases, alias, installed):
+    settings.PGACTIVITY_CONTEXT_DATABASES = databases
+    conn = types.SimpleNamespace(alias=alias, execute_wrappers=[])
+
+    runtime.install(conn)
+    runtime.install(conn)
+    assert conn.execute_wrappers == ([runtime._inject_context] if installed else [])
+
+
+@pytest.mark.django_db(transaction=True)
+def test_install_in_execute_wrapper():
+    """Connections opened inside execute_wrapper keep the user's wrapper last"""
+
+    def blocker(execute, sql, params, many, context):
+        return execute(sql, params, many, context)
+
+    def run():
+        # Threads have their own connections, which aren't instrumented yet
+        conn = connections["default"]
+        try:
+            with conn.execute_wrapper(blocker):
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+
+            with pgactivity.context(key="value"):
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT current_query()")
+                    return conn.execute_wrappers, cursor.fetchone()[0]
+        finally:
+            conn.close()
+
+    wrappers, query = ThreadPoolExecutor(max_workers=1).submit(run).result()
+    assert blocker not in wrappers
+    assert runtime._inject_context in wrappers
+    assert query.startswith("/*pga_context=")
+
+
+def test_compact_encoding(settings):
+    settings.PGACTIVITY_CONTEXT_KEY_ALIASES = {"url": "u", "method": "m"}
+    metadata = {"url": "/a/long/url/", "method": "GET", "user": 1}
+    assert runtime._render_context(metadata) == (
+        '/*pga_context={"u":"/a/long/url/","m":"GET","user":1}*/\n'
+    )
+
+    settings.PGACTIVITY_CONTEXT_MAX_VALUE_LENGTH = 5
+    assert (
+        runtime._render_context(metadata) == '/*pga_context={"u":"/a/lo","m":"GET","user":1}*/\n'
+    )
+
+    # Trailing keys are dropped until the comment fits the byte budget
+    settings.PGACTIVITY_CONTEXT_MAX_BYTES = 40
+    assert runtime._render_context(metadata) == '/*pga_context={"u":"/a/lo","m":"GET"}*/\n'
+    settings.PGACTIVITY_CONTEXT_MAX_BYTES = 19
+    assert runtime._render_context(metadata) == "/*pga_context={}*/\n"
+    settings.PGACTIVITY_CONTEXT_MAX_BYTES = 18
+    assert runtime._render_context(metadata) == ""
+
+
+def test_context_sampling(settings):
+    def num_injected():
+        with pgactivity.context(key="value"):
+            return sum(
+                runtime._inject_context(_execute, "SELECT 1", None, False, {}) != "SELECT 1"
+                for _ in range(1000)
+            )
+
+    assert num_injected() == 1000
+
+    settings.PGACTIVITY_CONTEXT_SAMPLE_RATE = 0
+    assert num_injected() == 0
+
+    settings.PGACTIVITY_CONTEXT_SAMPLE_RATE = 0.5
+    assert 300 < num_injected() < 700
+
+    # Context is always injected in slow paths
+    settings.PGACTIVITY_CONTEXT_SAMPLE_RATE = 0
+    with pgactivity.always_context():
+        assert num_injected() == 1000
+
+    assert num_injected() == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_context_min_transaction_age(settings):
+    settings.PGACTIVITY_CONTEXT_MIN_TRANSACTION_AGE = "100ms"
+
+    def current_query():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_query()")
+            return cursor.fetchone()[0]
+
+    with pgactivity.context(key="value"):
+        with transaction.atomic():
+            assert current_query() == "SELECT current_query()"
+            time.sleep(0.1)
+            assert current_query().startswith("/*pga_context=")
+
+        # Statements outside of transactions aren't sampled
+        assert current_query() == "SELECT current_query()"
+
+    # Contexts entered in the middle of a transaction see its age
+    with transaction.atomic():
+        assert current_query() == "SELECT current_query()"
+        time.sleep(0.1)
+        with pgactivity.context(key="value"):
+            assert current_query().startswith("/*pga_context=")
+
+    # Ages of earlier transactions don't carry over
+    with transaction.atomic():
+        assert current_query() == "SELECT current_query()"
+        with pgactivity.context(key="value"):
+            assert current_query() == "SELECT current_query()"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_application_name_transport(settings, mocker):
+    settings.PGACTIVITY_CONTEXT_TRANSPORT = "application_name"
+    set_application_name = mocker.spy(runtime, "_set_application_name")
+
+    def fetchone(sql):
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
+
+    with pgactivity.context(key="value"):
+        # Query text is unchanged
+        assert fetchone("SELECT current_query()") == "SELECT current_query()"
+        assert fetchone("SHOW application_name") == 'pga={"key":"value"}'
+        assert PGActivity.objects.pid(pgactivity.pid()).get().context == {"key": "value"}
+
+        # application_name is only set when the context changes
+        assert set_application_name.call_count == 1
+        pgactivity.context(other="y")
+        assert fetchone("SHOW application_name") == 'pga={"key":"value","other":"y"}'
+        assert set_application_name.call_count == 2
+
+        # Keys that don't fit in application_name are dropped
+        pgactivity.context(long="x" * 100)
+        assert fetchone("SHOW application_name") == 'pga={"key":"value","other":"y"}'
+        assert set_application_name.call_count == 2
+
+    # application_name is reset after the context exits
+    assert fetchone("SHOW application_name") == ""
+    assert fetchone("SHOW application_name") == ""
+    assert set_application_name.call_count == 3
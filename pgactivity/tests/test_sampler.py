@@ -0,0 +1,80 @@
+import datetime as dt
+import logging
+
+import pytest
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+
+from pgactivity import models, sampler
+
+
+def _partitions():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = 'pgactivity_pgactivityhistory'::regclass
+            ORDER BY child.relname
+            """
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sampler(other_connection):
+    activity_sampler = sampler.Sampler(interval="10ms")
+    activity_sampler.run_forever(count=3)
+
+    today = dt.datetime.now(dt.timezone.utc).date()
+    assert set(_partitions()) >= {
+        sampler._partition_name(today + dt.timedelta(days=offset)) for offset in (-1, 0, 1)
+    }
+    history = models.PGActivityHistory.objects.all()
+    assert len({row.sampled_at for row in history}) == 3
+    with other_connection.cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid()")
+        assert cursor.fetchone()[0] in {row.pid for row in history}
+
+    # The statement is prepared again if the connection changes
+    connection.close()
+    assert activity_sampler.sample()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sampler_errors(caplog, mocker):
+    activity_sampler = sampler.Sampler(interval="1ms")
+    sample = mocker.patch.object(
+        activity_sampler, "sample", side_effect=[DatabaseError("connection lost"), 1]
+    )
+    close = mocker.patch.object(connection, "close_if_unusable_or_obsolete")
+
+    # Database errors don't stop the sampler
+    with caplog.at_level(logging.ERROR, logger="pgactivity.sampler"):
+        activity_sampler.run_forever(count=2)
+
+    assert sample.call_count == 2
+    assert close.call_count == 1
+    assert caplog.records[0].exc_info[0] is DatabaseError
+
+
+@pytest.mark.django_db
+def test_drop_expired_partitions():
+    today = dt.datetime.now(dt.timezone.utc).date()
+    sampler.ensure_partitions(today)
+    sampler.ensure_partitions(dt.date(2020, 1, 2))
+    assert len(_partitions()) == 6
+
+    assert sampler.drop_expired_partitions(retention="2d") == [
+        sampler._partition_name(dt.date(2020, 1, day)) for day in (1, 2, 3)
+    ]
+    assert _partitions() == [
+        sampler._partition_name(today + dt.timedelta(days=offset)) for offset in (-1, 0, 1)
+    ]
+
+
+@pytest.mark.django_db
+def test_sample_command(other_connection):
+    call_command("pgactivity_sample", "--interval", "1ms", "--count", "2")
+    assert len({row.sampled_at for row in models.PGActivityHistory.objects.all()}) == 2
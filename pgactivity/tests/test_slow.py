@@ -0,0 +1,90 @@
+import types
+
+import pytest
+from django.db import connection
+
+import pgactivity
+from pgactivity import core, slow
+
+
+@pytest.fixture
+def slow_statements(settings, monkeypatch):
+    """Record the two slowest statements of the default connection"""
+    settings.PGACTIVITY_SLOW_STATEMENTS = 2
+    # Statements executed by the tests are attributed to the tests
+    monkeypatch.setattr(
+        slow,
+        "_internal_packages",
+        (
+            "asgiref",
+            "contextlib",
+            "django",
+            "pgactivity.core",
+            "pgactivity.runtime",
+            "pgactivity.slow",
+        ),
+    )
+    slow.reset()
+    slow.install(connection)
+    yield
+    connection.execute_wrappers.remove(slow._time_statement)
+    slow.reset()
+
+
+def _sleep(seconds):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_sleep(%s)", [seconds])
+
+
+@pytest.mark.django_db
+def test_slow_statements(slow_statements, settings):
+    _sleep(0.05)
+    with pgactivity.context(url="/slow/"):
+        _sleep(0.1)
+
+    for _ in range(10):
+        _sleep(0)
+
+    statements = slow.statements()
+    assert [s["duration"].total_seconds() > 0.1 for s in statements] == [True, False]
+    assert statements[0]["context"] == {"url": "/slow/"}
+    assert statements[0]["sql"].endswith("SELECT pg_sleep(%s)")
+    assert statements[0]["database"] == "default"
+    assert statements[1]["context"] is None
+    assert "test_slow.py" in statements[0]["call_site"]
+    assert statements[0]["call_site"].endswith(" in _sleep")
+
+    # The number of kept statements is read again on reset
+    settings.PGACTIVITY_SLOW_STATEMENTS = 1
+    slow.reset()
+    assert slow.statements() == []
+    _sleep(0)
+    _sleep(0)
+    assert len(slow.statements()) == 1
+
+
+def test_slow_statements_disabled():
+    buffer = slow._Buffer(0)
+    assert not buffer.accepts(10)
+
+
+def test_install_in_execute_wrapper(settings):
+    """Installing doesn't displace a wrapper added by connection.execute_wrapper"""
+    settings.PGACTIVITY_SLOW_STATEMENTS = 2
+    conn = types.SimpleNamespace(alias="default", execute_wrappers=[])
+    core.install(conn)
+    conn.execute_wrappers.append(print)
+
+    slow.install(conn)
+    assert conn.execute_wrappers.pop() is print
+    assert conn.execute_wrappers == [core._apply_timeout, slow._time_statement]
+
+
+@pytest.mark.django_db
+def test_slow_statements_view(client, slow_statements):
+    _sleep(0)
+
+    [statement] = [
+        s for s in client.get("/pgactivity/slow-statements/").json() if "pg_sleep" in s["sql"]
+    ]
+    assert statement["duration"].startswith("P0D")
@@ -0,0 +1,80 @@
+import datetime as dt
+import random
+
+import pytest
+from django.core.cache import cache
+
+import pgactivity
+from pgactivity.models import PGActivity
+
+
+@pytest.fixture
+def context_key(other_connection):
+    """Run a query with a random context key in another connection"""
+    cache.clear()
+    key = str(random.random())
+    with other_connection.cursor() as cursor:
+        cursor.execute(f'/*pga_context={{"key":"{key}","n":1}}*/\nSELECT 1')
+
+    return key, other_connection.connection.get_backend_pid()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_cached(context_key, django_assert_num_queries):
+    key, pid = context_key
+
+    # The snapshot is shared until it expires. Normalized queries aren't
+    # computed by the database
+    with django_assert_num_queries(1) as captured:
+        snapshot = PGActivity.objects.cached()
+
+    assert "MD5" not in captured.captured_queries[0]["sql"]
+
+    with django_assert_num_queries(0):
+        assert PGActivity.objects.cached().taken_at == snapshot.taken_at
+
+    # The process that took the snapshot isn't part of it
+    assert not snapshot.filter(id=pgactivity.pid())
+
+    [activity] = snapshot.filter(context__key=key)
+    assert activity.id == pid
+    assert activity.query == "SELECT 1"
+    assert activity.context == {"key": key, "n": 1}
+
+    assert snapshot.filter(context__key=key, state__in=["IDLE"], duration__gte="0s").count() == 1
+    assert snapshot.filter(id=str(pid), context__n__gt=0, query__istartswith="select")
+    assert snapshot.filter(context__contains={"key": key}).count() == 1
+    assert not snapshot.filter(context__key=key, duration__gt=dt.timedelta(days=1))
+    assert not snapshot.filter(context__key=key, duration__gt="1 minute")
+    assert snapshot.filter(context__key=key, duration__lt="1 day 2 hours").count() == 1
+    assert not snapshot.filter(context__key=key, wait_event__isnull=True)
+    assert len(snapshot.exclude(context__key=key)) == len(snapshot) - 1
+    assert list(PGActivity.objects.pid(pid).cached().values("id")) == [{"id": pid}]
+
+    ordered = snapshot.order_by("-state", "id").values("state", "id")
+    assert list(ordered) == sorted(
+        snapshot.values("state", "id"), key=lambda row: (row["state"], -row["id"]), reverse=True
+    )
+    assert ordered[:1].count() == 1
+
+    # Normalized queries and fingerprints match the ones computed in SQL
+    live = PGActivity.objects.pid(pid).get()
+    assert activity.normalized_query == live.normalized_query == "SELECT ?"
+    assert snapshot.filter(fingerprint=live.fingerprint, id=pid).count() == 1
+    assert list(snapshot.filter(id=pid).values("fingerprint")) == [
+        {"fingerprint": live.fingerprint}
+    ]
+
+    with pytest.raises(ValueError, match="Cannot filter"):
+        snapshot.filter(unknown=1)
+
+    with pytest.raises(ValueError, match="Filter the snapshot"):
+        PGActivity.objects.filter(state="ACTIVE").cached()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_cached_timeout(context_key, django_assert_num_queries):
+    PGActivity.objects.cached(timeout=0)
+
+    with django_assert_num_queries(1):
+        PGActivity.objects.cached(timeout=0)
@@ -0,0 +1,110 @@
+import datetime as dt
+
+import pytest
+from django.db import connection, connections
+
+from pgactivity import models, statements
+from pgactivity.models import PGStatement
+
+
+@pytest.fixture
+def pg_stat_statements_schema():
+    """Reset the cached pg_stat_statements schemas"""
+    models._pg_stat_statements_schemas.clear()
+    yield models._pg_stat_statements_schemas
+    models._pg_stat_statements_schemas.clear()
+
+
+@pytest.mark.django_db
+def test_statements_without_extension(pg_stat_statements_schema, django_assert_num_queries):
+    # The extension is checked by every query until it's installed
+    with django_assert_num_queries(4):
+        assert not PGStatement.objects.order_by("-total_exec_time").exists()
+        assert list(PGStatement.objects.values("id", "calls")) == []
+
+    assert pg_stat_statements_schema == {}
+    assert PGStatement.objects.snapshot().statements == {}
+
+
+@pytest.mark.django_db
+def test_statements_sql(pg_stat_statements_schema):
+    pg_stat_statements_schema["default"] = "extensions"
+
+    sql = str(PGStatement.objects.filter(calls__gt=1).query)
+    assert '"extensions".pg_stat_statements' in sql
+    assert "GROUP BY queryid" in sql
+
+
+@pytest.mark.parametrize(
+    "pg_version, total_time_col", [(130000, "total_exec_time"), (120000, "total_time")]
+)
+@pytest.mark.django_db
+def test_statements_query(pg_stat_statements_schema, mocker, pg_version, total_time_col):
+    # A table stands in for the extension, which isn't always available
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            CREATE SCHEMA pgactivity_test;
+            CREATE TABLE pgactivity_test.pg_stat_statements AS
+            SELECT
+                oid AS dbid,
+                1::bigint AS queryid,
+                'SELECT $1'::text AS query,
+                calls::bigint AS calls,
+                calls::bigint AS rows,
+                0::bigint AS shared_blks_hit,
+                0::bigint AS shared_blks_read,
+                0::bigint AS temp_blks_written,
+                10::float8 AS {total_time_col}
+            FROM pg_database, (VALUES (1), (3)) AS _calls(calls)
+            WHERE datname = current_database()
+            """
+        )
+
+    pg_stat_statements_schema["default"] = "pgactivity_test"
+    mocker.patch.object(connections["default"], "pg_version", pg_version)
+
+    # Rows of every user and nesting level are summed
+    assert list(
+        PGStatement.objects.values("id", "query", "calls", "total_exec_time", "mean_exec_time")
+    ) == [
+        {
+            "id": 1,
+            "query": "SELECT $1",
+            "calls": 4,
+            "total_exec_time": 20.0,
+            "mean_exec_time": 5.0,
+        }
+    ]
+
+
+def test_snapshot_diff():
+    def stats(calls, total_exec_time):
+        return {
+            "query": "SELECT $1",
+            "calls": calls,
+            "total_exec_time": total_exec_time,
+            "rows": calls,
+            "shared_blks_hit": 0,
+            "shared_blks_read": 0,
+            "temp_blks_written": 0,
+        }
+
+    taken_at = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    earlier = statements.Snapshot(
+        taken_at, {1: stats(10, 100.0), 2: stats(5, 5.0), 3: stats(50, 50)}
+    )
+    later = statements.Snapshot(
+        taken_at + dt.timedelta(seconds=10),
+        {1: stats(30, 300.0), 2: stats(5, 5.0), 3: stats(2, 1000.0), 4: stats(1, 1.0)},
+    )
+
+    diffs = later.diff(earlier)
+    assert [diff["id"] for diff in diffs] == [3, 1, 4]
+    assert diffs[1]["calls"] == 20
+    assert diffs[1]["calls_per_second"] == 2
+    assert diffs[1]["mean_exec_time"] == 10
+
+    # Statistics that were reset start from zero
+    assert diffs[0]["calls"] == 2
+    assert diffs[0]["total_exec_time"] == 1000
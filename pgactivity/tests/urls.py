@@ -1,6 +1,66 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
 from django import urls
 from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import connection
+from django.http import JsonResponse
+
+from pgactivity import runtime
+
+
+def _current_query():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT current_query()")
+        return cursor.fetchone()[0]
+
+
+async def _task_metadata():
+    return runtime._context.get().metadata
+
+
+async def async_context(request):
+    """Return the context seen by tasks and the SQL seen by sync code"""
+    return JsonResponse(
+        {
+            "task_metadata": await asyncio.create_task(_task_metadata()),
+            "query": await sync_to_async(_current_query)(),
+        }
+    )
+
+
+def statement_timeout(request):
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW statement_timeout")
+        return JsonResponse({"statement_timeout": cursor.fetchone()[0]})
+
+
+def usernames(request):
+    """Return usernames read with a server-side cursor"""
+    return JsonResponse({"usernames": [user.username for user in User.objects.iterator()]})
+
+
+# The errors raised by the sleep view
+sleep_errors = []
+
+
+def sleep(request):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_sleep(2)")
+    except Exception as exc:
+        sleep_errors.append(exc)
+        raise
+
+    return JsonResponse({})
+
 
 urlpatterns = [
     urls.path("admin/", admin.site.urls),
+    urls.path("async-context/", async_context),
+    urls.path("sleep/", sleep),
+    urls.path("statement-timeout/", statement_timeout, name="statement_timeout"),
+    urls.path("usernames/", usernames),
+    urls.path("pgactivity/", urls.include("pgactivity.urls")),
 ]
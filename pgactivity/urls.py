@@ -0,0 +1,8 @@
+from django.urls import path
+
+from pgactivity import views
+
+urlpatterns = [
+    path("metrics/", views.metrics, name="pgactivity_metrics"),
+    path("slow-statements/", views.slow_statements, name="pgactivity_slow_statements"),
+]
@@ -1,3 +1,8 @@
+import datetime as dt
+import functools
+import json
+import re
+
 import django
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.version import get_version_tuple
@@ -34,3 +39,76 @@ class JSONField(DjangoJSONField):
     Creates a consistent import path for JSONField regardless of Django
     version.
     """
+
+
+def load_json(value):
+    """Decode a JSON value fetched with a raw cursor.
+
+    Django loads ``jsonb`` columns as strings and decodes them in model
+    fields, so raw queries return undecoded JSON.
+    """
+    return json.loads(value) if isinstance(value, str) else value
+
+
+_interval_re = re.compile(r"^\s*(?P<value>\d+(\.\d+)?)\s*(?P<unit>ms|s|m|h|d)?\s*$")
+_interval_units = {
+    "ms": "milliseconds",
+    "s": "seconds",
+    "m": "minutes",
+    "h": "hours",
+    "d": "days",
+}
+
+
+def parse_interval(interval):
+    """Parse an interval such as "500ms", "1s", "5m", or "1h" into a timedelta.
+
+    Numbers without units and ints or floats are treated as seconds.
+    Timedeltas are returned as-is.
+    """
+    if isinstance(interval, dt.timedelta):
+        return interval
+    elif isinstance(interval, (int, float)):
+        return dt.timedelta(seconds=interval)
+
+    match = _interval_re.match(str(interval))
+    if not match:
+        raise ValueError(f'"{interval}" is not a valid interval. Use values such as "1s" or "5m".')
+
+    unit = _interval_units[match.group("unit") or "s"]
+    return dt.timedelta(**{unit: float(match.group("value"))})
+
+
+# Patterns that normalize queries into fingerprints, applied in order. Every
+# pattern is written so that it also works with Postgres regular expressions
+# once word boundaries are converted. See ``fingerprint``
+fingerprint_patterns = [
+    (r"/\*.*?\*/", " ", ""),
+    (r"--[^\n]*", " ", ""),
+    (r"'(?:[^']|'')*'", "?", ""),
+    (r"\$\d+", "?", ""),
+    (r"\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", "?", "i"),
+    (r"\b(?:TRUE|FALSE|NULL)\b", "?", "i"),
+    (r"\s+", " ", ""),
+    (r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(...)", ""),
+    (r"\[\s*\?(?:\s*,\s*\?)*\s*\]", "[...]", ""),
+    (r"(?:\(\.\.\.\)\s*,\s*)+\(\.\.\.\)", "(...)", ""),
+]
+_fingerprint_res = [
+    (re.compile(pattern, re.DOTALL | (re.IGNORECASE if "i" in flags else 0)), replacement)
+    for pattern, replacement, flags in fingerprint_patterns
+]
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(query):
+    """Normalize a query so that queries differing only in values are grouped.
+
+    Comments are removed, literals and placeholders are replaced with ``?``,
+    lists of values are collapsed, and whitespace is condensed. Matches the
+    ``normalized_query`` attribute of ``PGActivity``.
+    """
+    for pattern, replacement in _fingerprint_res:
+        query = pattern.sub(replacement, query)
+
+    return query.strip()
@@ -0,0 +1,26 @@
+from django.http import HttpResponse, JsonResponse
+
+from pgactivity import config, slow
+from pgactivity import metrics as pgactivity_metrics
+
+
+def metrics(request):
+    """Serve activity metrics in the Prometheus text format.
+
+    The view is not protected. Restrict access to it when including it
+    in a project's URLs.
+    """
+    return HttpResponse(
+        pgactivity_metrics.collect(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def slow_statements(request):
+    """Serve the slowest statements of the process as JSON.
+
+    Statements are only recorded when ``settings.PGACTIVITY_SLOW_STATEMENTS``
+    is set. Every process keeps its own statements, so the response only
+    covers the process that served the request. The view is not protected.
+    Restrict access to it when including it in a project's URLs.
+    """
+    return JsonResponse(slow.statements(), encoder=config.json_encoder(), safe=False)